@@ -0,0 +1,83 @@
+"""
+Recall and query latency of the identity lookup indexes against brute-force cosine search,
+on synthetic clustered embeddings.
+
+    python -m benchmarks.ann_recall --identities 50000 --queries 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.face_recognition.ann_index import ExactIndex, IVFIndex, create_ann_index, faiss
+
+
+def synthetic_embeddings(identities, queries, dim, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    # Identities share a few directions, like faces of similar people
+    centers = rng.standard_normal((max(1, identities // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), identities)] + rng.standard_normal((identities, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    targets = rng.integers(0, identities, queries)
+    probes = vectors[targets] + noise * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return vectors, probes
+
+
+def recall_at(results, expected, k):
+    return float(np.mean([len({id_ for id_, _ in found[:k]} & set(truth[:k])) / k for found, truth in zip(results, expected)]))
+
+
+def timed_search(index, probes, k, exact=False):
+    start = time.perf_counter()
+    results = [(index.search_exact if exact else index.search)(probe[None], k)[0] for probe in probes]
+    return results, (time.perf_counter() - start) / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--identities', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--noise', type=float, default=0.5)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    vectors, probes = synthetic_embeddings(args.identities, args.queries, args.dim, args.noise)
+    ids = [str(i) for i in range(len(vectors))]
+
+    exact = ExactIndex()
+    exact.add(ids, vectors)
+    truth, exact_latency = timed_search(exact, probes, args.k, exact=True)
+    expected = [[id_ for id_, _ in result] for result in truth]
+    print(f"{'index':<24}{'recall@1':>10}{'recall@' + str(args.k):>10}{'ms/query':>10}{'speedup':>10}")
+    print(f"{'exact':<24}{1.0:>10.3f}{1.0:>10.3f}{exact_latency * 1000:>10.3f}{1.0:>10.2f}")
+
+    candidates = []
+    ivf = IVFIndex()
+    ivf.add(ids, vectors)
+    start = time.perf_counter()
+    ivf.train()
+    print(f'ivf trained in {time.perf_counter() - start:.2f}s with {len(ivf.centroids)} clusters')
+    for nprobe in (1, 4, 8, 16, 32):
+        candidates.append((f'ivf nprobe={nprobe}', ivf, {'nprobe': nprobe}))
+    if faiss is not None:
+        hnsw = create_ann_index('hnsw')
+        hnsw.add(ids, vectors)
+        for ef_search in (16, 64, 256):
+            candidates.append((f'hnsw ef_search={ef_search}', hnsw, {'ef_search': ef_search}))
+    else:
+        print('faiss is not installed, skipping hnsw')
+
+    for name, index, params in candidates:
+        for key, value in params.items():
+            setattr(index, key, value)
+        if 'ef_search' in params:
+            index._index.hnsw.efSearch = params['ef_search']
+        results, latency = timed_search(index, probes, args.k)
+        print(f"{name:<24}{recall_at(results, expected, 1):>10.3f}{recall_at(results, expected, args.k):>10.3f}"
+              f"{latency * 1000:>10.3f}{exact_latency / latency:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
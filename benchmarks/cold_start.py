@@ -0,0 +1,76 @@
+"""
+Cold-start-to-first-authentication time of a fresh process: imports, model loading, warm-up and the first two
+authentications of a synthetic frame. Every run starts a new interpreter so no import or weight is cached in memory.
+
+    python -m benchmarks.cold_start --runs 3
+    python -m benchmarks.cold_start --artifact weights/inception.pt --no-warmup
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def child(args) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    import numpy as np
+    import tempfile
+
+    from config import mtcnn_params
+    from src.authenticator import FaceAuthenticator
+    from src.face_detection.image import Frame
+    from src.face_detection.mtcnn_model import MTCNNModel
+    from src.face_recognition.authorization_database import AuthorizationDatabase
+    from src.face_recognition.inception_model import InceptionModel
+    timings['import_ms'] = (time.perf_counter() - start) * 1000
+
+    mark = time.perf_counter()
+    detection_model = MTCNNModel(mtcnn_params, weights_dir=args.weights_dir)
+    embedding_model = InceptionModel(pretrained=None if args.random_weights else 'vggface2', weights_dir=args.weights_dir,
+                                     artifact=args.artifact)
+    timings['load_ms'] = (time.perf_counter() - mark) * 1000
+
+    mark = time.perf_counter()
+    if args.warmup:
+        detection_model.run_warmup()
+        embedding_model.warmup()
+    timings['warmup_ms'] = (time.perf_counter() - mark) * 1000
+
+    frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as rooms_path:
+        authenticator = FaceAuthenticator(detection_model, embedding_model, AuthorizationDatabase(room_path=rooms_path))
+        for name in ('first_authentication_ms', 'second_authentication_ms'):
+            mark = time.perf_counter()
+            authenticator.authenticate(Frame(frame), 'room')
+            timings[name] = (time.perf_counter() - mark) * 1000
+    timings['total_ms'] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--weights-dir', default=None)
+    parser.add_argument('--artifact', default=None, help='TorchScript engine saved with src.weights export')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    parser.add_argument('--random-weights', action='store_true', help='Skip loading the pretrained InceptionResnetV1 weights')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args)))
+        return
+
+    command = [sys.executable, '-m', 'benchmarks.cold_start', '--child'] + sys.argv[1:]
+    for run in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        wall = (time.perf_counter() - start) * 1000
+        timings = json.loads(output.strip().splitlines()[-1])
+        print(f'run {run}: process {wall:.0f}ms ' + ' '.join(f'{name}={value:.0f}' for name, value in timings.items()))
+
+
+if __name__ == '__main__':
+    main()
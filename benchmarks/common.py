@@ -0,0 +1,52 @@
+import time
+from glob import glob
+from typing import Callable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def load_images(pattern: Optional[str], count: int, size=(640, 480), seed: int = 0) -> List[Image.Image]:
+    """
+    Loads up to count RGB images matching the glob pattern, or creates count random images of the given (width, height)
+    """
+    if pattern:
+        return [Image.open(path).convert('RGB') for path in sorted(glob(pattern))[:count]]
+    rng = np.random.default_rng(seed)
+    width, height = size
+    return [Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def random_embeddings(count: int, dim: int = 512, seed: int = 0) -> np.ndarray:
+    """
+    Creates count random L2-normalized float32 embeddings
+    """
+    embeddings = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def measure(fn: Callable[[], object], repeats: int = 20, warmup: int = 2) -> dict:
+    """
+    Calls fn warmup times, then times repeats calls
+
+    Returns
+    -------
+    dict
+        Mean, median, 90th percentile, minimum and maximum latency in milliseconds
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        'repeats': repeats,
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'min_ms': float(latencies.min()),
+        'max_ms': float(latencies.max()),
+    }
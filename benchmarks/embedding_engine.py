@@ -0,0 +1,64 @@
+"""
+Per-face embedding latency and accuracy of the InceptionModel engine options against the fp32 eager baseline.
+
+    python -m benchmarks.embedding_engine --images "faces/*.jpg" --batch-size 8
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.common import load_images
+from src.face_recognition.inception_model import InceptionModel
+
+ENGINES = {
+    'fp32': {},
+    'fp32-channels-last': {'channels_last': True},
+    'fp32-torchscript': {'compile_mode': 'torchscript'},
+    'int8': {'precision': 'int8'},
+    'int8-torchscript': {'precision': 'int8', 'compile_mode': 'torchscript'},
+    'bf16': {'precision': 'bf16'},
+}
+
+
+def per_face_latency(model, faces, batch_size, repeats):
+    model.get_embeddings(faces[:batch_size])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(faces), batch_size):
+            model.get_embeddings(faces[i:i + batch_size])
+    return (time.perf_counter() - start) / (repeats * len(faces))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Glob of face crops. Random images are used if not given.')
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    faces = load_images(args.images, args.count, size=(160, 160))
+    baseline = InceptionModel(device='cpu')
+    baseline_latency = per_face_latency(baseline, faces, args.batch_size, args.repeats)
+
+    print(f"{'engine':<20}{'ms/face':>10}{'speedup':>10}{'mean cos':>10}{'min cos':>10}")
+    for name, options in ENGINES.items():
+        try:
+            # The int8 engines are calibrated on the measured faces
+            calibration = {'calibration_images': faces} if options.get('precision') == 'int8' else {}
+            model = baseline if not options else InceptionModel(device='cpu', **options, **calibration)
+            latency = per_face_latency(model, faces, args.batch_size, args.repeats) if options else baseline_latency
+            accuracy = model.compare_to_baseline(faces, baseline=baseline)
+        except (RuntimeError, ValueError) as e:
+            print(f'{name:<20}unavailable: {e}')
+            continue
+        print(f"{name:<20}{latency * 1000:>10.2f}{baseline_latency / latency:>10.2f}"
+              f"{accuracy['mean_cosine_similarity']:>10.4f}{accuracy['min_cosine_similarity']:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Synthetic load generator for the authentication service. Keeps a number of concurrent door cameras
+posting frames for a fixed duration and reports throughput and client side latency percentiles.
+
+    python -m src.service.server --port 8000 &
+    python -m benchmarks.load_generator --room FENS1017 --clients 16 --duration 30
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_jpeg(path=None, width=640, height=480):
+    image = Image.open(path).convert('RGB') if path else Image.fromarray(
+        np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = (await reader.readline()).strip()
+        if not line:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def camera(host, port, room, frame, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    request = (f'POST /authenticate?room={room} HTTP/1.1\r\nHost: {host}\r\nContent-Type: image/jpeg\r\n'
+               f'Content-Length: {len(frame)}\r\n\r\n').encode('latin-1') + frame
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, _ = await read_response(reader)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    frame = synthetic_jpeg(args.image)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(camera(args.host, args.port, args.room, frame, start + args.duration, latencies, errors)
+                           for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    writer.write(f'GET /metrics HTTP/1.1\r\nHost: {args.host}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    _, server_metrics = await read_response(reader)
+    writer.close()
+
+    print(f'{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.2f} req/s), {len(errors)} errors')
+    if latencies:
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f'client latency p50={p50:.1f}ms p99={p99:.1f}ms')
+    print(f'server metrics: {server_metrics}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--room', required=True)
+    parser.add_argument('--image', help='Frame to send. A random 640x480 frame is used if not given.')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Frames per second of the authentication of a frame stream when it is sharded across 1 to N worker processes,
+compared with a single process using all intra-op threads.
+
+    python -m benchmarks.process_scaling --max-workers 8 --threads-per-worker 1
+    python -m benchmarks.process_scaling --images "frames/*.jpg" --count 64
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import load_images
+from config import inception_params, mtcnn_params
+from src.face_recognition.authorization_database import AuthorizationDatabase
+
+
+def single_process(frames, rooms_path, threads):
+    import torch
+
+    from src.authenticator import FaceAuthenticator
+    from src.face_detection.image import Frame
+    from src.face_detection.mtcnn_model import MTCNNModel
+    from src.face_recognition.inception_model import InceptionModel
+
+    torch.set_num_threads(threads)
+    authenticator = FaceAuthenticator(MTCNNModel(mtcnn_params), InceptionModel(**{**inception_params, 'pretrained': None}),
+                                      AuthorizationDatabase(room_path=rooms_path))
+    authenticator.authenticate(Frame(frames[0]), 'room')
+    start = time.perf_counter()
+    for frame in frames:
+        authenticator.authenticate(Frame(frame), 'room')
+    return len(frames) / (time.perf_counter() - start)
+
+
+def sharded(frames, rooms_path, workers, threads_per_worker):
+    from src.runtime.process_pool import ShardedAuthenticator
+
+    with ShardedAuthenticator(mtcnn_params, {**inception_params, 'pretrained': None}, AuthorizationDatabase(room_path=rooms_path),
+                              workers=workers, threads_per_worker=threads_per_worker,
+                              max_frame_shape=frames[0].shape) as authenticator:
+        # The worker processes are started and load their models on the first frames
+        list(authenticator.imap(frames[:2 * workers], 'room'))
+        start = time.perf_counter()
+        for _ in authenticator.imap(frames, 'room'):
+            pass
+        return len(frames) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Glob of camera frames. Random 640x480 frames are used if not given.')
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    args = parser.parse_args()
+
+    frames = [np.asarray(image) for image in load_images(args.images, args.count)]
+    if len({frame.shape for frame in frames}) > 1:
+        parser.error('All frames must have the same size')
+
+    with tempfile.TemporaryDirectory() as rooms_path:
+        baseline = single_process(frames, rooms_path, os.cpu_count())
+        print(f'single process, {os.cpu_count()} threads: {baseline:.1f} frames/s')
+        for workers in range(1, args.max_workers + 1):
+            fps = sharded(frames, rooms_path, workers, args.threads_per_worker)
+            print(f'{workers} workers x {args.threads_per_worker} threads: {fps:.1f} frames/s ({fps / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
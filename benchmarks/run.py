@@ -0,0 +1,171 @@
+"""
+Benchmark suite of the detection and recognition hot paths. Runs offline on CPU with synthetic
+frames and random model weights by default, and writes the results as JSON so that runs on
+different commits can be compared.
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --only authorize --compare bench.json
+
+Random frames contain no faces, so detection only measures the MTCNN cascade. Pass --images with real
+photos to also cover cropping, and --pretrained to use the downloaded InceptionResnetV1 weights.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+import torch
+
+from benchmarks.common import load_images, measure, random_embeddings
+from config import mtcnn_params
+from src.authenticator import FaceAuthenticator
+from src.face_detection.image import Frame
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.face_recognition.authorization_database import AuthorizationDatabase
+from src.face_recognition.inception_model import InceptionModel
+from src.face_recognition.room_storage import RoomStorage
+
+ROOM_SIZES = (10, 1000, 100000)
+
+
+def bench_frame(images, repeats):
+    return {'frame_construction': measure(lambda: Frame(images[0]), repeats=repeats * 10)}
+
+
+def bench_detection(images, repeats):
+    model = MTCNNModel(mtcnn_params)
+    frames = [Frame(image) for image in images]
+    frame = iter(frames * (repeats + 2))
+    return {
+        'mtcnn_detect': measure(lambda: model.detect(next(frame)), repeats=repeats),
+        f'mtcnn_detect_faces_batch_{len(frames)}': measure(lambda: model.detect_faces_batch(frames), repeats=max(1, repeats // 4)),
+    }
+
+
+def bench_embedding(images, repeats, pretrained):
+    model = InceptionModel(pretrained='vggface2' if pretrained else None)
+    faces = [image.resize((160, 160)) for image in images]
+    results = {'inception_get_embedding': measure(lambda: model.get_embedding(faces[0]), repeats=repeats)}
+    for batch_size in (8, 32):
+        batch = (faces * batch_size)[:batch_size]
+        results[f'inception_get_embeddings_batch_{batch_size}'] = measure(lambda: model.get_embeddings(batch), repeats=max(1, repeats // 4))
+    return results
+
+
+def bench_authorize(repeats, room_sizes):
+    results = {}
+    query = torch.from_numpy(random_embeddings(1, seed=1))
+    with tempfile.TemporaryDirectory() as rooms_path:
+        for size in room_sizes:
+            room_name = f'room{size}'
+            RoomStorage(os.path.join(rooms_path, room_name)).write([f'user{i}' for i in range(size)], random_embeddings(size))
+
+            def cold():
+                AuthorizationDatabase(room_path=rooms_path).authorize_user(room_name, query)
+
+            database = AuthorizationDatabase(room_path=rooms_path)
+            results[f'authorize_user_{size}_cold'] = measure(cold, repeats=max(1, repeats // 4), warmup=1)
+            results[f'authorize_user_{size}_warm'] = measure(lambda: database.authorize_user(room_name, query), repeats=repeats * 5)
+    return results
+
+
+def bench_visualize(images, repeats):
+    frame = Frame(images[0])
+    frame.update_face_bbox_location(100, 100, 260, 300)
+    return {
+        'frame_visualize': measure(lambda: frame.visualize(return_image=True), repeats=repeats * 5),
+        'frame_visualize_text': measure(lambda: frame.visualize(return_image=True, text='user'), repeats=repeats * 5),
+    }
+
+
+def bench_end_to_end(images, repeats, pretrained):
+    with tempfile.TemporaryDirectory() as rooms_path:
+        RoomStorage(os.path.join(rooms_path, 'room')).write([f'user{i}' for i in range(1000)], random_embeddings(1000))
+        authenticator = FaceAuthenticator(MTCNNModel(mtcnn_params), InceptionModel(pretrained='vggface2' if pretrained else None),
+                                          AuthorizationDatabase(room_path=rooms_path))
+        frame = iter(images * (repeats + 2))
+        return {'end_to_end_authenticate': measure(lambda: authenticator.authenticate(Frame(next(frame)), 'room'), repeats=repeats)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    print(f"\n{'benchmark':<40}{'baseline ms':>14}{'current ms':>14}{'ratio':>8}")
+    for name, stats in results.items():
+        if name in baseline:
+            before, after = baseline[name]['p50_ms'], stats['p50_ms']
+            print(f"{name:<40}{before:>14.3f}{after:>14.3f}{after / before:>8.2f}")
+
+
+def main():
+    benchmarks = ('frame', 'detection', 'embedding', 'authorize', 'visualize', 'end_to_end')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=benchmarks, default=benchmarks)
+    parser.add_argument('--images', help='Glob of camera frames. Random 640x480 frames are used if not given.')
+    parser.add_argument('--count', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--room-sizes', type=int, nargs='+', default=ROOM_SIZES)
+    parser.add_argument('--pretrained', action='store_true', help='Use the pretrained InceptionResnetV1 weights')
+    parser.add_argument('--threads', type=int, default=None, help='Number of torch intra-op threads')
+    parser.add_argument('--output', help='Path of the JSON results')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    images = load_images(args.images, args.count)
+
+    results = {}
+    for name in args.only:
+        print(f'Running {name} benchmarks...')
+        if name == 'frame':
+            results.update(bench_frame(images, args.repeats))
+        elif name == 'detection':
+            results.update(bench_detection(images, args.repeats))
+        elif name == 'embedding':
+            results.update(bench_embedding(images, args.repeats, args.pretrained))
+        elif name == 'authorize':
+            results.update(bench_authorize(args.repeats, args.room_sizes))
+        elif name == 'visualize':
+            results.update(bench_visualize(images, args.repeats))
+        elif name == 'end_to_end':
+            results.update(bench_end_to_end(images, args.repeats, args.pretrained))
+
+    for name, stats in results.items():
+        print(f"{name:<40}p50={stats['p50_ms']:>10.3f}ms  mean={stats['mean_ms']:>10.3f}ms")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'images': args.images or 'synthetic',
+            'pretrained': args.pretrained,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results are written to {args.output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
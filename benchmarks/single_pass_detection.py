@@ -0,0 +1,52 @@
+"""
+Frames per second of the authentication loop detection step, calling MTCNN twice per frame
+(overlay frame and face crop) versus reusing one DetectionResult for both.
+
+    python -m benchmarks.single_pass_detection --images "frames/*.jpg"
+"""
+import argparse
+import time
+
+from benchmarks.common import load_images
+from config import mtcnn_params
+from src import Frame, MTCNNModel
+
+
+def two_pass(model, image):
+    frame = Frame(image)
+    screen_img = model.detect(frame, return_frame=True)
+    face_img = model.detect(frame)
+    return screen_img, face_img
+
+
+def single_pass(model, image):
+    detections = model.detect_faces(Frame(image))
+    return detections.update_frame(), detections.face
+
+
+def frames_per_second(step, model, images, repeats):
+    step(model, images[0])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for image in images:
+            step(model, image)
+    return repeats * len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Glob of camera frames. Random 640x480 frames are used if not given.')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    model = MTCNNModel(mtcnn_params)
+    images = load_images(args.images, args.count)
+    before = frames_per_second(two_pass, model, images, args.repeats)
+    after = frames_per_second(single_pass, model, images, args.repeats)
+    print(f'two MTCNN passes per frame: {before:.2f} FPS')
+    print(f'single MTCNN pass per frame: {after:.2f} FPS ({after / before:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
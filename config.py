@@ -9,4 +9,42 @@ mtcnn_params = {
     "selection_method": None,
     "keep_all": False,
     "device": None
-}
\ No newline at end of file
+}
+
+detection_frontend_params = {
+    "motion_threshold": 2.0,
+    "motion_size": 64,
+    "detection_scale": 0.5,
+    "target_latency": 0.05,
+    "max_stride": 4
+}
+
+inception_params = {
+    "precision": "fp32",
+    "channels_last": False,
+    "compile_mode": None,
+    "artifact": None,
+    "allow_download": False,
+    "calibration_images": None
+}
+
+startup_params = {
+    "weights_dir": None,
+    "warmup": True
+}
+
+tracker_params = {
+    "iou_threshold": 0.3,
+    "max_centroid_distance": 0.5,
+    "max_missed": 5,
+    "recheck_interval": 30,
+    "confidence_decay": 0.97,
+    "min_confidence": 0.5
+}
+
+database_params = {
+    "max_templates": 10,
+    "template_recheck_k": 3,
+    "update_threshold": None,
+    "template_redundancy": 0.97
+}
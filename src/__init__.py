@@ -1,2 +1,9 @@
-from .face_detection.image import Frame
-from .face_detection.mtcnn_model import MTCNNModel
\ No newline at end of file
+def __getattr__(name):
+    # Importing a submodule of src must not import torch and facenet_pytorch
+    if name == 'Frame':
+        from .face_detection.image import Frame
+        return Frame
+    if name == 'MTCNNModel':
+        from .face_detection.mtcnn_model import MTCNNModel
+        return MTCNNModel
+    raise AttributeError(f"module 'src' has no attribute '{name}'")
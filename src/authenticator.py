@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional
+
+from src.face_detection.detection_result import DetectionResult
+from src.face_detection.face_tracker import FaceTracker, Track
+from src.face_detection.image import Frame
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.face_recognition.authorization_database import AuthorizationDatabase
+from src.face_recognition.inception_model import InceptionModel
+
+
+class FaceMatch(NamedTuple):
+    """
+    Authentication result of a single face in a frame
+
+    Attributes
+    ----------
+    bbox: list
+        Face bounding box coordinates [x1, y1, x2, y2]
+    user_id: Optional[str]
+        ID of the authorized user, None if the face is not authorized
+    score: Optional[float]
+        Similarity to the most similar authorized user, None if the room has no users
+    track_id: Optional[int]
+        ID of the face track, None if the faces are not tracked
+    recognized: bool
+        True if the face was recognized in this frame, False if the identity is cached from its track
+    """
+    bbox: list
+    user_id: Optional[str]
+    score: Optional[float]
+    track_id: Optional[int] = None
+    recognized: bool = True
+
+
+@dataclass
+class FaceAuthenticator:
+    """
+    Authenticates every face in a frame with one batched embedding forward pass and one matrix match
+
+    Attributes
+    ----------
+    detection_model: MTCNNModel
+        Model to detect faces
+    embedding_model: InceptionModel
+        Model to extract face embeddings
+    database: AuthorizationDatabase
+        Database of the authorized users
+    threshold: float
+        Similarity threshold for authorization
+    tracker: Optional[FaceTracker]
+        Tracker to reuse the identity of faces seen in previous frames. Only one room should be authenticated per tracker.
+    """
+    detection_model: MTCNNModel
+    embedding_model: InceptionModel
+    database: AuthorizationDatabase
+    threshold: float = 0.7
+    tracker: Optional[FaceTracker] = None
+
+    def authenticate(self, image: Frame, room_name: str) -> List[FaceMatch]:
+        """
+        Detects all faces in the image and authorizes them for the given room
+
+        Parameters
+        ----------
+        image: src.face_detection.image.Frame
+            Image to authenticate faces in
+        room_name: str
+            The name of the room for authorization
+
+        Returns
+        -------
+        List[FaceMatch]
+            Bounding box, authorized user ID and similarity score of every detected face
+        """
+        return self.authenticate_detections(self.detection_model.detect_faces(image), room_name)
+
+    def authenticate_batch(self, images: List[Frame], room_names: List[str]) -> List[List[FaceMatch]]:
+        """
+        Authenticates the faces of several frames, possibly for different rooms, with one batched detection,
+        one embedding forward pass and one matrix match per room. The tracker is not used.
+
+        Parameters
+        ----------
+        images: List[src.face_detection.image.Frame]
+            Images to authenticate faces in
+        room_names: List[str]
+            The name of the room for authorization of every image
+
+        Returns
+        -------
+        List[List[FaceMatch]]
+            The matches of every image, in the same order as the images
+        """
+        detections = self.detection_model.detect_faces_batch(images)
+        owners = [(i, bbox) for i, result in enumerate(detections) for bbox in result.boxes]
+        matches: List[List[FaceMatch]] = [[] for _ in images]
+        if not owners:
+            return matches
+
+        embeddings = self.embedding_model.get_embeddings([view for result in detections for view in result.views])
+        by_room: Dict[str, List[int]] = {}
+        for face, (i, _) in enumerate(owners):
+            by_room.setdefault(room_names[i], []).append(face)
+        for room_name, faces in by_room.items():
+            results = self.database.authorize_users(room_name, embeddings[faces], threshold=self.threshold)
+            for face, (_, user_id, score) in zip(faces, results):
+                i, bbox = owners[face]
+                matches[i].append(FaceMatch(bbox, user_id, score))
+        return matches
+
+    def authenticate_detections(self, detections: DetectionResult, room_name: str) -> List[FaceMatch]:
+        """
+        Authorizes already detected faces for the given room
+
+        Parameters
+        ----------
+        detections: DetectionResult
+            Faces detected in a frame
+        room_name: str
+            The name of the room for authorization
+
+        Returns
+        -------
+        List[FaceMatch]
+            Bounding box, authorized user ID and similarity score of every detected face
+        """
+        if self.tracker is None:
+            if not detections:
+                return []
+            embeddings = self.embedding_model.get_embeddings(detections.views)
+            results = self.database.authorize_users(room_name, embeddings, threshold=self.threshold)
+            return [FaceMatch(bbox, user_id, score) for bbox, (_, user_id, score) in zip(detections.boxes, results)]
+
+        tracks = self.tracker.update(detections.boxes)
+        selected = self.tracker.select_for_recognition(tracks)
+        if selected:
+            embeddings = self.embedding_model.get_embeddings([detections.views[i] for i in selected])
+            results = self.database.authorize_users(room_name, embeddings, threshold=self.threshold)
+            for i, (_, user_id, score) in zip(selected, results):
+                self.tracker.record_identity(tracks[i], user_id, score)
+        return tracked_matches(tracks, selected)
+
+
+def tracked_matches(tracks: List[Track], recognized: List[int]) -> List[FaceMatch]:
+    """
+    Builds the matches of tracked faces from the identities cached in their tracks
+
+    Parameters
+    ----------
+    tracks: List[Track]
+        Tracks of the faces of a frame
+    recognized: List[int]
+        Indices of the tracks recognized in this frame
+
+    Returns
+    -------
+    List[FaceMatch]
+        Bounding box, cached user ID and score of every tracked face
+    """
+    return [FaceMatch(track.bbox, track.user_id, track.score, track.track_id, i in recognized)
+            for i, track in enumerate(tracks)]
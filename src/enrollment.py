@@ -0,0 +1,201 @@
+"""
+Bulk enrollment of users from a directory tree of photos laid out as <root>/<room>/<user>/*.jpg
+
+    python -m src.enrollment photos --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image, UnidentifiedImageError
+
+from src.face_detection.image import Frame
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.face_recognition.authorization_database import AuthorizationDatabase
+from src.face_recognition.inception_model import InceptionModel
+from src.face_recognition.room_storage import prepare_embeddings
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+_detection_model = None
+_embedding_model = None
+
+
+@dataclass
+class EnrollmentResult:
+    """
+    Templates of a single user computed from their photos
+
+    Attributes
+    ----------
+    room_name: str
+        The name of the room the user is enrolled to
+    user_id: str
+        The unique identifier for the user
+    embeddings: Optional[np.ndarray]
+        Normalized embedding of every face, stored as the templates of the user. None if no face is found in any photo.
+    used_images: int
+        Number of photos a face is found in
+    skipped_images: List[str]
+        Paths of the photos that cannot be read or contain no face
+    """
+    room_name: str
+    user_id: str
+    embeddings: Optional[np.ndarray] = None
+    used_images: int = 0
+    skipped_images: List[str] = field(default_factory=list)
+
+
+def normalize_user_id(user_id: str) -> str:
+    return user_id.replace('_', '').replace(' ', '')
+
+
+def find_enrollment_images(root: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Lists the photos of every user of every room under root
+
+    Returns
+    -------
+    Dict[str, Dict[str, List[str]]]
+        Photo paths by room name and user id
+    """
+    rooms = {}
+    for room_name in sorted(os.listdir(root)):
+        room_dir = os.path.join(root, room_name)
+        if not os.path.isdir(room_dir):
+            continue
+        for user_name in sorted(os.listdir(room_dir)):
+            user_dir = os.path.join(room_dir, user_name)
+            if not os.path.isdir(user_dir):
+                continue
+            paths = [os.path.join(user_dir, filename) for filename in sorted(os.listdir(user_dir))
+                     if filename.lower().endswith(IMAGE_EXTENSIONS)]
+            if paths:
+                rooms.setdefault(room_name, {})[normalize_user_id(user_name)] = paths
+    return rooms
+
+
+def _init_worker(mtcnn_kwargs: dict, inception_kwargs: dict, threads: int, weights_dir: Optional[str] = None) -> None:
+    global _detection_model, _embedding_model
+    torch.set_num_threads(threads)
+    _detection_model = MTCNNModel(mtcnn_kwargs, weights_dir=weights_dir)
+    _embedding_model = InceptionModel(**inception_kwargs, weights_dir=weights_dir)
+
+
+def enroll_user(room_name: str, user_id: str, paths: List[str], batch_size: int = 16) -> EnrollmentResult:
+    """
+    Detects the faces of the photos of a user in batches, one MTCNN pass per batch of photos of the same size,
+    and embeds the first face of every photo into the templates of the user.
+    Runs in a worker process initialized with _init_worker.
+    """
+    result = EnrollmentResult(room_name, user_id)
+    embeddings = []
+    for start in range(0, len(paths), batch_size):
+        frames, readable = [], []
+        for path in paths[start:start + batch_size]:
+            try:
+                frames.append(Frame(Image.open(path).convert('RGB')))
+                readable.append(path)
+            except (OSError, UnidentifiedImageError):
+                result.skipped_images.append(path)
+        faces = []
+        for path, detections in zip(readable, _detection_model.detect_faces_batch(frames) if frames else []):
+            if len(detections):
+                faces.append(detections.views[0])
+            else:
+                result.skipped_images.append(path)
+        if faces:
+            embeddings.append(_embedding_model.get_embeddings(faces))
+
+    if embeddings:
+        result.embeddings = prepare_embeddings(torch.cat(embeddings))
+        result.used_images = len(result.embeddings)
+    return result
+
+
+def enroll(root: str, database: AuthorizationDatabase, mtcnn_kwargs: dict, inception_kwargs: dict,
+           workers: int = 1, threads_per_worker: int = 1, batch_size: int = 16, replace: bool = False,
+           weights_dir: Optional[str] = None) -> List[EnrollmentResult]:
+    """
+    Enrolls every user under root to their room, writing each room to the database in a single transaction
+
+    Parameters
+    ----------
+    root: str
+        Directory laid out as <root>/<room>/<user>/*.jpg
+    database: AuthorizationDatabase
+        Database the users are added to
+    mtcnn_kwargs: dict
+        Keyword arguments of MTCNN, see config.mtcnn_params
+    inception_kwargs: dict
+        Keyword arguments of InceptionModel, see config.inception_params
+    workers: int
+        Number of worker processes
+    threads_per_worker: int
+        Number of torch intra-op threads of every worker
+    batch_size: int
+        Number of photos detected and embedded in one pass
+    replace: bool
+        Whether to replace the embeddings of already enrolled users
+    weights_dir: Optional[str]
+        Directory of the local weight cache, see src.weights
+
+    Returns
+    -------
+    List[EnrollmentResult]
+        The enrollment result of every user
+    """
+    rooms = find_enrollment_images(root)
+    tasks = [(room_name, user_id, paths) for room_name, users in rooms.items() for user_id, paths in users.items()]
+    # Workers are spawned, forking a process with initialized torch thread pools can dead-lock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                             initargs=(mtcnn_kwargs, inception_kwargs, threads_per_worker, weights_dir)) as executor:
+        futures = [executor.submit(enroll_user, room_name, user_id, paths, batch_size) for room_name, user_id, paths in tasks]
+        results = [future.result() for future in futures]
+
+    for room_name in rooms:
+        enrolled = [result for result in results if result.room_name == room_name and result.embeddings is not None]
+        if enrolled:
+            database.add_users(room_name, [result.user_id for result in enrolled], replace=replace,
+                               templates=[result.embeddings for result in enrolled])
+    return results
+
+
+def main():
+    from config import mtcnn_params, inception_params, database_params, startup_params
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='Directory laid out as <root>/<room>/<user>/*.jpg')
+    parser.add_argument('--rooms-path', default='rooms')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--replace', action='store_true', help='Replace already enrolled users')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = enroll(args.root, AuthorizationDatabase(room_path=args.rooms_path, **database_params), mtcnn_params, inception_params,
+                     workers=args.workers, threads_per_worker=args.threads_per_worker,
+                     batch_size=args.batch_size, replace=args.replace, weights_dir=startup_params['weights_dir'])
+    elapsed = time.perf_counter() - start
+
+    images = sum(result.used_images + len(result.skipped_images) for result in results)
+    skipped = [path for result in results for path in result.skipped_images]
+    failed = [f'{result.room_name}/{result.user_id}' for result in results if result.embeddings is None]
+    print(f'{len(results) - len(failed)} users enrolled from {images} images in {elapsed:.2f}s ({images / max(elapsed, 1e-9):.2f} images/s)')
+    if skipped:
+        print(f'{len(skipped)} images skipped (unreadable or no face):')
+        for path in skipped:
+            print(f'  {path}')
+    if failed:
+        print(f'{len(failed)} users not enrolled, no face found: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
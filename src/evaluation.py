@@ -0,0 +1,333 @@
+"""
+Threshold calibration on a labeled face dataset laid out as <root>/<room>/<user>/*.jpg, or <root>/<user>/*.jpg for a single room.
+
+Every photo is embedded once, in batches by a pool of worker processes, and the embedding matrix is cached.
+The cosine scores of all genuine (same user) and impostor (different users) pairs of a room are computed in
+blocks of matrix products and accumulated into score histograms, so millions of pairs are scored in seconds.
+The report contains the equal error rate, the threshold for a target false accept rate of every room, and the
+ROC/DET curves.
+
+    python -m src.evaluation photos --cache photos.npz --output report.json --curves curves.csv --target-far 0.001
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.enrollment import IMAGE_EXTENSIONS, _init_worker, enroll_user, find_enrollment_images, normalize_user_id
+
+SCORE_BINS = 4001
+CURRENT_THRESHOLD = 0.7
+
+
+@dataclass
+class EmbeddedDataset:
+    """
+    Embeddings of the faces of a labeled dataset
+
+    Attributes
+    ----------
+    embeddings: np.ndarray
+        Normalized embedding of every face with shape (number of faces, embedding size)
+    labels: np.ndarray
+        User id of every face
+    rooms: np.ndarray
+        Room name of every face
+    paths: np.ndarray
+        Photo path of every face
+    """
+    embeddings: np.ndarray
+    labels: np.ndarray
+    rooms: np.ndarray
+    paths: np.ndarray
+
+    def save(self, path: str, key: str) -> None:
+        with open(path, 'wb') as f:
+            np.savez(f, embeddings=self.embeddings, labels=self.labels, rooms=self.rooms, paths=self.paths, key=np.array(key))
+
+    @classmethod
+    def load(cls, path: str, key: str) -> Optional['EmbeddedDataset']:
+        """
+        Loads a cached dataset, None if the cache does not exist or was computed from other photos or models
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data['key']) != key:
+                return None
+            return cls(data['embeddings'], data['labels'], data['rooms'], data['paths'])
+
+
+def find_evaluation_images(root: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Lists the photos of every user of every room under root. A root whose user directories directly
+    contain photos is a single room named after the root directory.
+
+    Returns
+    -------
+    Dict[str, Dict[str, List[str]]]
+        Photo paths by room name and user id
+    """
+    rooms = find_enrollment_images(root)
+    if rooms:
+        return rooms
+    users = {}
+    for user_name in sorted(os.listdir(root)):
+        user_dir = os.path.join(root, user_name)
+        if os.path.isdir(user_dir):
+            paths = [os.path.join(user_dir, filename) for filename in sorted(os.listdir(user_dir))
+                     if filename.lower().endswith(IMAGE_EXTENSIONS)]
+            if paths:
+                users[normalize_user_id(user_name)] = paths
+    return {os.path.basename(os.path.abspath(root)): users} if users else {}
+
+
+def dataset_key(rooms: Dict[str, Dict[str, List[str]]], mtcnn_kwargs: dict, inception_kwargs: dict) -> str:
+    """
+    Hash of the photo paths, sizes and modification times and of the model parameters
+    """
+    digest = hashlib.sha1(json.dumps([mtcnn_kwargs, inception_kwargs], sort_keys=True, default=str).encode())
+    for room_name, users in sorted(rooms.items()):
+        for user_id, paths in sorted(users.items()):
+            for path in paths:
+                stat = os.stat(path)
+                digest.update(f'{room_name}\0{user_id}\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def embed_dataset(rooms: Dict[str, Dict[str, List[str]]], mtcnn_kwargs: dict, inception_kwargs: dict, workers: int = 1,
+                  threads_per_worker: int = 1, batch_size: int = 16, weights_dir: Optional[str] = None) -> EmbeddedDataset:
+    """
+    Detects the first face of every photo and embeds the faces of every user in batches, with one task per user
+
+    Returns
+    -------
+    EmbeddedDataset
+        The embedding of every photo a face is found in
+    """
+    tasks = [(room_name, user_id, paths) for room_name, users in rooms.items() for user_id, paths in users.items()]
+    # Workers are spawned, forking a process with initialized torch thread pools can dead-lock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                             initargs=(mtcnn_kwargs, inception_kwargs, threads_per_worker, weights_dir)) as executor:
+        futures = [executor.submit(enroll_user, room_name, user_id, paths, batch_size) for room_name, user_id, paths in tasks]
+        results = [future.result() for future in futures]
+
+    embeddings, labels, room_names, paths = [], [], [], []
+    for (_, _, user_paths), result in zip(tasks, results):
+        if result.embeddings is None:
+            continue
+        skipped = set(result.skipped_images)
+        embeddings.append(result.embeddings)
+        labels += [result.user_id] * len(result.embeddings)
+        room_names += [result.room_name] * len(result.embeddings)
+        paths += [path for path in user_paths if path not in skipped]
+    if not embeddings:
+        raise ValueError('No face is found in any photo')
+    return EmbeddedDataset(np.concatenate(embeddings).astype(np.float32), np.array(labels), np.array(room_names), np.array(paths))
+
+
+def score_histograms(embeddings: np.ndarray, labels: np.ndarray, block_size: int = 1024,
+                     max_block_elements: int = 2 ** 23) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Accumulates the cosine scores of all pairs of distinct faces into histograms of SCORE_BINS bins over [-1, 1]
+
+    Parameters
+    ----------
+    embeddings: np.ndarray
+        Normalized embeddings with shape (number of faces, embedding size)
+    labels: np.ndarray
+        Identity of every face
+    block_size: int
+        Number of rows of the score matrix computed at once
+    max_block_elements: int
+        Maximum number of scores computed at once, which lowers the number of rows for large datasets
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Number of genuine and of impostor pairs in every score bin
+    """
+    _, ids = np.unique(labels, return_inverse=True)
+    genuine = np.zeros(SCORE_BINS, dtype=np.int64)
+    impostor = np.zeros(SCORE_BINS, dtype=np.int64)
+    block_size = max(1, min(block_size, max_block_elements // max(len(embeddings), 1)))
+    for start in range(0, len(embeddings) - 1, block_size):
+        stop = min(start + block_size, len(embeddings))
+        # Only the pairs (i, j) with i < j, every pair is scored once
+        scores = embeddings[start:stop] @ embeddings[start + 1:].T
+        upper = np.arange(start + 1, len(embeddings))[None, :] > np.arange(start, stop)[:, None]
+        same = ids[start:stop, None] == ids[None, start + 1:]
+        bins = np.clip(np.rint((scores + 1) * ((SCORE_BINS - 1) / 2)), 0, SCORE_BINS - 1).astype(np.int64)
+        genuine += np.bincount(bins[upper & same], minlength=SCORE_BINS)
+        impostor += np.bincount(bins[upper & ~same], minlength=SCORE_BINS)
+    return genuine, impostor
+
+
+def error_rates(genuine: np.ndarray, impostor: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    False accept and false reject rates of every threshold, where a pair is accepted if its score is above the threshold
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Thresholds (the bin centers), false accept rates and false reject rates
+    """
+    thresholds = np.linspace(-1, 1, SCORE_BINS)
+    far = 1 - np.cumsum(impostor) / max(int(impostor.sum()), 1)
+    frr = np.cumsum(genuine) / max(int(genuine.sum()), 1)
+    return thresholds, far, frr
+
+
+def calibrate(genuine: np.ndarray, impostor: np.ndarray, target_far: float = 1e-3) -> dict:
+    """
+    Computes the equal error rate and the recommended threshold of a room from its score histograms
+
+    Parameters
+    ----------
+    genuine: np.ndarray
+        Genuine pair counts of every score bin
+    impostor: np.ndarray
+        Impostor pair counts of every score bin
+    target_far: float
+        Highest acceptable false accept rate
+
+    Returns
+    -------
+    dict
+        Pair counts, equal error rate and its threshold, the lowest threshold with a false accept rate
+        of at most target_far and the error rates at it and at the current default threshold
+    """
+    thresholds, far, frr = error_rates(genuine, impostor)
+    eer_bin = int(np.argmin(np.abs(far - frr)))
+    recommended = int(np.argmax(far <= target_far))
+    current = int(np.searchsorted(thresholds, CURRENT_THRESHOLD - 1e-9))
+    return {
+        'genuine_pairs': int(genuine.sum()),
+        'impostor_pairs': int(impostor.sum()),
+        'eer': float((far[eer_bin] + frr[eer_bin]) / 2),
+        'eer_threshold': float(thresholds[eer_bin]),
+        'recommended_threshold': float(thresholds[recommended]),
+        'far_at_recommended': float(far[recommended]),
+        'frr_at_recommended': float(frr[recommended]),
+        f'far_at_{CURRENT_THRESHOLD}': float(far[current]),
+        f'frr_at_{CURRENT_THRESHOLD}': float(frr[current]),
+    }
+
+
+def evaluate(dataset: EmbeddedDataset, target_far: float = 1e-3, block_size: int = 1024) -> Tuple[dict, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Calibrates every room of the dataset and all rooms together, pairing only the faces of the same room
+
+    Returns
+    -------
+    Tuple[dict, Dict[str, Tuple[np.ndarray, np.ndarray]]]
+        The calibration of every room and of 'all' rooms, and their genuine and impostor score histograms
+    """
+    report, histograms = {}, {}
+    total_genuine = np.zeros(SCORE_BINS, dtype=np.int64)
+    total_impostor = np.zeros(SCORE_BINS, dtype=np.int64)
+    for room_name in np.unique(dataset.rooms):
+        faces = dataset.rooms == room_name
+        genuine, impostor = score_histograms(dataset.embeddings[faces], dataset.labels[faces], block_size)
+        histograms[str(room_name)] = (genuine, impostor)
+        report[str(room_name)] = {'users': int(len(np.unique(dataset.labels[faces]))), 'faces': int(faces.sum()),
+                                  **calibrate(genuine, impostor, target_far)}
+        total_genuine += genuine
+        total_impostor += impostor
+    histograms['all'] = (total_genuine, total_impostor)
+    report['all'] = {'users': int(len(np.unique(dataset.labels))), 'faces': int(len(dataset.labels)),
+                     **calibrate(total_genuine, total_impostor, target_far)}
+    return report, histograms
+
+
+def write_curves(path: str, histograms: Dict[str, Tuple[np.ndarray, np.ndarray]], step: int = 10) -> None:
+    """
+    Writes the ROC/DET curve of every room as CSV rows of room, threshold, false accept rate, false reject rate
+    and true accept rate, for every step-th score bin
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['room', 'threshold', 'far', 'frr', 'tar'])
+        for room_name, (genuine, impostor) in histograms.items():
+            thresholds, far, frr = error_rates(genuine, impostor)
+            for i in range(0, SCORE_BINS, step):
+                writer.writerow([room_name, round(float(thresholds[i]), 4), float(far[i]), float(frr[i]), float(1 - frr[i])])
+
+
+def plot_curves(path: str, histograms: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+    """
+    Plots the ROC and DET curves of every room into an image. Requires matplotlib.
+    """
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError('Plotting the curves requires the matplotlib package: pip install matplotlib')
+
+    figure, (roc, det) = plt.subplots(1, 2, figsize=(12, 5))
+    for room_name, (genuine, impostor) in histograms.items():
+        _, far, frr = error_rates(genuine, impostor)
+        roc.plot(far, 1 - frr, label=room_name)
+        det.plot(far, frr, label=room_name)
+    roc.set(xscale='log', xlabel='False accept rate', ylabel='True accept rate', title='ROC')
+    det.set(xscale='log', yscale='log', xlabel='False accept rate', ylabel='False reject rate', title='DET')
+    roc.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    from config import mtcnn_params, inception_params, startup_params
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='Directory laid out as <root>/<room>/<user>/*.jpg or <root>/<user>/*.jpg')
+    parser.add_argument('--cache', help='Embedding cache, reused while the photos and model parameters do not change')
+    parser.add_argument('--output', help='JSON report of every room')
+    parser.add_argument('--curves', help='CSV file of the ROC/DET curves')
+    parser.add_argument('--plot', help='Image of the ROC/DET curves, requires matplotlib')
+    parser.add_argument('--target-far', type=float, default=1e-3, help='False accept rate of the recommended thresholds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    rooms = find_evaluation_images(args.root)
+    key = dataset_key(rooms, mtcnn_params, inception_params)
+    dataset = EmbeddedDataset.load(args.cache, key) if args.cache else None
+    if dataset is None:
+        start = time.perf_counter()
+        dataset = embed_dataset(rooms, mtcnn_params, inception_params, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                                batch_size=args.batch_size, weights_dir=startup_params['weights_dir'])
+        print(f'{len(dataset.labels)} faces embedded in {time.perf_counter() - start:.2f}s')
+        if args.cache:
+            dataset.save(args.cache, key)
+
+    start = time.perf_counter()
+    report, histograms = evaluate(dataset, target_far=args.target_far)
+    pairs = report['all']['genuine_pairs'] + report['all']['impostor_pairs']
+    print(f'{pairs} pairs scored in {time.perf_counter() - start:.2f}s')
+    for room_name, room in report.items():
+        print(f"{room_name}: {room['users']} users, {room['faces']} faces, EER {room['eer']:.4f} at {room['eer_threshold']:.3f}, "
+              f"recommended threshold {room['recommended_threshold']:.3f} "
+              f"(FAR {room['far_at_recommended']:.5f}, FRR {room['frr_at_recommended']:.4f})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'target_far': args.target_far, 'rooms': report}, f, indent=2)
+    if args.curves:
+        write_curves(args.curves, histograms)
+    if args.plot:
+        plot_curves(args.plot, histograms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import List, Optional, TYPE_CHECKING
+
+import numpy as np
+
+from src.face_detection.image import Frame
+
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+
+@dataclass
+class DetectionResult:
+    """
+    Class to represent the faces detected in a frame, shared by the overlay and the embedding stages
+
+    Attributes
+    ----------
+    frame: Frame
+        Frame the faces are detected in
+    boxes: List[list]
+        Face bounding boxes [x1, y1, x2, y2] with the margin ratio applied, largest face first if the detector selects the largest
+    probs: List[float]
+        Detection probability of each face
+    landmarks: List[np.ndarray]
+        Facial landmarks of each face with shape (5, 2)
+    crops: List[Image]
+        PILLOW Images of each face, cropped on first access
+    views: List[np.ndarray]
+        Each face as a view of the frame array, created on first access without copying the pixels
+    reused: bool
+        True if the faces are carried over from a previous frame instead of being detected in this frame
+    """
+    frame: Frame
+    boxes: List[list] = field(default_factory=list)
+    probs: List[float] = field(default_factory=list)
+    landmarks: List[np.ndarray] = field(default_factory=list)
+    reused: bool = False
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @cached_property
+    def crops(self) -> List[Image]:
+        return [self.frame.crop_bbox(bbox) for bbox in self.boxes]
+
+    @cached_property
+    def views(self) -> List[np.ndarray]:
+        return [self.frame.crop_view(bbox) for bbox in self.boxes]
+
+    @property
+    def face(self) -> Optional[Image]:
+        """
+        Returns the crop of the first face, None if no face is detected
+        """
+        return self.crops[0] if self.boxes else None
+
+    def update_frame(self) -> Frame:
+        """
+        Sets the first face bounding box as the face location of the frame and returns the frame
+        """
+        if self.boxes:
+            self.frame.update_face_bbox_location(*self.boxes[0])
+        return self.frame
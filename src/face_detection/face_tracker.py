@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from src.instrumentation import increment
+
+
+@dataclass
+class Track:
+    """
+    Class to represent a face followed across consecutive frames and its cached identity
+
+    Attributes
+    ----------
+    track_id: int
+        Unique ID of the track
+    bbox: list
+        Face bounding box [x1, y1, x2, y2] in the last frame the face was seen
+    user_id: Optional[str]
+        ID of the authorized user of the last recognition, None if not authorized
+    score: Optional[float]
+        Similarity score of the last recognition
+    confidence: float
+        Confidence in the cached identity. It is 1 after a recognition and decays every frame.
+    frames_since_recognition: Optional[int]
+        Number of frames since the face was last scheduled for recognition, None if it never was
+    missed: int
+        Number of consecutive frames the face was not detected
+    """
+    track_id: int
+    bbox: list
+    user_id: Optional[str] = None
+    score: Optional[float] = None
+    confidence: float = 0.0
+    frames_since_recognition: Optional[int] = None
+    missed: int = 0
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Computes the intersection over union of every pair of [x1, y1, x2, y2] boxes with shape (len(boxes_a), len(boxes_b))
+    """
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+class FaceTracker:
+    """
+    IoU tracker with a centroid distance fallback that assigns track IDs to face bounding boxes across frames,
+    so that the identity of a face is only recognized again when it is needed.
+
+    A track is recognized when it is new, when its confidence decays below min_confidence, when it moves so fast
+    that it is only matched by its centroid, or every recheck_interval frames.
+
+    Attributes
+    ----------
+    iou_threshold: float
+        Minimum IoU to match a box to a track
+    max_centroid_distance: float
+        Maximum centroid distance, relative to the track box diagonal, to match a box that does not overlap enough
+    max_missed: int
+        Number of frames a track is kept without a matching box
+    recheck_interval: int
+        Number of frames after which a track is recognized again
+    confidence_decay: float
+        Factor the confidence of a track is multiplied with every frame
+    min_confidence: float
+        Confidence below which a track is recognized again
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_centroid_distance: float = 0.5, max_missed: int = 5,
+                 recheck_interval: int = 30, confidence_decay: float = 0.97, min_confidence: float = 0.5):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+        self.recheck_interval = recheck_interval
+        self.confidence_decay = confidence_decay
+        self.min_confidence = min_confidence
+        self.tracks: List[Track] = []
+        self._next_id = 0
+
+    def update(self, boxes: List[list]) -> List[Track]:
+        """
+        Matches the face bounding boxes of a new frame to the existing tracks
+
+        Parameters
+        ----------
+        boxes: List[list]
+            Face bounding boxes [x1, y1, x2, y2] of the frame
+
+        Returns
+        -------
+        List[Track]
+            The track of every box, in the same order as the boxes
+        """
+        for track in self.tracks:
+            track.confidence *= self.confidence_decay
+            if track.frames_since_recognition is not None:
+                track.frames_since_recognition += 1
+
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        unmatched_tracks = list(self.tracks)
+        if boxes and self.tracks:
+            new = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            old = np.asarray([track.bbox for track in self.tracks], dtype=np.float64)
+            iou = box_iou(new, old)
+            new_centers = (new[:, :2] + new[:, 2:]) / 2
+            old_centers = (old[:, :2] + old[:, 2:]) / 2
+            diagonals = np.linalg.norm(old[:, 2:] - old[:, :2], axis=1)
+            distance = np.linalg.norm(new_centers[:, None] - old_centers[None], axis=2) / np.maximum(diagonals[None], 1e-9)
+
+            # Greedy matching, most overlapping pairs first, then the closest centroids
+            pairs = [(-iou[i, j], 0, i, j) for i, j in zip(*np.nonzero(iou >= self.iou_threshold))]
+            pairs += [(distance[i, j], 1, i, j) for i, j in zip(*np.nonzero(distance <= self.max_centroid_distance))]
+            used = set()
+            for _, by_centroid, i, j in sorted(pairs):
+                track = self.tracks[j]
+                if assigned[i] is not None or j in used:
+                    continue
+                assigned[i] = track
+                used.add(j)
+                if by_centroid:
+                    track.confidence = 0.0
+            unmatched_tracks = [track for j, track in enumerate(self.tracks) if j not in used]
+
+        for i, box in enumerate(boxes):
+            if assigned[i] is None:
+                assigned[i] = Track(track_id=self._next_id, bbox=list(box))
+                self._next_id += 1
+                self.tracks.append(assigned[i])
+            assigned[i].bbox = list(box)
+            assigned[i].missed = 0
+
+        for track in unmatched_tracks:
+            track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        return assigned
+
+    def needs_recognition(self, track: Track) -> bool:
+        return (track.frames_since_recognition is None
+                or track.frames_since_recognition >= self.recheck_interval
+                or track.confidence < self.min_confidence)
+
+    def select_for_recognition(self, tracks: List[Track]) -> List[int]:
+        """
+        Returns the indices of the tracks whose faces should be recognized and marks them as scheduled,
+        so they are not scheduled again while their recognition is still running
+
+        Parameters
+        ----------
+        tracks: List[Track]
+            Tracks of the faces of a frame, as returned by update
+
+        Returns
+        -------
+        List[int]
+            Indices of the tracks to recognize
+        """
+        selected = [i for i, track in enumerate(tracks) if self.needs_recognition(track)]
+        increment('tracker.cache_hits', len(tracks) - len(selected))
+        for i in selected:
+            tracks[i].frames_since_recognition = 0
+            tracks[i].confidence = 1.0
+        return selected
+
+    def record_identity(self, track: Track, user_id: Optional[str], score: Optional[float]) -> None:
+        """
+        Caches the recognized identity of a track
+        """
+        track.user_id = user_id
+        track.score = score
+
+    def reset(self) -> None:
+        self.tracks = []
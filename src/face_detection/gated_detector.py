@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import time
+from typing import Optional, Union, TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+from src.face_detection.base_face_detection import BaseFaceDetection
+from src.face_detection.detection_result import DetectionResult
+from src.face_detection.image import Frame
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.instrumentation import increment
+
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+
+class GatedDetector(BaseFaceDetection):
+    """
+    Detection front-end of a single video stream that avoids running the MTCNN cascade on every full resolution frame.
+
+    - Motion gate: frames that differ too little from the frame of the last detection reuse its faces.
+    - Downscaled detection: MTCNN runs on a copy scaled by detection_scale and the boxes are scaled back
+      to the original frame coordinates. Note that the effective minimum face size grows by 1 / detection_scale.
+    - Adaptive stride: detection runs every stride frames. The stride grows while detection is slower than
+      target_latency and shrinks again when it is fast.
+
+    Attributes
+    ----------
+    model: MTCNNModel
+        Face detection model
+    motion_threshold: float
+        Mean absolute grayscale difference (0-255) below which a frame is considered static. 0 disables the gate.
+    motion_size: int
+        Width of the grayscale thumbnail the motion is measured on
+    detection_scale: float
+        Scale of the image MTCNN runs on. 1 disables downscaling.
+    target_latency: Optional[float]
+        Detection latency in seconds above which the stride grows. None disables the adaptive stride.
+    max_stride: int
+        Maximum number of frames between two detections
+    """
+
+    def __init__(self, model: MTCNNModel, motion_threshold: float = 2.0, motion_size: int = 64,
+                 detection_scale: float = 0.5, target_latency: Optional[float] = 0.05, max_stride: int = 4):
+        if not 0 < detection_scale <= 1:
+            raise ValueError('detection_scale must be in (0, 1]')
+        self.model = model
+        self.motion_threshold = motion_threshold
+        self.motion_size = motion_size
+        self.detection_scale = detection_scale
+        self.target_latency = target_latency
+        self.max_stride = max_stride
+        self.stride = 1
+        self.skipped = 0
+        self.detected = 0
+        self._last_result: Optional[DetectionResult] = None
+        self._last_thumbnail: Optional[np.ndarray] = None
+        self._frames_since_detection = 0
+
+    def reset(self) -> None:
+        self.stride = 1
+        self._last_result = None
+        self._last_thumbnail = None
+        self._frames_since_detection = 0
+
+    def detect(self, image: Frame, offset_ratio: float = 0.05, return_frame = False) -> Union[Image, Frame]:
+        """
+        Detects faces in the image and returns the first face as a PILLOW Image, or the frame if return_frame is set
+        """
+        detections = self.detect_faces(image, offset_ratio=offset_ratio)
+        detections.update_frame()
+        if return_frame:
+            return image
+        return detections.face
+
+    def detect_faces(self, image: Frame, offset_ratio: float = 0.05) -> DetectionResult:
+        """
+        Detects all faces in the image, or reuses the faces of the last detection when the frame is skipped
+
+        Parameters
+        ----------
+        image: src.face_detection.image.Frame
+            Image to detect faces
+        offset_ratio: float
+            Ratio to add to the face bounding boxes to cover the whole head.
+
+        Returns
+        -------
+        DetectionResult
+            Bounding boxes, probabilities, landmarks and crops of every face in the original frame coordinates
+        """
+        thumbnail = self._thumbnail(image) if self.motion_threshold > 0 else None
+        self._frames_since_detection += 1
+        if self._last_result is not None and self._can_skip(thumbnail, image):
+            self.skipped += 1
+            increment('detection.frames_skipped')
+            last = self._last_result
+            return DetectionResult(image, list(last.boxes), list(last.probs), list(last.landmarks), reused=True)
+
+        start = time.perf_counter()
+        result = self._detect_scaled(image, offset_ratio)
+        self._adapt_stride(time.perf_counter() - start)
+        self.detected += 1
+        increment('detection.frames_detected')
+        self._last_result = result
+        self._last_thumbnail = thumbnail
+        self._frames_since_detection = 0
+        return result
+
+    def _can_skip(self, thumbnail: Optional[np.ndarray], image: Frame) -> bool:
+        if (image.width, image.height) != (self._last_result.frame.width, self._last_result.frame.height):
+            return False
+        if self._frames_since_detection < self.stride:
+            return True
+        if thumbnail is None or self._last_thumbnail is None:
+            return False
+        return float(np.abs(thumbnail - self._last_thumbnail).mean()) < self.motion_threshold
+
+    def _thumbnail(self, image: Frame) -> np.ndarray:
+        height = max(1, round(image.height * self.motion_size / image.width))
+        thumbnail = cv2.resize(image.get_array(), (self.motion_size, height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    def _detect_scaled(self, image: Frame, offset_ratio: float) -> DetectionResult:
+        if self.detection_scale == 1:
+            return self.model.detect_faces(image, offset_ratio=offset_ratio)
+
+        size = (max(1, round(image.width * self.detection_scale)), max(1, round(image.height * self.detection_scale)))
+        small = Frame(cv2.resize(image.get_array(), size, interpolation=cv2.INTER_AREA))
+        result = self.model.detect_faces(small, offset_ratio=offset_ratio)
+        scale_x, scale_y = image.width / size[0], image.height / size[1]
+        return DetectionResult(
+            frame=image,
+            boxes=[[x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y] for x1, y1, x2, y2 in result.boxes],
+            probs=result.probs,
+            landmarks=[landmark * np.array([scale_x, scale_y]) for landmark in result.landmarks],
+        )
+
+    def _adapt_stride(self, latency: float) -> None:
+        if self.target_latency is None:
+            return
+        if latency > self.target_latency:
+            self.stride = min(self.stride + 1, self.max_stride)
+        elif latency < self.target_latency / 2:
+            self.stride = max(self.stride - 1, 1)
@@ -1,17 +1,25 @@
-from dataclasses import dataclass
-from typing import Union, Optional
-from PIL import Image, ImageDraw, ImageFont
+from typing import List, Union, Optional
+
+import numpy as np
+from PIL import Image
+
+from src.face_detection.overlay import draw_boxes
+from src.instrumentation import instrument
 
 
-@dataclass
 class Frame:
     """
-    Class to represent an image frame and its face bounding box location
+    Class to represent an image frame and its face bounding box location.
+
+    The image is kept in the form it is given, an RGB uint8 NumPy array or a PILLOW Image, and converted
+    to the other form only on first access, so camera frames are never converted to PILLOW Images unless needed.
 
     Attributes
     ----------
-    img: Union[Image.Image, str]
-        Image to detect faces
+    img: Image.Image
+        Image to detect faces as a PILLOW Image
+    array: np.ndarray
+        Image to detect faces as an RGB uint8 array with shape (height, width, 3)
     width: int
         Width of the image
     height: int
@@ -35,29 +43,57 @@ class Frame:
     bbox: list
         List of the face bounding box coordinates [x1, y1, x2, y2]
     """
-    img: Union[Image.Image, str] = None
-
-    def __post_init__(self):
+    __slots__ = ('_array', '_pil', 'width', 'height', 'x1', 'y1', 'x2', 'y2',
+                 'face_x1', 'face_y1', 'face_x2', 'face_y2', 'bbox')
 
-        if not self.img:
+    def __init__(self, img: Union[Image.Image, np.ndarray, str] = None):
+        if img is None or isinstance(img, str) and not img:
             raise ValueError('Image is required')
 
-        if isinstance(self.img, str):
-            self.img = Image.open(self.img)
+        if isinstance(img, str):
+            img = Image.open(img)
 
-        self.width, self.height = self.img.size
+        if isinstance(img, np.ndarray):
+            if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3:
+                raise ValueError('Image arrays must be RGB uint8 arrays with shape (height, width, 3)')
+            self._array, self._pil = img, None
+            self.height, self.width = img.shape[:2]
+        else:
+            self._array, self._pil = None, img
+            self.width, self.height = img.size
         self.x1, self.y1, self.x2, self.y2 = 0, 0, self.width, self.height
 
         self.face_x1, self.face_y1 = None, None
         self.face_x2, self.face_y2 = None, None
         self.bbox = None
 
+    def __repr__(self) -> str:
+        return f'Frame(width={self.width}, height={self.height}, bbox={self.bbox})'
+
+    @property
+    def img(self) -> Image.Image:
+        return self.get_pillow_image()
+
+    @property
+    def array(self) -> np.ndarray:
+        return self.get_array()
+
     def get_pillow_image(self) -> Image.Image:
         """
-        Returns the image as a PILLOW Image
+        Returns the image as a PILLOW Image, converted from the array on first access
         """
-        return self.img
-    
+        if self._pil is None:
+            self._pil = Image.fromarray(self._array)
+        return self._pil
+
+    def get_array(self) -> np.ndarray:
+        """
+        Returns the image as an RGB uint8 array with shape (height, width, 3), converted from the PILLOW Image on first access
+        """
+        if self._array is None:
+            self._array = np.asarray(self._pil if self._pil.mode == 'RGB' else self._pil.convert('RGB'))
+        return self._array
+
     def update_face_bbox_location(self, x1, y1, x2, y2):
         """
         Updates the face bounding box location
@@ -86,40 +122,86 @@ class Frame:
         ratio: float
             Ratio to add to the face bounding box to cover the whole head. Ratio is defined as a percentage of the face bounding box width and height.
         """
+        self.face_x1, self.face_y1, self.face_x2, self.face_y2 = self.add_margin_to_bbox(
+            (self.face_x1, self.face_y1, self.face_x2, self.face_y2), ratio=ratio)
+
+    def add_margin_to_bbox(self, bbox, ratio: float = 0.2) -> list:
+        """
+        Returns the given face bounding box with the margin ratio added to each side
+
+        Parameters
+        ----------
+        bbox: list
+            Face bounding box coordinates [x1, y1, x2, y2]
+        ratio: float
+            Ratio to add to the face bounding box to cover the whole head. Ratio is defined as a percentage of the image width and height.
+        """
+        x1, y1, x2, y2 = bbox
         width_ratio = self.width * ratio
         height_ratio = self.height * ratio
-
-        self.face_x1, self.face_x2 = self.face_x1 - width_ratio/2, self.face_x2 + width_ratio/2
-        self.face_y1, self.face_y2 = self.face_y1 - height_ratio/2, self.face_y2 + height_ratio/2
+        return [x1 - width_ratio/2, y1 - height_ratio/2, x2 + width_ratio/2, y2 + height_ratio/2]
 
     def crop_face(self) -> Image.Image:
         """
         Crops the face from the image and returns the face as a PILLOW Image
         """
-        return self.img.crop((self.face_x1, self.face_y1, self.face_x2, self.face_y2))
+        return self.crop_bbox((self.face_x1, self.face_y1, self.face_x2, self.face_y2))
+
+    def clip_bbox(self, bbox) -> tuple:
+        """
+        Rounds the given bounding box [x1, y1, x2, y2] to pixels and clips it to the image
+        """
+        x1, y1, x2, y2 = (int(round(v)) for v in bbox)
+        x1, x2 = min(max(x1, 0), self.width), min(max(x2, 0), self.width)
+        y1, y2 = min(max(y1, 0), self.height), min(max(y2, 0), self.height)
+        return x1, y1, max(x2, x1 + 1), max(y2, y1 + 1)
+
+    def crop_bbox(self, bbox) -> Image.Image:
+        """
+        Crops the given bounding box [x1, y1, x2, y2], clipped to the image, and returns it as a PILLOW Image
+        """
+        return self.get_pillow_image().crop(self.clip_bbox(bbox))
+
+    def crop_view(self, bbox) -> np.ndarray:
+        """
+        Returns the given bounding box [x1, y1, x2, y2], clipped to the image, as a view of the image array without copying
+        """
+        x1, y1, x2, y2 = self.clip_bbox(bbox)
+        return self.get_array()[y1:y2, x1:x2]
 
-    def visualize(self, border_color: str = "red", save_path: Optional[str]=None, return_image: bool = False, text: Optional[str] = None):
+    @instrument('frame.visualize')
+    def visualize(self, border_color: str = "red", save_path: Optional[str]=None, return_image: bool = False, text: Optional[str] = None,
+                  boxes: Optional[List[list]] = None, labels: Optional[List[Optional[str]]] = None, in_place: bool = False):
         """
         Visualizes the face bounding box on the image and saves it to the given path if provided.
+        The boxes are drawn on the form the frame holds, the returned image is an array for frames created from arrays.
 
         Parameters
         ----------
         save_path: Optional[str]
             Path to save the image with the face bounding box drawn on it.
+        boxes: Optional[List[list]]
+            Bounding boxes [x1, y1, x2, y2] to draw instead of the face bounding box, e.g. every face of a DetectionResult
+        labels: Optional[List[Optional[str]]]
+            Text of every box in boxes. text is used for the face bounding box.
+        in_place: bool
+            Draws on the frame image itself instead of a copy. Use OverlayRenderer to draw on a reusable buffer instead.
         """
-        img_to_draw = self.img.copy()
-        draw = ImageDraw.Draw(img_to_draw)
+        # Draws on the form the frame was created from, arrays converted from PILLOW Images are read-only
+        writable_array = self._array is not None and (self._pil is None or self._array.flags.writeable)
+        image = self._array if writable_array else self._pil
+        img_to_draw = image if in_place else image.copy()
+        if in_place:
+            # The other form of the image would be stale
+            self._array, self._pil = (image, None) if isinstance(image, np.ndarray) else (None, image)
+        if boxes is None:
+            boxes = [[self.face_x1, self.face_y1, self.face_x2, self.face_y2]] if self.face_x1 else []
+            labels = [text]
+        draw_boxes(img_to_draw, boxes, labels=labels, colors=border_color)
 
-        if self.face_x1:
-            draw.rectangle(((self.face_x1, self.face_y1), (self.face_x2, self.face_y2)), outline=border_color, width=3)
-            if text:
-                fontsize = 24
-                font = ImageFont.truetype("arial.ttf", fontsize)
-                ratio = 0.06
-                draw.text(xy=(self.face_x1, self.face_y1-self.height*ratio), text=text, fill=border_color, font=font)
         if save_path:
-            img_to_draw.save(save_path)
+            (Image.fromarray(img_to_draw) if isinstance(img_to_draw, np.ndarray) else img_to_draw).save(save_path)
         if return_image:
             return img_to_draw
         else:
-            img_to_draw.show()
\ No newline at end of file
+            (Image.fromarray(img_to_draw) if isinstance(img_to_draw, np.ndarray) else img_to_draw).show()
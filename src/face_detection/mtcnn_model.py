@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import numpy as np
 
-from facenet_pytorch import MTCNN
 from dataclasses import dataclass
-from typing import Optional, Union, TYPE_CHECKING
+from typing import List, Optional, Union, TYPE_CHECKING
 
 from src.face_detection.base_face_detection  import BaseFaceDetection
+from src.face_detection.detection_result import DetectionResult
 from src.face_detection.image import Frame
+from src.instrumentation import increment, timed
+from src.weights import load_mtcnn_weights
 
 if TYPE_CHECKING:
     from PIL.Image import Image
@@ -16,9 +18,22 @@ if TYPE_CHECKING:
 class MTCNNModel(BaseFaceDetection):
 
     mtcnn_kwargs: Optional[dict] = None
+    weights_dir: Optional[str] = None
+    warmup: bool = False
 
     def __post_init__(self):
+        from facenet_pytorch import MTCNN
+
         self.__model = MTCNN(**self.mtcnn_kwargs) if self.mtcnn_kwargs else MTCNN()
+        load_mtcnn_weights(self.__model, self.weights_dir)
+        if self.warmup:
+            self.run_warmup()
+
+    def run_warmup(self, size=(480, 640)) -> None:
+        """
+        Runs the cascade on a blank frame of the given (height, width), so that the first real frame does not pay for lazy initialization
+        """
+        self.__model.detect(np.zeros((*size, 3), dtype=np.uint8))
 
     def detect(self, image: Frame, offset_ratio: float = 0.05, return_frame = False) -> Union[Image, Frame]:
         """
@@ -36,16 +51,68 @@ class MTCNNModel(BaseFaceDetection):
         Image
             PILLOW Image of the face
         """
-        img = image.get_pillow_image()
-        boxes, probs, _ = self.__model.detect(img, landmarks=True)
-        if isinstance(boxes, np.ndarray):
-            image.update_face_bbox_location(*boxes[0])
-            image.set_margin_ratio_to_face_bbox(ratio=offset_ratio)
-            face_img = image.crop_face()
-            if return_frame:
-                return image
-            return face_img
-        else:
-            if return_frame:
-                return image
-            return None
\ No newline at end of file
+        detections = self.detect_faces(image, offset_ratio=offset_ratio)
+        detections.update_frame()
+        if return_frame:
+            return image
+        return detections.face
+
+    def detect_faces(self, image: Frame, offset_ratio: float = 0.05) -> DetectionResult:
+        """
+        Detects all faces in the image with a single MTCNN pass
+
+        Parameters
+        ----------
+        image: src.face_detection.image.Frame
+            Image to detect faces
+        offset_ratio: float
+            Ratio to add to the face bounding boxes to cover the whole head.
+
+        Returns
+        -------
+        DetectionResult
+            Bounding boxes, probabilities, landmarks and crops of every detected face
+        """
+        with timed('detection.mtcnn'):
+            boxes, probs, landmarks = self.__model.detect(image.get_array(), landmarks=True)
+        return self._build_result(image, boxes, probs, landmarks, offset_ratio)
+
+    def detect_faces_batch(self, images: List[Frame], offset_ratio: float = 0.05) -> List[DetectionResult]:
+        """
+        Detects all faces in several images, running MTCNN once for every group of images with the same size
+
+        Parameters
+        ----------
+        images: List[src.face_detection.image.Frame]
+            Images to detect faces
+        offset_ratio: float
+            Ratio to add to the face bounding boxes to cover the whole head.
+
+        Returns
+        -------
+        List[DetectionResult]
+            Detection result of every image, in the same order as the images
+        """
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault((image.width, image.height), []).append(i)
+
+        results = [None] * len(images)
+        for indices in groups.values():
+            with timed('detection.mtcnn_batch'):
+                boxes, probs, landmarks = self.__model.detect(np.stack([images[i].get_array() for i in indices]), landmarks=True)
+            for i, image_boxes, image_probs, image_landmarks in zip(indices, boxes, probs, landmarks):
+                results[i] = self._build_result(images[i], image_boxes, image_probs, image_landmarks, offset_ratio)
+        return results
+
+    @staticmethod
+    def _build_result(image: Frame, boxes, probs, landmarks, offset_ratio: float) -> DetectionResult:
+        if not isinstance(boxes, np.ndarray):
+            return DetectionResult(image)
+        increment('detections', len(boxes))
+        return DetectionResult(
+            frame=image,
+            boxes=[image.add_margin_to_bbox(box, ratio=offset_ratio) for box in boxes],
+            probs=list(probs),
+            landmarks=list(landmarks),
+        )
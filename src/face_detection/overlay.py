@@ -0,0 +1,110 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+Color = Union[str, tuple]
+
+
+@lru_cache(maxsize=None)
+def load_font(size: int = 24) -> ImageFont.ImageFont:
+    """
+    Loads the label font of the given size once, falls back to the default PILLOW font if arial.ttf is not installed
+    """
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def _rgb(color: Color) -> tuple:
+    return ImageColor.getrgb(color) if isinstance(color, str) else tuple(color)
+
+
+def draw_boxes(image: Union[Image.Image, np.ndarray], boxes: Sequence[Sequence[float]], labels: Optional[Sequence[Optional[str]]] = None,
+               colors: Union[Color, List[Color]] = "red", width: int = 3, font_size: int = 24, label_offset: float = 0.06):
+    """
+    Draws labeled bounding boxes in place on a PILLOW Image or on an RGB uint8 NumPy array.
+    NumPy arrays are drawn with OpenCV, so the frame is never converted to a PILLOW Image.
+
+    Parameters
+    ----------
+    image: Union[Image.Image, np.ndarray]
+        Image to draw on, it is modified in place
+    boxes: Sequence[Sequence[float]]
+        Bounding boxes [x1, y1, x2, y2]
+    labels: Optional[Sequence[Optional[str]]]
+        Text drawn above every box, None to draw no text for a box
+    colors: Union[Color, List[Color]]
+        Color name or RGB tuple of all boxes, or a list with one color per box
+    width: int
+        Line width of the boxes
+    font_size: int
+        Font size of the labels in pixels
+    label_offset: float
+        Distance of the labels above the boxes as a ratio of the image height
+
+    Returns
+    -------
+    Union[Image.Image, np.ndarray]
+        The same image
+    """
+    labels = labels if labels is not None else [None] * len(boxes)
+    colors = [colors] * len(boxes) if isinstance(colors, (str, tuple)) else colors
+
+    if isinstance(image, np.ndarray):
+        import cv2
+
+        height = image.shape[0]
+        for box, label, color in zip(boxes, labels, colors):
+            x1, y1, x2, y2 = (int(round(v)) for v in box)
+            rgb = _rgb(color)
+            cv2.rectangle(image, (x1, y1), (x2, y2), rgb, width)
+            if label:
+                # OpenCV places the text by its baseline, PILLOW by its top
+                cv2.putText(image, label, (x1, max(y1 - int(height * label_offset) + font_size, font_size)),
+                            cv2.FONT_HERSHEY_SIMPLEX, font_size / 30, rgb, 2, cv2.LINE_AA)
+        return image
+
+    draw = ImageDraw.Draw(image)
+    font = load_font(font_size)
+    for box, label, color in zip(boxes, labels, colors):
+        x1, y1, x2, y2 = box
+        draw.rectangle(((x1, y1), (x2, y2)), outline=color, width=width)
+        if label:
+            draw.text(xy=(x1, y1 - image.height * label_offset), text=label, fill=color, font=font)
+    return image
+
+
+class OverlayRenderer:
+    """
+    Renders labeled face boxes on a reusable buffer, so a video loop allocates no new image per frame.
+    The returned image is overwritten by the next render call.
+    """
+
+    def __init__(self, width: int = 3, font_size: int = 24):
+        self.width = width
+        self.font_size = font_size
+        self._buffer: Optional[Union[Image.Image, np.ndarray]] = None
+
+    def render(self, image: Union[Image.Image, np.ndarray], boxes: Sequence[Sequence[float]],
+               labels: Optional[Sequence[Optional[str]]] = None, colors: Union[Color, List[Color]] = "red"):
+        """
+        Copies the image into the buffer and draws the boxes on it
+
+        Returns
+        -------
+        Union[Image.Image, np.ndarray]
+            The buffer with the boxes drawn, of the same type as the image
+        """
+        if isinstance(image, np.ndarray):
+            if not isinstance(self._buffer, np.ndarray) or self._buffer.shape != image.shape or self._buffer.dtype != image.dtype:
+                self._buffer = np.empty_like(image)
+            np.copyto(self._buffer, image)
+        else:
+            if not isinstance(self._buffer, Image.Image) or self._buffer.size != image.size or self._buffer.mode != image.mode:
+                self._buffer = Image.new(image.mode, image.size)
+            self._buffer.paste(image)
+        return draw_boxes(self._buffer, boxes, labels=labels, colors=colors, width=self.width, font_size=self.font_size)
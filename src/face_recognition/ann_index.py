@@ -0,0 +1,336 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+class ANNIndex(ABC):
+    """
+    Nearest neighbour index of normalized embeddings searched by cosine similarity.
+
+    Every index keeps the normalized vectors it is built from, so it can always fall back to
+    exact search and be rebuilt incrementally.
+
+    Attributes
+    ----------
+    ids: List[str]
+        Ids of the indexed vectors
+    vectors: np.ndarray
+        Normalized float32 vectors with shape (number of ids, embedding size)
+    """
+
+    kind = None
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.vectors: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Adds normalized vectors to the index
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        self.ids = self.ids + list(ids)
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+        self._added(len(ids))
+
+    def remove(self, ids: Sequence[str]) -> None:
+        """
+        Removes the vectors of the given ids from the index
+        """
+        removed = set(ids)
+        keep = np.array([i for i, id_ in enumerate(self.ids) if id_ not in removed], dtype=np.int64)
+        if len(keep) == len(self.ids):
+            return
+        self.ids = [self.ids[i] for i in keep]
+        self.vectors = self.vectors[keep] if len(keep) else None
+        self._removed(keep)
+
+    def search_exact(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """
+        Finds the k most similar ids of every query by brute force
+
+        Parameters
+        ----------
+        queries: np.ndarray
+            Normalized query vectors with shape (number of queries, embedding size)
+        k: int
+            Number of most similar ids to return per query
+
+        Returns
+        -------
+        List[List[Tuple[str, float]]]
+            For every query, ids and cosine similarities of the most similar vectors in descending order
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.ids:
+            return [[] for _ in range(len(queries))]
+        rows = np.arange(len(self.ids))
+        return [self._top_k(scores, rows, k) for scores in queries @ self.vectors.T]
+
+    def _top_k(self, scores: np.ndarray, rows: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    @abstractmethod
+    def search(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """
+        Finds the approximately k most similar ids of every query, see search_exact
+        """
+
+    def build(self) -> None:
+        """
+        Builds the search structures that are otherwise built lazily on the first search, e.g. before saving
+        """
+
+    def _added(self, count: int) -> None:
+        pass
+
+    def _removed(self, keep: np.ndarray) -> None:
+        pass
+
+    def _state(self) -> dict:
+        return {}
+
+    def _restore(self, state: dict) -> None:
+        pass
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to a .npz file, written atomically
+        """
+        state = {key: value for key, value in self._state().items() if value is not None}
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, kind=self.kind, params=json.dumps(self.params()), ids=np.array(self.ids, dtype=str),
+                 vectors=self.vectors if self.vectors is not None else np.empty((0, 0), dtype=np.float32), **state)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'ANNIndex':
+        """
+        Loads an index saved with save
+        """
+        with np.load(path, allow_pickle=False) as data:
+            index = create_ann_index(str(data['kind']), **json.loads(str(data['params'])))
+            index.ids = data['ids'].tolist()
+            index.vectors = data['vectors'] if len(index.ids) else None
+            index._restore({key: data[key] for key in data.files if key not in ('kind', 'params', 'ids', 'vectors')})
+        return index
+
+    def params(self) -> dict:
+        return {}
+
+
+class ExactIndex(ANNIndex):
+    """
+    Brute force index, exact and fast enough for small rooms
+    """
+
+    kind = 'exact'
+
+    def search(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        return self.search_exact(queries, k)
+
+
+class IVFIndex(ANNIndex):
+    """
+    Inverted file index in NumPy. The vectors are clustered with spherical k-means and a query is only
+    compared to the vectors of the nprobe clusters with the most similar centroids.
+
+    The clusters are trained on the first search and retrained once the index has grown by retrain_growth
+    since the last training, new vectors are assigned to the existing clusters until then.
+
+    Attributes
+    ----------
+    nlist: Optional[int]
+        Number of clusters, 4 * sqrt(number of vectors) if None
+    nprobe: int
+        Number of clusters searched per query
+    train_iterations: int
+        Number of k-means iterations
+    retrain_growth: float
+        Growth factor of the index after which the clusters are retrained
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, train_iterations: int = 10,
+                 retrain_growth: float = 2.0, seed: int = 0):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._order = None
+        self._offsets = None
+
+    def params(self) -> dict:
+        return {'nlist': self.nlist, 'nprobe': self.nprobe, 'train_iterations': self.train_iterations,
+                'retrain_growth': self.retrain_growth, 'seed': self.seed}
+
+    def train(self) -> None:
+        """
+        Clusters the indexed vectors with spherical k-means
+        """
+        if not self.ids:
+            self.centroids, self.assignments, self._trained_size = None, None, 0
+            return
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist or max(1, int(4 * np.sqrt(len(self.ids)))), len(self.ids))
+        sample = self.vectors[rng.choice(len(self.ids), size=min(len(self.ids), nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(self.train_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        self._trained_size = len(self.ids)
+        self._build_lists()
+
+    def build(self) -> None:
+        if self.centroids is None and self.ids:
+            self.train()
+
+    def _build_lists(self) -> None:
+        self._order = np.argsort(self.assignments, kind='stable')
+        self._offsets = np.searchsorted(self.assignments[self._order], np.arange(len(self.centroids) + 1))
+
+    def _added(self, count: int) -> None:
+        if self.centroids is None:
+            return
+        if len(self.ids) > self._trained_size * self.retrain_growth:
+            self.centroids = None
+            return
+        new = np.argmax(self.vectors[-count:] @ self.centroids.T, axis=1)
+        self.assignments = np.concatenate([self.assignments, new])
+        self._build_lists()
+
+    def _removed(self, keep: np.ndarray) -> None:
+        if self.centroids is not None and len(keep):
+            self.assignments = self.assignments[keep]
+            self._build_lists()
+        else:
+            self.centroids = None
+
+    def search(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        if not self.ids:
+            return self.search_exact(queries, k)
+        if self.centroids is None:
+            self.train()
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, probe in zip(queries, probes):
+            rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe])
+            if not len(rows):
+                results.append([])
+                continue
+            results.append(self._top_k(self.vectors[rows] @ query, rows, k))
+        return results
+
+    def _state(self) -> dict:
+        return {'centroids': self.centroids, 'assignments': self.assignments,
+                'trained_size': np.array(self._trained_size)}
+
+    def _restore(self, state: dict) -> None:
+        if 'centroids' in state:
+            self.centroids = state['centroids']
+            self.assignments = state['assignments']
+            self._trained_size = int(state['trained_size'])
+            self._build_lists()
+
+
+class FaissHNSWIndex(ANNIndex):
+    """
+    HNSW graph index of the optional faiss package. Removals rebuild the graph from the kept vectors.
+
+    Attributes
+    ----------
+    m: int
+        Number of neighbours of each graph node
+    ef_search: int
+        Size of the candidate list while searching
+    """
+
+    kind = 'hnsw'
+
+    def __init__(self, m: int = 32, ef_search: int = 64):
+        if faiss is None:
+            raise ImportError('The hnsw index requires the faiss package: pip install faiss-cpu')
+        super().__init__()
+        self.m = m
+        self.ef_search = ef_search
+        self._index = None
+
+    def params(self) -> dict:
+        return {'m': self.m, 'ef_search': self.ef_search}
+
+    def _new_index(self, dim: int):
+        index = faiss.IndexHNSWFlat(dim, self.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def _added(self, count: int) -> None:
+        if self._index is None:
+            self._index = self._new_index(self.vectors.shape[1])
+            self._index.add(self.vectors)
+        else:
+            self._index.add(self.vectors[-count:])
+
+    def _removed(self, keep: np.ndarray) -> None:
+        self._index = None
+        if len(keep):
+            self._index = self._new_index(self.vectors.shape[1])
+            self._index.add(self.vectors)
+
+    def _state(self) -> dict:
+        return {'graph': faiss.serialize_index(self._index) if self._index is not None else None}
+
+    def _restore(self, state: dict) -> None:
+        if 'graph' in state:
+            self._index = faiss.deserialize_index(state['graph'])
+            self._index.hnsw.efSearch = self.ef_search
+
+    def search(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        if not self.ids:
+            return self.search_exact(queries, k)
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        scores, rows = self._index.search(queries, min(k, len(self.ids)))
+        return [[(self.ids[row], float(score)) for score, row in zip(query_scores, query_rows) if row >= 0]
+                for query_scores, query_rows in zip(scores, rows)]
+
+
+ANN_INDEXES = {index.kind: index for index in (ExactIndex, IVFIndex, FaissHNSWIndex)}
+
+
+def create_ann_index(kind: str = 'ivf', **params) -> ANNIndex:
+    """
+    Creates an empty index of the given kind: 'exact', 'ivf' or 'hnsw' (requires faiss)
+    """
+    if kind not in ANN_INDEXES:
+        raise ValueError(f"Unknown index '{kind}'. Use one of {list(ANN_INDEXES)}")
+    return ANN_INDEXES[kind](**params)
@@ -1,11 +1,230 @@
+import json
 import os
+import threading
+from contextlib import contextmanager
 
-import torch
-from torch.nn.functional import cosine_similarity
+import numpy as np
+
+from src.face_recognition.ann_index import ANNIndex, create_ann_index
+from src.face_recognition.room_index import RoomIndex
+from src.face_recognition.room_storage import (RoomStorage, _file_lock, has_legacy_files, migrate_legacy_room,
+                                              prepare_embeddings)
+from src.face_recognition.templates import TemplateStore, normalized_centroid, select_diverse
+from src.instrumentation import increment, instrument
+
+GLOBAL_INDEX_DIRECTORY = '.ann'
+PENDING_FILENAME = 'pending.json'
+TRANSACTION_LOCK_FILENAME = '.transaction.lock'
 
 class AuthorizationDatabase:
-    def __init__(self, room_path = 'rooms'):
+    def __init__(self, room_path = 'rooms', dtype = 'float32', ann_backend = 'ivf', ann_params = None, exact_search_limit = 5000,
+                 max_templates = 10, template_recheck_k = 0, update_threshold = None, template_redundancy = 0.97):
+        """
+        Parameters
+        ----------
+        room_path: str
+            Directory of the rooms.
+        dtype: str
+            Data type of the stored embeddings of new rooms, 'float32' or 'float16'.
+        ann_backend: str
+            Index of the campus-wide identity lookup: 'ivf', 'hnsw' (requires faiss) or 'exact'.
+        ann_params: Optional[dict]
+            Keyword arguments of the identity lookup index.
+        exact_search_limit: int
+            Number of enrolled identities up to which the identity lookup uses exact search.
+        max_templates: int
+            Maximum number of templates stored per user. The least diverse templates are evicted above it.
+        template_recheck_k: int
+            Number of top candidates of the centroid search whose templates are also compared. 0 matches on the centroids only.
+        update_threshold: Optional[float]
+            Similarity above which an authenticated embedding is added as a template of the user. None disables the updates.
+        template_redundancy: float
+            Similarity to a stored template above which an authenticated embedding is not added as a new template.
+        """
         self.room_path = room_path
+        self.dtype = dtype
+        self.ann_backend = ann_backend
+        self.ann_params = ann_params or {}
+        self.exact_search_limit = exact_search_limit
+        self.max_templates = max_templates
+        self.template_recheck_k = template_recheck_k
+        self.update_threshold = update_threshold
+        self.template_redundancy = template_redundancy
+        self._indexes = {}
+        self._templates = {}
+        self._global_index = None
+        self._global_signatures = None
+        self._legacy_checked = set()
+        self._callbacks = []
+        self._watcher = None
+        self._watch_stop = threading.Event()
+
+    def get_room_storage(self, room_name):
+        """
+        Returns the embedding storage of a specific room. Rooms in the legacy '<user>_emb.pt' layout are migrated
+        when they are first opened, keeping the legacy files. If the migration fails, their legacy users are not
+        authorized until 'python -m src.face_recognition.room_storage' is run.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room.
+
+        Returns
+        -------
+        RoomStorage
+            The embedding storage of the room.
+        """
+        room_path = os.path.join(self.room_path, room_name)
+        storage = RoomStorage(room_path, dtype=self.dtype)
+        if room_name not in self._legacy_checked and not storage.exists() and has_legacy_files(room_path):
+            self._legacy_checked.add(room_name)
+            try:
+                migrated = migrate_legacy_room(room_path, dtype=self.dtype)
+                print(f"Room '{room_name}': {migrated} users migrated from legacy '<user>_emb.pt' files.")
+            except Exception as e:
+                print(f"Room '{room_name}' has legacy '<user>_emb.pt' files that cannot be migrated: {e!r}. "
+                      f"Run 'python -m src.face_recognition.room_storage {self.room_path}' to migrate them.")
+        return storage
+
+    def get_room_index(self, room_name):
+        """
+        Returns the up to date in-memory embedding index of a specific room.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room.
+
+        Returns
+        -------
+        RoomIndex
+            The embedding index of the room.
+        """
+        index = self._indexes.get(room_name)
+        if index is None:
+            index = RoomIndex(self.get_room_storage(room_name))
+            index.refresh()
+            self._indexes[room_name] = index
+        elif self._watcher is None:
+            index.refresh()
+        return index
+
+    def watch(self, callback=None, interval=1.0):
+        """
+        Refreshes the indexes of the opened rooms in a background thread, so that authorization does not check
+        the room storages on every frame and changes made by other processes are picked up within interval seconds.
+
+        Parameters
+        ----------
+        callback: Optional[Callable[[str], None]]
+            Called from the watcher thread with the name of every room that changed.
+        interval: float
+            Seconds between two checks of the room storages.
+        """
+        if callback is not None:
+            self._callbacks.append(callback)
+        if self._watcher is None:
+            self._watch_stop.clear()
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='room-watcher', daemon=True)
+            self._watcher.start()
+
+    def unwatch(self):
+        """
+        Stops the watcher thread, the indexes are refreshed on every access again.
+        """
+        if self._watcher is not None:
+            self._watch_stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval):
+        while not self._watch_stop.wait(interval):
+            for room_name, index in list(self._indexes.items()):
+                try:
+                    changed = index.refresh()
+                except Exception as e:
+                    # The room is retried on the next check instead of stopping the watcher
+                    print(f"Room '{room_name}' cannot be refreshed: {e!r}")
+                    continue
+                if changed:
+                    for callback in self._callbacks:
+                        callback(room_name)
+
+    def _changed(self, room_name):
+        # Writes of this process are visible immediately, without waiting for the watcher
+        index = self._indexes.get(room_name)
+        if index is not None:
+            index.refresh()
+
+    def get_template_store(self, room_name):
+        """
+        Returns the template store of a specific room.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room.
+
+        Returns
+        -------
+        TemplateStore
+            The templates of every user of the room.
+        """
+        if room_name not in self._templates:
+            self._templates[room_name] = TemplateStore(os.path.join(self.room_path, room_name), dtype=self.dtype,
+                                                       max_templates=self.max_templates)
+        return self._templates[room_name]
+
+    @contextmanager
+    def _transaction(self, room_name, replaced=(), removed=()):
+        """
+        Writes the templates and the stored centroids of users as one transaction. The users are recorded in a
+        pending file before the templates are written, and the file is removed once the centroids are committed.
+        A transaction that is interrupted in between is completed by the next transaction of the room.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room.
+        replaced: Sequence[str]
+            Users whose templates are written, their centroids are recomputed from the templates on recovery.
+        removed: Sequence[str]
+            Users whose templates and centroids are removed.
+        """
+        room_path = os.path.join(self.room_path, room_name)
+        os.makedirs(room_path, exist_ok=True)
+        pending_path = os.path.join(room_path, PENDING_FILENAME)
+        with _file_lock(os.path.join(room_path, TRANSACTION_LOCK_FILENAME)):
+            self._recover(room_name)
+            with open(pending_path + '.tmp', 'w') as f:
+                json.dump({'replaced': list(replaced), 'removed': list(removed)}, f)
+            os.replace(pending_path + '.tmp', pending_path)
+            yield
+            os.remove(pending_path)
+
+    def _recover(self, room_name):
+        """
+        Completes an interrupted transaction of a room. Must hold the transaction lock of the room.
+        """
+        pending_path = os.path.join(self.room_path, room_name, PENDING_FILENAME)
+        try:
+            with open(pending_path) as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            return
+        store = self.get_template_store(room_name)
+        storage = self.get_room_storage(room_name)
+        # Users whose new templates were not written keep their old templates and centroid
+        replaced = [user_id for user_id in pending['replaced'] if len(store.get(user_id))]
+        if replaced:
+            storage.replace(replaced, np.stack([normalized_centroid(store.get(user_id)) for user_id in replaced]))
+        if pending['removed']:
+            store.remove(pending['removed'])
+            storage.remove(pending['removed'])
+        os.remove(pending_path)
+        self._changed(room_name)
+        print(f"Interrupted write of room '{room_name}' is completed.")
 
     def create_room(self, room_name):
         """
@@ -25,6 +244,7 @@ class AuthorizationDatabase:
     def add_user(self, room_name, user_id, embedding):
         """
         Adds a user to the authorized users for a specific room, along with their embedding.
+        Several embeddings of the user are stored as templates and matched through their centroid.
 
         Parameters
         ----------
@@ -33,20 +253,68 @@ class AuthorizationDatabase:
         user_id: str
             The unique identifier for the user.
         embedding: torch.Tensor
-            The embedding of the user, represented as a torch tensor.
+            The embedding of the user, or several embeddings with shape (number of embeddings, embedding size).
         """
         room_path = os.path.join(self.room_path, room_name)
         if not os.path.exists(room_path):
             print(f'Room {room_name} not exists. Creating...')
             os.makedirs(room_path)
 
-        user_embedding_path = os.path.join(room_path, f'{user_id}_emb.pt')
-        if os.path.exists(user_embedding_path):
+        if user_id in self.list_users(room_name):
             print(f"User '{user_id}' is already authorized in room '{room_name}'. Please remove it first to add again.")
         else:
-            torch.save(embedding, user_embedding_path)
+            with self._transaction(room_name, replaced=[user_id]):
+                templates = self.get_template_store(room_name).add(user_id, embedding)
+                self.get_room_storage(room_name).append([user_id], normalized_centroid(templates))
+            self._changed(room_name)
             print(f"User '{user_id}' is added to authorized users for room '{room_name}'.")
 
+    def add_users(self, room_name, user_ids, embeddings=None, replace=False, templates=None):
+        """
+        Adds several users to the authorized users for a specific room in a single write.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room to which the users will be added.
+        user_ids: List[str]
+            The unique identifiers for the users.
+        embeddings: torch.Tensor
+            The embeddings of the users with shape (number of users, embedding size). Not needed if templates are given.
+        replace: bool, optional
+            Whether to replace the embeddings of already authorized users. Otherwise they are skipped.
+        templates: Optional[List[np.ndarray]]
+            Several embeddings of every user, e.g. one per enrollment photo. The centroid of the kept templates
+            is stored as the embedding of the user.
+
+        Returns
+        -------
+        List[str]
+            The unique identifiers of the users that are added or replaced.
+        """
+        if templates is None:
+            templates = list(prepare_embeddings(embeddings)[:, None])
+        templates = [prepare_embeddings(user_templates) for user_templates in templates]
+        templates = [user_templates[select_diverse(user_templates, self.max_templates)] for user_templates in templates]
+        rows = np.stack([normalized_centroid(user_templates) for user_templates in templates])
+        storage = self.get_room_storage(room_name)
+        stored = set(storage.load()[0])
+        duplicates = [user_id for user_id in user_ids if user_id in stored]
+        if duplicates and not replace:
+            print(f"Users {duplicates} are already authorized in room '{room_name}' and are skipped.")
+            keep = [i for i, user_id in enumerate(user_ids) if user_id not in stored]
+            user_ids, rows, templates = [user_ids[i] for i in keep], rows[keep], [templates[i] for i in keep]
+        if not user_ids:
+            return []
+
+        with self._transaction(room_name, replaced=user_ids):
+            self.get_template_store(room_name).replace(dict(zip(user_ids, templates)))
+            # A single journal append keeps the whole batch a single transaction
+            storage.replace(user_ids, rows)
+        self._changed(room_name)
+        print(f"{len(user_ids)} users are added to authorized users for room '{room_name}'.")
+        return list(user_ids)
+
     def remove_user(self, room_name, user_id):
         """
         Removes a user from the authorized users for a specific room.
@@ -58,14 +326,34 @@ class AuthorizationDatabase:
         user_id: str
             The unique identifier for the user.
         """
-        room_path = os.path.join(self.room_path, room_name)
-        user_embedding_path = os.path.join(room_path, f'{user_id}_emb.pt')
-        if os.path.exists(user_embedding_path):
-            os.remove(user_embedding_path)
+        removed = 0
+        if os.path.isdir(os.path.join(self.room_path, room_name)):
+            with self._transaction(room_name, removed=[user_id]):
+                self.get_template_store(room_name).remove([user_id])
+                removed = self.get_room_storage(room_name).remove([user_id])
+        if removed:
+            self._changed(room_name)
             print(f"User '{user_id}' has been removed from room '{room_name}'.")
         else:
             print("Failed! User '{user_id}' is not authorized in room '{room_name}'")
 
+    def list_users(self, room_name):
+        """
+        Lists the authorized users of a specific room.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room.
+
+        Returns
+        -------
+        List[str]
+            The unique identifiers of the authorized users.
+        """
+        return list(self.get_room_index(room_name).user_ids)
+
+    @instrument('database.authorize')
     def authorize_user(self, room_name, new_embedding, threshold=0.7):
         """
         Authorizes a user in a specific room based on their embedding similarity.
@@ -92,21 +380,198 @@ class AuthorizationDatabase:
             print(f"Room '{room_name}' does not exist.")
             return False
 
-        user_ids = []
-        room_embeddings = []
-        for filename in os.listdir(room_path):
-            if filename.endswith('.pt'):
-                user_id, _ = os.path.splitext(filename)
-                saved_embedding = torch.load(os.path.join(room_path, filename))
-                similarity = cosine_similarity(new_embedding, saved_embedding).item()
-                room_embeddings.append(similarity)
-                user_ids.append(user_id.split('_')[0])
-
-        if room_embeddings:
-            max_similarity_idx = room_embeddings.index(max(room_embeddings))
-            max_similarity = max(room_embeddings)
+        matches = self.get_room_index(room_name).search(new_embedding, k=max(1, self.template_recheck_k))
+        if matches:
+            query = prepare_embeddings(new_embedding)[0]
+            authorized_user, max_similarity = self._recheck_templates(room_name, query, matches)
             if max_similarity > threshold:
-                authorized_user = user_ids[max_similarity_idx]
+                increment('matches')
+                self._learn(room_name, authorized_user, query, max_similarity)
                 return True, authorized_user, max_similarity
+            increment('rejections')
             return False, None, max_similarity
-        return False, None, None
\ No newline at end of file
+        return False, None, None
+
+    @instrument('database.authorize')
+    def authorize_users(self, room_name, new_embeddings, threshold=0.7):
+        """
+        Authorizes a batch of users in a specific room with a single similarity matrix computation.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room for authorization.
+        new_embeddings: torch.Tensor
+            The embeddings of the users to be authorized with shape (number of users, embedding size).
+        threshold: float, optional
+            The similarity threshold for authorization. Default is 0.7.
+
+        Returns
+        -------
+        List[Tuple[bool, str, float]]
+            The result of authorize_user for every embedding, in the same order.
+        """
+        if not os.path.exists(os.path.join(self.room_path, room_name)):
+            print(f"Room '{room_name}' does not exist.")
+            return [(False, None, None) for _ in range(len(new_embeddings))]
+
+        results = []
+        queries = prepare_embeddings(new_embeddings)
+        for query, matches in zip(queries, self.get_room_index(room_name).search_batch(new_embeddings, k=max(1, self.template_recheck_k))):
+            if matches:
+                user_id, similarity = self._recheck_templates(room_name, query, matches)
+                results.append((similarity > threshold, user_id if similarity > threshold else None, similarity))
+                if similarity > threshold:
+                    self._learn(room_name, user_id, query, similarity)
+            else:
+                results.append((False, None, None))
+        authorized = sum(is_auth for is_auth, _, _ in results)
+        increment('matches', authorized)
+        increment('rejections', len(results) - authorized)
+        return results
+
+    def update_identity(self, room_name, user_id, new_embedding):
+        """
+        Adds an authenticated embedding as a template of a user and updates the user's centroid in place.
+        Embeddings that are nearly identical to a stored template are skipped.
+
+        Parameters
+        ----------
+        room_name: str
+            The name of the room of the user.
+        user_id: str
+            The unique identifier for the user.
+        new_embedding: torch.Tensor
+            The authenticated embedding of the user.
+
+        Returns
+        -------
+        bool
+            True if the embedding is added as a template.
+        """
+        index = self.get_room_index(room_name)
+        if user_id not in index.user_ids:
+            return False
+        query = prepare_embeddings(new_embedding)
+        store = self.get_template_store(room_name)
+        templates = store.get(user_id)
+        if len(templates) and float((templates @ query[0]).max()) >= self.template_redundancy:
+            return False
+
+        with self._transaction(room_name, replaced=[user_id]):
+            if not len(templates):
+                # Users enrolled before templates were stored start from their stored embedding
+                templates = store.add(user_id, index.embeddings[index.user_ids.index(user_id)].numpy())
+                if float((templates @ query[0]).max()) >= self.template_redundancy:
+                    return False
+            centroid = normalized_centroid(store.add(user_id, query))
+            self.get_room_storage(room_name).replace([user_id], centroid)
+        self._changed(room_name)
+        increment('database.template_updates')
+        return True
+
+    def _recheck_templates(self, room_name, query, matches):
+        """
+        Scores the centroid search candidates by their most similar template and returns the best (user_id, similarity)
+        """
+        if not self.template_recheck_k:
+            return matches[0]
+        store = self.get_template_store(room_name)
+        best = None
+        for user_id, similarity in matches:
+            templates = store.get(user_id)
+            if len(templates):
+                similarity = max(similarity, float((templates @ query).max()))
+            if best is None or similarity > best[1]:
+                best = (user_id, similarity)
+        return best
+
+    def _learn(self, room_name, user_id, query, similarity):
+        if self.update_threshold is not None and similarity >= self.update_threshold:
+            self.update_identity(room_name, user_id, query)
+
+    def list_rooms(self):
+        """
+        Lists the names of all rooms.
+        """
+        if not os.path.isdir(self.room_path):
+            return []
+        return sorted(room_name for room_name in os.listdir(self.room_path)
+                      if not room_name.startswith('.') and os.path.isdir(os.path.join(self.room_path, room_name)))
+
+    def get_global_index(self):
+        """
+        Returns the nearest neighbour index of every user of every room, persisted under '<room_path>/.ann'.
+        Only the rooms that changed since the index was last synchronized are re-indexed.
+
+        Returns
+        -------
+        ANNIndex
+            The index of all enrolled users, with '<room>/<user>' ids.
+        """
+        index_dir = os.path.join(self.room_path, GLOBAL_INDEX_DIRECTORY)
+        index_path = os.path.join(index_dir, 'index.npz')
+        signatures_path = os.path.join(index_dir, 'rooms.json')
+        if self._global_index is None:
+            if os.path.exists(index_path) and os.path.exists(signatures_path):
+                self._global_index = ANNIndex.load(index_path)
+                with open(signatures_path) as f:
+                    self._global_signatures = json.load(f)
+            else:
+                self._global_index = create_ann_index(self.ann_backend, **self.ann_params)
+                self._global_signatures = {}
+
+        index, signatures = self._global_index, self._global_signatures
+        rooms = self.list_rooms()
+        changed = [room_name for room_name in signatures if room_name not in rooms]
+        room_indexes = {}
+        for room_name in rooms:
+            room_indexes[room_name] = self.get_room_index(room_name)
+            signature = room_indexes[room_name].signature
+            if signatures.get(room_name) != (list(signature) if signature else None):
+                changed.append(room_name)
+        if not changed:
+            return index
+
+        prefixes = tuple(f'{room_name}/' for room_name in changed)
+        index.remove([id_ for id_ in index.ids if id_.startswith(prefixes)])
+        for room_name in changed:
+            signatures.pop(room_name, None)
+            room_index = room_indexes.get(room_name)
+            if room_index is None:
+                continue
+            if len(room_index):
+                index.add([f'{room_name}/{user_id}' for user_id in room_index.user_ids], room_index.embeddings.numpy())
+            signatures[room_name] = list(room_index.signature) if room_index.signature else None
+
+        # The index is saved trained, so that the processes loading it do not retrain it
+        index.build()
+        os.makedirs(index_dir, exist_ok=True)
+        index.save(index_path)
+        with open(signatures_path, 'w') as f:
+            json.dump(signatures, f)
+        return index
+
+    def identify(self, new_embedding, k=5):
+        """
+        Finds the most similar users across every room.
+
+        Parameters
+        ----------
+        new_embedding: torch.Tensor
+            The embedding of the user to be identified.
+        k: int, optional
+            The number of most similar users to return. Default is 5.
+
+        Returns
+        -------
+        List[Tuple[str, str, float]]
+            Room name, user ID and similarity score of the k most similar users, in descending similarity order.
+        """
+        index = self.get_global_index()
+        query = prepare_embeddings(new_embedding)
+        if len(index) <= self.exact_search_limit:
+            matches = index.search_exact(query, k)[0]
+        else:
+            matches = index.search(query, k)[0]
+        return [(*id_.split('/', 1), score) for id_, score in matches]
@@ -1,25 +1,203 @@
-from torchvision import transforms
-from facenet_pytorch import InceptionResnetV1
+import json
+import os
+from glob import glob
+
+import numpy as np
+import torch
+from torch.nn.functional import cosine_similarity, interpolate
 
 from src.face_recognition.base_face_recognition import BaseEmbeddingModel
+from src.instrumentation import increment, timed
+from src.weights import load_inception
+
+IMAGE_SIZE = 160
+PRECISIONS = ('fp32', 'bf16', 'int8')
+COMPILE_MODES = (None, 'torchscript', 'torch_compile')
+CALIBRATION_BATCH_SIZE = 32
 
 class InceptionModel(BaseEmbeddingModel):
-    def __init__(self, device='cpu'):
+    def __init__(self, device='cpu', precision='fp32', channels_last=False, compile_mode=None, pretrained='vggface2',
+                 weights_dir=None, artifact=None, warmup=False, allow_download=False, calibration_images=None):
+        """
+        Parameters
+        ----------
+        device: str
+            Device to run the model on.
+        precision: str
+            Inference precision. 'fp32', 'bf16' (autocast, where the hardware supports it) or 'int8'
+            (static quantization of the convolutions and linear layers, CPU only).
+        channels_last: bool
+            Whether to run the convolutions in channels-last memory layout.
+        compile_mode: Optional[str]
+            None to run the model eagerly, 'torchscript' to trace and freeze it or 'torch_compile' to compile it with torch.compile.
+        pretrained: Optional[str]
+            Pretrained weights of InceptionResnetV1, 'vggface2' or 'casia-webface'. None keeps random weights, e.g. for benchmarks.
+        weights_dir: Optional[str]
+            Directory of the local weight cache, see src.weights. Defaults to FACE_AUTH_WEIGHTS or 'weights'.
+        artifact: Optional[str]
+            Path of a ready-to-run TorchScript engine. It is loaded instead of building the engine if it exists,
+            otherwise the engine is built and saved to it. The precision and memory layout of the artifact are used.
+        warmup: bool
+            Whether to run a dummy batch after loading, so that the first authentication does not pay for lazy initialization.
+        allow_download: bool
+            Whether to download the pretrained weights if they are not in the weight cache. A missing file raises FileNotFoundError otherwise.
+        calibration_images: Optional[Union[str, List[Union[PIL.Image.Image, np.ndarray]]]]
+            Face images, or a glob pattern of face image files, whose activation ranges calibrate the int8 engine.
+            Required to build an int8 engine, a few hundred faces of the target cameras are enough.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision '{precision}'. Use one of {PRECISIONS}")
+        if compile_mode not in COMPILE_MODES:
+            raise ValueError(f"Unsupported compile mode '{compile_mode}'. Use one of {COMPILE_MODES}")
+        if precision == 'int8' and device != 'cpu':
+            raise ValueError('int8 quantization is only supported on cpu')
+
         self.device = device
-        self.facenet = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
-        self.transform = transforms.Compose([
-            transforms.Resize((160, 160)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-        ])
+        self.precision = precision
+        self.channels_last = channels_last
+        self.compile_mode = compile_mode
+        self.pretrained = pretrained
+        self.weights_dir = weights_dir
+        self.allow_download = allow_download
+        self.calibration_images = calibration_images
+        if artifact is not None and os.path.exists(artifact):
+            self.facenet = self._load_artifact(artifact)
+        else:
+            self.facenet = self._build_engine(load_inception(pretrained, weights_dir, allow_download).to(self.device))
+            if artifact is not None:
+                self.save_artifact(artifact)
+        if warmup:
+            self.warmup()
+
+    def _build_engine(self, model):
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        if self.precision == 'int8':
+            model = self._quantize(model)
+        if self.compile_mode == 'torchscript':
+            example = self._prepare_batch(torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+            with torch.no_grad():
+                model = torch.jit.freeze(torch.jit.trace(model, example))
+        elif self.compile_mode == 'torch_compile':
+            model = torch.compile(model)
+        return model
+
+    def _quantize(self, model):
+        """
+        Quantizes the convolutions and linear layers to int8 with FX graph mode post-training static quantization.
+        Dynamic quantization would only cover the final linear layer, which is a negligible part of the forward pass.
+        """
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        images = self.calibration_images
+        if isinstance(images, str):
+            from PIL import Image
+
+            images = [Image.open(path).convert('RGB') for path in sorted(glob(images))]
+        if not images:
+            raise ValueError('int8 quantization needs calibration_images, face images to calibrate the activation ranges')
+        example = self._prepare_batch(torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+        model = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), (example,))
+        with torch.inference_mode():
+            for start in range(0, len(images), CALIBRATION_BATCH_SIZE):
+                model(self._prepare_batch(self.preprocess(images[start:start + CALIBRATION_BATCH_SIZE])))
+        return convert_fx(model)
+
+    def save_artifact(self, path):
+        """
+        Saves the engine as a frozen TorchScript module that is loaded without facenet_pytorch or tracing.
+
+        Parameters
+        ----------
+        path: str
+            Path of the artifact.
+        """
+        if self.compile_mode == 'torch_compile' or self.precision == 'bf16':
+            raise ValueError('Only fp32 and int8 engines without torch.compile can be saved as an artifact')
+        engine = self.facenet
+        if not isinstance(engine, torch.jit.ScriptModule):
+            example = self._prepare_batch(torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+            with torch.no_grad():
+                engine = torch.jit.freeze(torch.jit.trace(engine, example))
+        metadata = {'precision': self.precision, 'channels_last': self.channels_last, 'pretrained': self.pretrained}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        torch.jit.save(engine, path + '.tmp', _extra_files={'engine.json': json.dumps(metadata)})
+        os.replace(path + '.tmp', path)
+
+    def _load_artifact(self, path):
+        extra_files = {'engine.json': ''}
+        engine = torch.jit.load(path, map_location=self.device, _extra_files=extra_files)
+        metadata = json.loads(extra_files['engine.json'])
+        self.precision = metadata['precision']
+        self.channels_last = metadata['channels_last']
+        self.pretrained = metadata.get('pretrained', self.pretrained)
+        self.compile_mode = 'torchscript'
+        return engine
+
+    def warmup(self, batch_sizes=(1,)):
+        """
+        Runs dummy batches through the engine to trigger lazy initialization, e.g. the TorchScript
+        profiling runs and the allocation of the working memory.
+
+        Parameters
+        ----------
+        batch_sizes: Tuple[int]
+            Batch sizes to run.
+        """
+        for batch_size in batch_sizes:
+            for _ in range(2):
+                self._forward(torch.zeros(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE))
+
+    def _prepare_batch(self, batch):
+        batch = batch.to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    def preprocess(self, images):
+        """
+        Resizes the face images to 160x160 and normalizes them to [-1, 1] in a single batch tensor.
+        NumPy arrays, e.g. the face views of a DetectionResult, are read without copying them first.
+
+        Parameters
+        ----------
+        images: List[Union[PIL.Image.Image, np.ndarray]]
+            RGB face images, PILLOW Images or uint8 arrays with shape (height, width, 3).
+
+        Returns
+        -------
+        torch.Tensor
+            The input batch of the model with shape (number of images, 3, 160, 160).
+        """
+        batch = torch.empty(len(images), 3, IMAGE_SIZE, IMAGE_SIZE)
+        for i, image in enumerate(images):
+            if not isinstance(image, np.ndarray):
+                image = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+            pixels = torch.from_numpy(image).permute(2, 0, 1).unsqueeze(0).float()
+            if pixels.shape[2:] == (IMAGE_SIZE, IMAGE_SIZE):
+                batch[i] = pixels[0]
+            else:
+                batch[i] = interpolate(pixels, size=(IMAGE_SIZE, IMAGE_SIZE), mode='bilinear', align_corners=False, antialias=True)[0]
+        # ToTensor and Normalize(0.5, 0.5) in one pass: x / 255 * 2 - 1
+        return batch.mul_(2 / 255).sub_(1)
+
+    def _forward(self, batch):
+        increment('embeddings', len(batch))
+        with timed('recognition.embedding'), torch.inference_mode():
+            batch = self._prepare_batch(batch)
+            if self.precision == 'bf16':
+                with torch.autocast(device_type=torch.device(self.device).type, dtype=torch.bfloat16):
+                    return self.facenet(batch).float()
+            return self.facenet(batch)
 
     def get_embedding(self, image):
         """
-        Retrieves the embedding of a given PIL Image.
+        Retrieves the embedding of a given PIL Image or RGB uint8 array.
 
         Parameters
         ----------
-        image: PIL.Image.Image
+        image: Union[PIL.Image.Image, np.ndarray]
             The input image for which the embedding is to be obtained.
 
         Returns
@@ -27,5 +205,53 @@ class InceptionModel(BaseEmbeddingModel):
         torch.Tensor
             The embedding of the input image.
         """
-        image = self.transform(image).unsqueeze(0).to(self.device)
-        return self.facenet(image)
\ No newline at end of file
+        return self._forward(self.preprocess([image]))
+
+    def get_embeddings(self, images):
+        """
+        Retrieves the embeddings of a list of PIL Images or RGB uint8 arrays in a single forward pass.
+
+        Parameters
+        ----------
+        images: List[Union[PIL.Image.Image, np.ndarray]]
+            The input images for which the embeddings are to be obtained.
+
+        Returns
+        -------
+        torch.Tensor
+            The embeddings of the input images with shape (number of images, embedding size).
+        """
+        with timed('recognition.preprocess'):
+            batch = self.preprocess(images)
+        return self._forward(batch)
+
+    def compare_to_baseline(self, images, baseline=None):
+        """
+        Measures how much the embeddings of this engine deviate from the fp32 eager baseline with the same weights.
+
+        Parameters
+        ----------
+        images: List[PIL.Image.Image]
+            Face images to compare the embeddings on.
+        baseline: Optional[InceptionModel]
+            The fp32 eager model to compare against. If not provided, one is built from the same pretrained
+            weights as this engine, which is not possible for random weights.
+
+        Returns
+        -------
+        dict
+            Mean and minimum cosine similarity and maximum absolute difference between the embeddings of both models.
+        """
+        if baseline is None:
+            if self.pretrained is None:
+                raise ValueError('The baseline of an engine with random weights must be given')
+            baseline = InceptionModel(device=self.device, pretrained=self.pretrained, weights_dir=self.weights_dir,
+                                      allow_download=self.allow_download)
+        expected = baseline.get_embeddings(images).float().cpu()
+        actual = self.get_embeddings(images).float().cpu()
+        similarities = cosine_similarity(expected, actual)
+        return {
+            'mean_cosine_similarity': similarities.mean().item(),
+            'min_cosine_similarity': similarities.min().item(),
+            'max_abs_difference': (expected - actual).abs().max().item(),
+        }
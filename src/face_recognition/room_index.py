@@ -0,0 +1,158 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import torch
+from torch.nn.functional import normalize
+
+from src.face_recognition.room_storage import RoomStorage, apply_journal
+from src.instrumentation import increment, timed
+
+
+class _IndexState(NamedTuple):
+    user_ids: List[str]
+    embeddings: Optional[torch.Tensor]
+    signature: Optional[tuple]
+    rows: Dict[str, List[int]]
+    count: int
+    ids_size: int
+    generation: int
+
+
+class RoomIndex:
+    """
+    In-memory embedding index of a single room.
+
+    All authorized embeddings of the room are kept L2-normalized in one contiguous
+    matrix, so that matching a new embedding is a single matrix-vector product.
+    The matrix is memory-mapped from the room storage, so loading it does not copy
+    the embeddings of float32 rooms unless the journal has dead rows.
+
+    The user ids and the matrix are replaced together by a single assignment on refresh,
+    so searches running in other threads see either the old or the new index.
+
+    Attributes
+    ----------
+    storage: RoomStorage
+        Storage of the room the index is built from.
+    user_ids: List[str]
+        User ids, aligned with the rows of the embedding matrix.
+    embeddings: torch.Tensor
+        Normalized embedding matrix with shape (number of users, embedding size).
+    """
+
+    def __init__(self, storage: RoomStorage):
+        self.storage = storage
+        self._state = _IndexState([], None, None, {}, 0, 0, 0)
+
+    def __len__(self) -> int:
+        return len(self._state.user_ids)
+
+    @property
+    def user_ids(self) -> List[str]:
+        return self._state.user_ids
+
+    @property
+    def embeddings(self) -> Optional[torch.Tensor]:
+        return self._state.embeddings
+
+    @property
+    def signature(self):
+        """
+        Storage signature the index was last refreshed from, None if the room storage does not exist.
+        """
+        return self._state.signature
+
+    def refresh(self) -> bool:
+        """
+        Synchronizes the index with the room storage if the storage has changed since the last refresh.
+        After an append only the new journal entries are read, the embedding matrix is re-mapped without copying.
+
+        Returns
+        -------
+        bool
+            True if the index changed.
+        """
+        signature = self.storage.signature()
+        if signature == self._state.signature:
+            increment('database.index_cache_hits')
+            return False
+        increment('database.index_reloads')
+        with timed('database.index_refresh'):
+            self._reload(signature)
+        return True
+
+    def _reload(self, signature) -> None:
+        state = self._state
+        if signature is None:
+            self._state = _IndexState([], None, None, {}, 0, 0, 0)
+            return
+
+        snapshot = None
+        if state.signature is not None:
+            # None if the journal was compacted since the last refresh, its files may even reuse the inode
+            snapshot = self.storage.snapshot(ids_start=state.ids_size, row_start=state.count, generation=state.generation)
+        if snapshot is not None:
+            rows = apply_journal({user_id: list(user_rows) for user_id, user_rows in state.rows.items()}, snapshot.user_ids,
+                                 start=state.count, unique=self.storage.unique)
+        else:
+            snapshot = self.storage.snapshot()
+            rows = self.storage.live_rows(snapshot)
+
+        count = len(snapshot.matrix)
+        live = sorted((row, user_id) for user_id, user_rows in rows.items() for row in user_rows)
+        embeddings = None
+        if live:
+            embeddings = torch.from_numpy(snapshot.matrix)
+            if len(live) < count:
+                embeddings = embeddings[[row for row, _ in live]]
+            embeddings = embeddings if embeddings.dtype == torch.float32 else embeddings.float()
+        self._state = _IndexState([user_id for _, user_id in live], embeddings, snapshot.signature, rows, count, snapshot.ids_size,
+                                  snapshot.generation)
+
+    def search(self, embedding: torch.Tensor, k: int = 1) -> List[Tuple[str, float]]:
+        """
+        Finds the most similar users to the given embedding.
+
+        Parameters
+        ----------
+        embedding: torch.Tensor
+            The embedding to be searched.
+        k: int
+            Number of most similar users to return.
+
+        Returns
+        -------
+        List[Tuple[str, float]]
+            User ids and cosine similarities of the k most similar users, in descending similarity order.
+        """
+        state = self._state
+        if not state.user_ids:
+            return []
+        query = normalize(embedding.detach().reshape(1, -1).float().cpu(), dim=1)[0]
+        similarities = state.embeddings @ query
+        scores, indices = torch.topk(similarities, min(k, len(state.user_ids)))
+        return [(state.user_ids[i], score) for i, score in zip(indices.tolist(), scores.tolist())]
+
+    def search_batch(self, embeddings: torch.Tensor, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """
+        Finds the most similar users to each of the given embeddings with a single matrix product.
+
+        Parameters
+        ----------
+        embeddings: torch.Tensor
+            The embeddings to be searched with shape (number of embeddings, embedding size).
+        k: int
+            Number of most similar users to return per embedding.
+
+        Returns
+        -------
+        List[List[Tuple[str, float]]]
+            For every embedding, user ids and cosine similarities of the k most similar users.
+        """
+        state = self._state
+        queries = normalize(embeddings.detach().reshape(len(embeddings), -1).float().cpu(), dim=1)
+        if not state.user_ids:
+            return [[] for _ in range(len(queries))]
+        similarities = queries @ state.embeddings.T
+        scores, indices = torch.topk(similarities, min(k, len(state.user_ids)), dim=1)
+        return [[(state.user_ids[i], score) for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices.tolist(), scores.tolist())]
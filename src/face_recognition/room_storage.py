@@ -0,0 +1,537 @@
+import argparse
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.nn.functional import normalize
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) writers are only serialized within a process
+    fcntl = None
+
+MATRIX_FILENAME = 'embeddings.bin'
+IDS_FILENAME = 'ids.txt'
+LEGACY_SUFFIX = '_emb.pt'
+LOCK_FILENAME = '.lock'
+TOMBSTONE = '\0'
+
+MAGIC = b'FAROOM01'
+HEADER_FORMAT = '<8sHHIQQ'
+HEADER_SIZE = 32
+COUNT_OFFSET = struct.calcsize('<8sHHI')
+DTYPES = {1: np.float32, 2: np.float16}
+DTYPE_CODES = {np.dtype(dtype).name: code for code, dtype in DTYPES.items()}
+
+_local_locks: Dict[str, threading.Lock] = {}
+
+
+def prepare_embeddings(embeddings) -> np.ndarray:
+    """
+    Converts embeddings to a L2-normalized float32 matrix with one embedding per row.
+
+    Parameters
+    ----------
+    embeddings: Union[torch.Tensor, np.ndarray]
+        A single embedding or a batch of embeddings.
+
+    Returns
+    -------
+    np.ndarray
+        Normalized embeddings with shape (number of embeddings, embedding size).
+    """
+    embeddings = torch.as_tensor(embeddings).detach().float().cpu()
+    embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+    return normalize(embeddings, dim=1).numpy()
+
+
+class RoomSnapshot(NamedTuple):
+    """
+    Immutable view of the committed journal of a room storage. Later appends are not visible in it, and a
+    compaction replaces the files without invalidating the memory-mapped matrix.
+
+    Attributes
+    ----------
+    user_ids: List[str]
+        Id line of every row, tombstones included.
+    matrix: np.ndarray
+        Memory-mapped rows with shape (number of rows, embedding size).
+    signature: Optional[tuple]
+        Signature of the matrix file the snapshot is read from, None if the storage does not exist.
+    ids_size: int
+        Committed size of the id file in bytes.
+    generation: int
+        Compaction generation of the storage the snapshot is read from.
+    """
+    user_ids: List[str]
+    matrix: np.ndarray
+    signature: Optional[tuple]
+    ids_size: int
+    generation: int = 0
+
+
+def is_tombstone(user_id: str) -> bool:
+    return user_id.startswith(TOMBSTONE)
+
+
+def apply_journal(rows: Dict[str, List[int]], user_ids: Sequence[str], start: int = 0, unique: bool = True) -> Dict[str, List[int]]:
+    """
+    Applies journal entries to the live rows of every user, in place.
+
+    Parameters
+    ----------
+    rows: Dict[str, List[int]]
+        Live row indices of every user, updated in place.
+    user_ids: Sequence[str]
+        Id lines of the rows starting at start.
+    start: int
+        Row index of the first id line.
+    unique: bool
+        Whether a row supersedes the earlier rows of its user. Otherwise the rows of a user accumulate until a tombstone.
+
+    Returns
+    -------
+    Dict[str, List[int]]
+        The updated live rows.
+    """
+    for row, user_id in enumerate(user_ids, start):
+        if is_tombstone(user_id):
+            rows.pop(user_id[len(TOMBSTONE):], None)
+        elif unique:
+            rows.pop(user_id, None)
+            rows[user_id] = [row]
+        else:
+            rows.setdefault(user_id, []).append(row)
+    return rows
+
+
+@contextmanager
+def _file_lock(path: str):
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b') as f:
+        if fcntl is None:
+            with _local_locks.setdefault(os.path.abspath(path), threading.Lock()):
+                yield f
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class RoomStorage:
+    """
+    Single-file, append-only embedding journal of a room.
+
+    The embeddings of a room are stored as one matrix file with a fixed size header followed by the
+    normalized embeddings as float32 or float16 rows, and a sidecar text file with one user id per line.
+    The header stores the number of committed rows and the committed size of the id file, and it is written
+    last, so rows and ids appended after them are not visible to readers until the append is complete.
+
+    Rows are never modified after they are committed. Updating a user appends a row that supersedes the
+    earlier ones and removing a user appends a tombstone, so readers access the committed rows without locks.
+    Once the superseded rows outnumber the live ones, the journal is compacted into new files that are
+    renamed over the old ones. Writers of all processes are serialized by a lock file, which also holds a
+    generation number that readers check to detect a compaction while they read.
+
+    Attributes
+    ----------
+    room_path: str
+        Path of the room directory.
+    dtype: str
+        Data type of the rows, used when the matrix file is created. Either 'float32' or 'float16'.
+    unique: bool
+        Whether every user has a single live row. Otherwise rows of a user accumulate until they are removed.
+    compact_ratio: float
+        The journal is compacted when the number of dead rows exceeds compact_ratio times the number of live rows.
+    min_compact_rows: int
+        Number of dead rows below which the journal is never compacted.
+    """
+
+    def __init__(self, room_path: str, dtype: str = 'float32', unique: bool = True, compact_ratio: float = 1.0,
+                 min_compact_rows: int = 64):
+        if dtype not in DTYPE_CODES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}'. Use one of {list(DTYPE_CODES)}")
+        self.room_path = room_path
+        self.dtype = dtype
+        self.unique = unique
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        self.matrix_path = os.path.join(room_path, MATRIX_FILENAME)
+        self.ids_path = os.path.join(room_path, IDS_FILENAME)
+        self.lock_path = os.path.join(room_path, LOCK_FILENAME)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.matrix_path)
+
+    def signature(self):
+        """
+        Returns a value that changes whenever the storage files are modified.
+        """
+        try:
+            stat = os.stat(self.matrix_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def generation(self) -> int:
+        """
+        Returns the compaction generation. It is odd while the files are being replaced.
+        """
+        try:
+            with open(self.lock_path, 'rb') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds the writer lock of the storage, shared by all processes. Yields the open lock file.
+        """
+        os.makedirs(self.room_path, exist_ok=True)
+        with _file_lock(self.lock_path) as f:
+            yield f
+
+    def read_header(self, f=None) -> Tuple[np.dtype, int, int, int]:
+        """
+        Reads the header of the matrix file.
+
+        Returns
+        -------
+        Tuple[np.dtype, int, int, int]
+            Data type of the rows, embedding size, number of stored embeddings and committed size of the id file in bytes.
+        """
+        if f is None:
+            with open(self.matrix_path, 'rb') as f:
+                return self.read_header(f)
+        f.seek(0)
+        magic, _, dtype_code, dim, count, ids_size = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC:
+            raise ValueError(f"'{self.matrix_path}' is not a room embedding file")
+        return np.dtype(DTYPES[dtype_code]), dim, count, ids_size
+
+    def read_ids(self, start: int = 0, stop: int = None) -> List[str]:
+        """
+        Reads the committed id lines of the byte range [start, stop) of the id file.
+        """
+        if stop is None:
+            stop = self.read_header()[3]
+        with open(self.ids_path, 'rb') as f:
+            f.seek(start)
+            return f.read(stop - start).decode('utf-8').splitlines()
+
+    def snapshot(self, ids_start: int = 0, row_start: int = 0, generation: Optional[int] = None) -> Optional[RoomSnapshot]:
+        """
+        Reads a consistent snapshot of the committed journal without taking the writer lock.
+
+        Parameters
+        ----------
+        ids_start: int
+            Byte offset of the id file to read the ids from, to read only the ids appended after an earlier snapshot.
+        row_start: int
+            Number of rows of the earlier snapshot.
+        generation: Optional[int]
+            Compaction generation of the earlier snapshot.
+
+        Returns
+        -------
+        Optional[RoomSnapshot]
+            The committed rows, their id lines from ids_start on and the signature of the read files. None if the
+            journal was compacted since the earlier snapshot, which then has to be read from the start.
+        """
+        while True:
+            current = self.generation()
+            if current % 2:
+                time.sleep(0.001)
+                continue
+            if generation is not None and current != generation:
+                return None
+            try:
+                with open(self.matrix_path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    dtype, dim, count, ids_size = self.read_header(f)
+                    extends = ids_size >= ids_start and count >= row_start
+                    if extends:
+                        user_ids = self.read_ids(ids_start, ids_size)
+                        matrix = self.map_rows(dtype, dim, 0, count, f)
+            except FileNotFoundError:
+                if self.generation() != current:
+                    continue
+                if ids_start or row_start:
+                    return None
+                return RoomSnapshot([], np.empty((0, 0), dtype=np.float32), None, 0, current)
+            except (ValueError, UnicodeDecodeError):
+                # The files were replaced while they were read
+                if self.generation() == current:
+                    raise
+                continue
+            if self.generation() != current:
+                continue
+            if not extends:
+                return None
+            return RoomSnapshot(user_ids, matrix, (stat.st_ino, stat.st_size, stat.st_mtime_ns), ids_size, current)
+
+    def live_rows(self, snapshot: RoomSnapshot) -> Dict[str, List[int]]:
+        """
+        Returns the live row indices of every user of a snapshot read from the start of the journal.
+        """
+        return apply_journal({}, snapshot.user_ids, unique=self.unique)
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Memory-maps the live embeddings. They are not copied into memory unless the journal has dead rows.
+
+        Returns
+        -------
+        Tuple[List[str], np.ndarray]
+            User ids and the embedding matrix with shape (number of rows, embedding size), one id per row.
+        """
+        snapshot = self.snapshot()
+        user_ids, rows = [], []
+        for user_id, user_rows in self.live_rows(snapshot).items():
+            user_ids += [user_id] * len(user_rows)
+            rows += user_rows
+        if len(rows) == len(snapshot.matrix):
+            return snapshot.user_ids, snapshot.matrix
+        order = np.argsort(rows)
+        return [user_ids[i] for i in order], np.asarray(snapshot.matrix[np.asarray(rows)[order]])
+
+    def map_rows(self, dtype: np.dtype, dim: int, start: int, stop: int, f=None) -> np.ndarray:
+        """
+        Memory-maps the rows in [start, stop) of the matrix file, or of the given open matrix file.
+        """
+        if stop <= start:
+            return np.empty((0, dim), dtype=dtype)
+        offset = HEADER_SIZE + start * dim * dtype.itemsize
+        return np.memmap(f if f is not None else self.matrix_path, dtype=dtype, mode='c', offset=offset, shape=(stop - start, dim))
+
+    def _write_header(self, f, dtype: np.dtype, dim: int, count: int, ids_size: int) -> None:
+        header = struct.pack(HEADER_FORMAT, MAGIC, 1, DTYPE_CODES[dtype.name], dim, count, ids_size)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def _append(self, lines: Sequence[str], rows: np.ndarray) -> None:
+        # Must hold the writer lock
+        if not self.exists() or self.read_header()[2] == 0:
+            open(self.ids_path, 'wb').close()
+            with open(self.matrix_path, 'wb') as f:
+                self._write_header(f, np.dtype(self.dtype), rows.shape[1], 0, 0)
+
+        dtype, dim, count, ids_size = self.read_header()
+        if rows.shape[1] != dim:
+            raise ValueError(f'Embedding size {rows.shape[1]} does not match the room embedding size {dim}')
+
+        # Anything after the committed ids and rows is left over from an interrupted append
+        with open(self.ids_path, 'r+b') as f:
+            f.seek(ids_size)
+            f.write(''.join(f'{line}\n' for line in lines).encode('utf-8'))
+            f.truncate()
+            ids_size = f.tell()
+        with open(self.matrix_path, 'r+b') as f:
+            f.seek(HEADER_SIZE + count * dim * dtype.itemsize)
+            f.write(rows.astype(dtype).tobytes())
+            f.truncate()
+            f.flush()
+            f.seek(COUNT_OFFSET)
+            f.write(struct.pack('<QQ', count + len(rows), ids_size))
+
+    def append(self, user_ids: Sequence[str], embeddings) -> None:
+        """
+        Appends embeddings to the end of the matrix file without rewriting the stored rows.
+        In a unique storage, the embedding of an already stored user supersedes the stored one.
+
+        Parameters
+        ----------
+        user_ids: Sequence[str]
+            The unique identifiers of the users.
+        embeddings: Union[torch.Tensor, np.ndarray]
+            The embeddings of the users, one row per user.
+        """
+        rows = prepare_embeddings(embeddings)
+        if len(rows) != len(user_ids):
+            raise ValueError('Number of user ids and embeddings must match')
+        with self.lock():
+            self._append(user_ids, rows)
+
+    def replace(self, user_ids: Sequence[str], embeddings) -> None:
+        """
+        Replaces all rows of the given users with the given embeddings in a single append, so readers see
+        either the old or the new rows of every user.
+
+        Parameters
+        ----------
+        user_ids: Sequence[str]
+            The identifier of the user of every embedding. A user can have several embeddings if the storage is not unique.
+        embeddings: Union[torch.Tensor, np.ndarray]
+            The new embeddings, one per row.
+        """
+        rows = prepare_embeddings(embeddings)
+        if len(rows) != len(user_ids):
+            raise ValueError('Number of user ids and embeddings must match')
+        # Rows of a unique storage supersede the earlier rows of their users without tombstones
+        tombstones = [] if self.unique else [TOMBSTONE + user_id for user_id in dict.fromkeys(user_ids)]
+        with self.lock() as lock:
+            self._append(tombstones + list(user_ids), np.concatenate([np.zeros((len(tombstones), rows.shape[1]), dtype=np.float32), rows]))
+            self._maybe_compact(lock)
+
+    def remove(self, user_ids: Sequence[str]) -> int:
+        """
+        Removes the embeddings of the given users by appending tombstones.
+
+        Parameters
+        ----------
+        user_ids: Sequence[str]
+            The unique identifiers of the users to be removed.
+
+        Returns
+        -------
+        int
+            Number of removed rows.
+        """
+        with self.lock() as lock:
+            if not self.exists():
+                return 0
+            snapshot = self.snapshot()
+            live = self.live_rows(snapshot)
+            removed = [user_id for user_id in dict.fromkeys(user_ids) if user_id in live]
+            if not removed:
+                return 0
+            self._append([TOMBSTONE + user_id for user_id in removed], np.zeros((len(removed), snapshot.matrix.shape[1]), dtype=np.float32))
+            self._maybe_compact(lock)
+            return sum(len(live[user_id]) for user_id in removed)
+
+    def compact(self) -> int:
+        """
+        Rewrites the live rows into new files that replace the journal atomically.
+
+        Returns
+        -------
+        int
+            Number of dropped dead rows.
+        """
+        with self.lock() as lock:
+            return self._compact(lock)
+
+    def _maybe_compact(self, lock) -> None:
+        snapshot = self.snapshot()
+        live = sum(len(rows) for rows in self.live_rows(snapshot).values())
+        dead = len(snapshot.user_ids) - live
+        if dead >= self.min_compact_rows and dead > self.compact_ratio * live:
+            self._compact(lock)
+
+    def _compact(self, lock) -> int:
+        count = len(self.snapshot().user_ids)
+        user_ids, matrix = self.load()
+        if len(user_ids) == count:
+            return 0
+        self._write(lock, user_ids, np.asarray(matrix))
+        return count - len(user_ids)
+
+    def write(self, user_ids: Sequence[str], embeddings) -> None:
+        """
+        Replaces the whole storage with the given embeddings.
+
+        Parameters
+        ----------
+        user_ids: Sequence[str]
+            The unique identifiers of the users.
+        embeddings: Union[torch.Tensor, np.ndarray]
+            The embeddings of the users, one row per user.
+        """
+        with self.lock() as lock:
+            self._write(lock, user_ids, embeddings)
+
+    def _write(self, lock, user_ids: Sequence[str], embeddings) -> None:
+        dtype = self.read_header()[0] if self.exists() else np.dtype(self.dtype)
+        if len(user_ids):
+            rows = prepare_embeddings(embeddings)
+        else:
+            rows = np.empty((0, self.read_header()[1] if self.exists() else 0), dtype=np.float32)
+
+        ids = ''.join(f'{user_id}\n' for user_id in user_ids).encode('utf-8')
+        with open(self.ids_path + '.tmp', 'wb') as f:
+            f.write(ids)
+        with open(self.matrix_path + '.tmp', 'wb') as f:
+            self._write_header(f, dtype, rows.shape[1], len(rows), len(ids))
+            f.write(rows.astype(dtype).tobytes())
+
+        # The odd generation tells readers that the two files are being replaced
+        generation = self.generation()
+        self._set_generation(lock, generation + 1)
+        try:
+            os.replace(self.ids_path + '.tmp', self.ids_path)
+            os.replace(self.matrix_path + '.tmp', self.matrix_path)
+        finally:
+            self._set_generation(lock, generation + 2)
+
+    @staticmethod
+    def _set_generation(lock, generation: int) -> None:
+        # Fixed width, so readers never see a partially written number
+        lock.seek(0)
+        lock.write(f'{generation:020d}'.encode())
+        lock.flush()
+
+
+def migrate_legacy_room(room_path: str, dtype: str = 'float32', keep_legacy_files: bool = True) -> int:
+    """
+    Moves the per-user '<user>_emb.pt' files of a room into the single-file room storage.
+
+    Parameters
+    ----------
+    room_path: str
+        Path of the room directory.
+    dtype: str
+        Data type of the stored embeddings if the room storage is created.
+    keep_legacy_files: bool
+        Whether to keep the '<user>_emb.pt' files after the migration.
+
+    Returns
+    -------
+    int
+        Number of migrated users.
+    """
+    storage = RoomStorage(room_path, dtype=dtype)
+    legacy_files = sorted(filename for filename in os.listdir(room_path) if filename.endswith(LEGACY_SUFFIX))
+    stored_ids = set(storage.load()[0])
+
+    user_ids, embeddings = [], []
+    for filename in legacy_files:
+        user_id = filename[:-len(LEGACY_SUFFIX)].split('_')[0]
+        if user_id not in stored_ids:
+            user_ids.append(user_id)
+            embeddings.append(prepare_embeddings(torch.load(os.path.join(room_path, filename))))
+    if user_ids:
+        storage.append(user_ids, np.concatenate(embeddings))
+
+    if not keep_legacy_files:
+        for filename in legacy_files:
+            os.remove(os.path.join(room_path, filename))
+    return len(user_ids)
+
+
+def has_legacy_files(room_path: str) -> bool:
+    return os.path.isdir(room_path) and any(filename.endswith(LEGACY_SUFFIX) for filename in os.listdir(room_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrates the '<user>_emb.pt' files of every room into the single-file room storage.")
+    parser.add_argument('rooms_path', nargs='?', default='rooms')
+    parser.add_argument('--dtype', default='float32', choices=list(DTYPE_CODES))
+    parser.add_argument('--delete-legacy', action='store_true', help="Delete the '<user>_emb.pt' files after the migration")
+    args = parser.parse_args()
+
+    for room_name in sorted(os.listdir(args.rooms_path)):
+        room_path = os.path.join(args.rooms_path, room_name)
+        if has_legacy_files(room_path):
+            migrated = migrate_legacy_room(room_path, dtype=args.dtype, keep_legacy_files=not args.delete_legacy)
+            print(f"Room '{room_name}': {migrated} users migrated.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.face_recognition.room_storage import RoomStorage, prepare_embeddings
+
+TEMPLATES_DIRECTORY = 'templates'
+
+
+def normalized_centroid(templates: np.ndarray) -> np.ndarray:
+    """
+    Returns the L2-normalized mean of the given normalized templates with shape (embedding size,)
+    """
+    centroid = np.asarray(templates, dtype=np.float32).mean(axis=0)
+    return centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+
+
+def select_diverse(templates: np.ndarray, max_templates: int) -> np.ndarray:
+    """
+    Selects at most max_templates of the given normalized templates by repeatedly evicting one template of the
+    most similar pair, the one that is more similar to the remaining templates, so that the kept templates cover
+    as many poses and lighting conditions as possible.
+
+    Returns
+    -------
+    np.ndarray
+        Sorted indices of the kept templates
+    """
+    keep = np.arange(len(templates))
+    if len(templates) <= max_templates:
+        return keep
+    similarities = templates @ templates.T
+    np.fill_diagonal(similarities, -np.inf)
+    while len(keep) > max_templates:
+        current = similarities[np.ix_(keep, keep)]
+        i, j = np.unravel_index(np.argmax(current), current.shape)
+        finite = np.where(np.isfinite(current), current, 0)
+        evicted = i if finite[i].sum() >= finite[j].sum() else j
+        keep = np.delete(keep, evicted)
+    return keep
+
+
+class TemplateStore:
+    """
+    Templates of every user of a room, stored in '<room>/templates' next to the centroids of the room storage.
+
+    Every template is a row of the storage with the user id of its owner, so a user can have several rows.
+    Replacing the templates of a user appends a tombstone followed by the new templates.
+    Templates are only read to re-check the top candidates of a match and to update the centroid of a user,
+    matching itself stays on the centroids.
+
+    Attributes
+    ----------
+    storage: RoomStorage
+        Storage of the templates
+    max_templates: int
+        Maximum number of templates per user
+    """
+
+    def __init__(self, room_path: str, dtype: str = 'float32', max_templates: int = 10):
+        self.storage = RoomStorage(os.path.join(room_path, TEMPLATES_DIRECTORY), dtype=dtype, unique=False)
+        self.max_templates = max_templates
+        self._signature = None
+        self._matrix: Optional[np.ndarray] = None
+        self._rows: Dict[str, List[int]] = {}
+
+    def refresh(self) -> None:
+        if self.storage.signature() == self._signature:
+            return
+        snapshot = self.storage.snapshot()
+        self._rows = self.storage.live_rows(snapshot)
+        self._matrix = snapshot.matrix
+        self._signature = snapshot.signature
+
+    def get(self, user_id: str) -> np.ndarray:
+        """
+        Returns the templates of a user with shape (number of templates, embedding size), empty if the user has none
+        """
+        self.refresh()
+        rows = self._rows.get(user_id)
+        if not rows:
+            return np.empty((0, self._matrix.shape[1] if self._matrix is not None else 0), dtype=np.float32)
+        return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def add(self, user_id: str, embeddings) -> np.ndarray:
+        """
+        Adds templates to a user, evicting the least diverse ones above max_templates
+
+        Returns
+        -------
+        np.ndarray
+            The kept templates of the user
+        """
+        new = prepare_embeddings(embeddings)
+        existing = self.get(user_id)
+        templates = np.concatenate([existing, new]) if len(existing) else new
+        keep = select_diverse(templates, self.max_templates)
+        if len(keep) == len(templates):
+            self.storage.append([user_id] * len(new), new)
+        else:
+            self.replace({user_id: templates[keep]})
+        return templates[keep]
+
+    def replace(self, templates: Dict[str, np.ndarray]) -> None:
+        """
+        Replaces all templates of the given users with a single append to the storage
+        """
+        user_ids, rows = [], []
+        for user_id, user_templates in templates.items():
+            user_templates = prepare_embeddings(user_templates)
+            user_ids += [user_id] * len(user_templates)
+            rows.append(user_templates)
+        if rows:
+            self.storage.replace(user_ids, np.concatenate(rows))
+
+    def remove(self, user_ids: Sequence[str]) -> int:
+        if not self.storage.exists():
+            return 0
+        return self.storage.remove(user_ids)
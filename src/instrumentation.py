@@ -0,0 +1,280 @@
+"""
+Per-stage timing and counters of the detection, recognition and database hot paths.
+
+Instrumentation is disabled by default and then costs one attribute check per timed block. It is enabled
+with enable() or by setting the FACE_AUTH_METRICS=1 environment variable.
+
+    from src import instrumentation
+
+    instrumentation.enable()
+    with instrumentation.timed('detection.mtcnn'):
+        ...
+    instrumentation.increment('matches')
+    print(instrumentation.to_prometheus())
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Optional
+
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """
+    Latency histogram of a stage with fixed Prometheus buckets and a rolling window for percentiles
+
+    Attributes
+    ----------
+    count: int
+        Number of observations
+    total: float
+        Sum of the observed latencies in milliseconds
+    bucket_counts: list
+        Number of observations per bucket of BUCKETS_MS, the last one counting the observations above all buckets
+    """
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * (len(BUCKETS_MS) + 1)
+        self._window = deque(maxlen=window)
+
+    def observe(self, latency_ms: float) -> None:
+        self.count += 1
+        self.total += latency_ms
+        self.bucket_counts[bisect_left(BUCKETS_MS, latency_ms)] += 1
+        self._window.append(latency_ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._window:
+            return None
+        values = sorted(self._window)
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of the stage histograms and counters
+
+    Attributes
+    ----------
+    enabled: bool
+        Whether timings and counters are recorded
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, latency_ms: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(latency_ms)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'stages': {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def to_prometheus(self, prefix: str = 'face_auth') -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format
+        """
+        lines = [f'# TYPE {prefix}_stage_latency_ms histogram']
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS_MS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_latency_ms_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_latency_ms_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_latency_ms_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{prefix}_stage_latency_ms_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f'# TYPE {prefix}_events_total counter')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(enabled=os.environ.get('FACE_AUTH_METRICS', '0') == '1')
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.stage, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def enable() -> None:
+    registry.enabled = True
+
+
+def disable() -> None:
+    registry.enabled = False
+
+
+def timed(stage: str):
+    """
+    Context manager recording the duration of the block in the histogram of the stage
+    """
+    return _Timer(stage) if registry.enabled else _NOOP_TIMER
+
+
+def instrument(stage: str):
+    """
+    Decorator recording the duration of every call in the histogram of the stage
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return function(*args, **kwargs)
+            with _Timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name: str, value: int = 1) -> None:
+    """
+    Adds value to the counter of the given name
+    """
+    if registry.enabled:
+        registry.increment(name, value)
+
+
+def snapshot() -> dict:
+    return registry.snapshot()
+
+
+def to_prometheus(prefix: str = 'face_auth') -> str:
+    return registry.to_prometheus(prefix)
+
+
+def append_jsonl(path: str) -> None:
+    """
+    Appends the current snapshot of the metrics as one JSON line to the file
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(registry.snapshot()) + '\n')
+
+
+def start_jsonl_exporter(path: str, interval: float = 10.0) -> threading.Event:
+    """
+    Appends a snapshot of the metrics to the file every interval seconds in a daemon thread
+
+    Returns
+    -------
+    threading.Event
+        Event that stops the exporter when set
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            append_jsonl(path)
+
+    threading.Thread(target=run, name='metrics-exporter', daemon=True).start()
+    return stop
+
+
+@contextmanager
+def profiled(path: Optional[str] = None):
+    """
+    Profiles the block with cProfile and dumps the statistics to path, readable with pstats or snakeviz.
+    Threads started inside the block, such as the pipeline stages, get their own profiler and their statistics
+    are merged with the calling thread. Threads started before the block are not profiled.
+    The path defaults to the FACE_AUTH_PROFILE environment variable and nothing is profiled if neither is set.
+    Sampling profilers such as py-spy need no hook, the pipeline threads are named after their stages.
+    """
+    path = path or os.environ.get('FACE_AUTH_PROFILE')
+    if not path:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profilers = [profiler]
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # Called once when a new thread starts, enabling its profiler replaces this hook in the thread
+        thread_profiler = cProfile.Profile()
+        with lock:
+            profilers.append(thread_profiler)
+        thread_profiler.enable()
+
+    # From Python 3.12 on cProfile hooks into sys.monitoring, which covers all threads with a single profiler
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        stats = pstats.Stats(profiler)
+        with lock:
+            for thread_profiler in profilers[1:]:
+                try:
+                    stats.add(thread_profiler)
+                except TypeError:
+                    # The thread has not made a call yet
+                    pass
+        stats.dump_stats(path)
@@ -0,0 +1,290 @@
+"""
+Offline authentication of recorded footage, e.g. to audit the attendance of a lecture.
+
+Frames of a video file or an image sequence are decoded ahead in a background thread, sampled at a configurable
+rate, authenticated in batches with one detection, embedding and matching pass per batch, and the matches of
+every frame are streamed to a JSONL or CSV file. Memory use does not depend on the length of the recording.
+
+    python -m src.runtime.offline lecture.mp4 --room FENS1017 --output lecture.jsonl --sample-fps 2
+    python -m src.runtime.offline "frames/*.jpg" --room FENS1017 --output frames.csv --source-fps 5
+"""
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+from src import instrumentation
+from src.authenticator import FaceAuthenticator, FaceMatch
+from src.face_detection.image import Frame
+from src.runtime.queues import DropOldestQueue
+from src.runtime.sources import ImageSequenceSource, VideoSource
+
+_END = object()
+CSV_COLUMNS = ('frame', 'timestamp', 'x1', 'y1', 'x2', 'y2', 'user_id', 'score')
+
+
+class SampledFrame(NamedTuple):
+    """
+    A decoded frame of a recording
+
+    Attributes
+    ----------
+    index: int
+        Index of the frame in the recording, counting the skipped frames
+    timestamp: Optional[float]
+        Position of the frame in the recording in seconds, None if the frame rate is unknown
+    frame: Frame
+        The decoded frame
+    """
+    index: int
+    timestamp: Optional[float]
+    frame: Frame
+
+
+def iter_frames(source: Union[VideoSource, ImageSequenceSource], sample_fps: Optional[float] = None,
+                prefetch: int = 32) -> Iterator[SampledFrame]:
+    """
+    Decodes the frames of a source ahead in a background thread and yields them in order
+
+    Parameters
+    ----------
+    source: Union[VideoSource, ImageSequenceSource]
+        Video file or image sequence
+    sample_fps: Optional[float]
+        Number of frames per second of the recording to yield. The other frames are skipped without decoding.
+        All frames are yielded if None or if the frame rate of the source is unknown.
+    prefetch: int
+        Maximum number of decoded frames waiting to be processed
+
+    Yields
+    ------
+    SampledFrame
+        Index, timestamp and the decoded frame
+    """
+    fps = source.fps
+    step = max(1, round(fps / sample_fps)) if sample_fps and fps else 1
+    queue = DropOldestQueue(prefetch)
+    stop = threading.Event()
+    errors = []
+
+    def decode():
+        index = 0
+        try:
+            while not stop.is_set():
+                with instrumentation.timed('capture.read'):
+                    frame = source.read()
+                if frame is None:
+                    break
+                item = SampledFrame(index, index / fps if fps else None, Frame(frame))
+                while not queue.put(item, block=True, timeout=0.1):
+                    if stop.is_set():
+                        return
+                index += 1 + source.skip(step - 1)
+        except Exception as e:
+            errors.append(e)
+        while not stop.is_set() and not queue.put(_END, block=True, timeout=0.1):
+            pass
+
+    thread = threading.Thread(target=decode, name='decode', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get(timeout=0.1)
+            if item is _END:
+                break
+            if item is not None:
+                yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join()
+        source.release()
+
+
+class MatchWriter:
+    """
+    Streams the matches of every frame to a file as JSON lines, one per frame, or as CSV rows, one per face
+
+    Attributes
+    ----------
+    path: str
+        Output file, '-' for the standard output
+    format: str
+        'jsonl' or 'csv', derived from the file extension if not given
+    """
+
+    def __init__(self, path: str = '-', format: Optional[str] = None):
+        self.path = path
+        self.format = format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        if self.format not in ('jsonl', 'csv'):
+            raise ValueError(f"Unsupported output format '{self.format}'. Use 'jsonl' or 'csv'")
+        self._file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        self._csv = None
+        if self.format == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(CSV_COLUMNS)
+
+    def write(self, item: SampledFrame, matches: List[FaceMatch]) -> None:
+        if self._csv is not None:
+            for match in matches:
+                self._csv.writerow([item.index, item.timestamp, *(round(float(v), 1) for v in match.bbox), match.user_id or '',
+                                    '' if match.score is None else round(float(match.score), 4)])
+            return
+        faces = [{'bbox': [round(float(v), 1) for v in match.bbox], 'user_id': match.user_id,
+                  'score': None if match.score is None else round(float(match.score), 4)} for match in matches]
+        self._file.write(json.dumps({'frame': item.index, 'timestamp': item.timestamp, 'faces': faces}) + '\n')
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not sys.stdout:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self) -> 'MatchWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class Attendance:
+    """
+    First and last sighting of every authorized user of a recording
+
+    Attributes
+    ----------
+    users: Dict[str, dict]
+        For every user ID, the first and last timestamp (or frame index if the frame rate is unknown)
+        and the number of frames the user was authorized in
+    """
+
+    def __init__(self):
+        self.users: Dict[str, dict] = {}
+
+    def update(self, item: SampledFrame, matches: List[FaceMatch]) -> None:
+        position = item.timestamp if item.timestamp is not None else item.index
+        for user_id in {match.user_id for match in matches if match.user_id is not None}:
+            user = self.users.setdefault(user_id, {'first_seen': position, 'last_seen': position, 'frames': 0})
+            user['last_seen'] = position
+            user['frames'] += 1
+
+
+def process_recording(source: Union[VideoSource, ImageSequenceSource], authenticator: FaceAuthenticator, room_name: str,
+                      writer: MatchWriter, sample_fps: Optional[float] = None, batch_size: int = 8,
+                      prefetch: int = 32) -> dict:
+    """
+    Authenticates the faces of a recording in batches and streams the matches of every frame to the writer
+
+    Parameters
+    ----------
+    source: Union[VideoSource, ImageSequenceSource]
+        Video file or image sequence
+    authenticator: FaceAuthenticator
+        Detection, embedding and matching of the faces. Its tracker is not used.
+    room_name: str
+        The name of the room for authorization
+    writer: MatchWriter
+        Output of the matches of every frame
+    sample_fps: Optional[float]
+        Number of frames per second of the recording to process, all frames if None
+    batch_size: int
+        Number of frames authenticated together
+    prefetch: int
+        Maximum number of decoded frames waiting to be processed
+
+    Returns
+    -------
+    dict
+        Number of processed frames and faces, processing time, processed duration of the recording,
+        speed relative to real time and the attendance of the authorized users
+    """
+    attendance = Attendance()
+    frames = faces = 0
+    last_timestamp = None
+    start = time.perf_counter()
+    batch: List[SampledFrame] = []
+
+    def flush():
+        nonlocal faces
+        results = authenticator.authenticate_batch([item.frame for item in batch], [room_name] * len(batch))
+        for item, matches in zip(batch, results):
+            writer.write(item, matches)
+            attendance.update(item, matches)
+            faces += len(matches)
+        writer.flush()
+        batch.clear()
+
+    for item in iter_frames(source, sample_fps=sample_fps, prefetch=prefetch):
+        batch.append(item)
+        frames += 1
+        last_timestamp = item.timestamp
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    duration = last_timestamp
+    return {
+        'frames': frames,
+        'faces': faces,
+        'elapsed_s': elapsed,
+        'duration_s': duration,
+        'realtime_factor': duration / elapsed if duration and elapsed else None,
+        'attendance': attendance.users,
+    }
+
+
+def open_source(source: str, source_fps: Optional[float] = None) -> Union[VideoSource, ImageSequenceSource]:
+    """
+    Opens a video file, or an image sequence if the source is a glob pattern
+    """
+    if any(char in source for char in '*?['):
+        return ImageSequenceSource(source, fps=source_fps or 1.0)
+    return VideoSource(source, realtime=False)
+
+
+def main():
+    from config import mtcnn_params, inception_params, database_params, startup_params
+    from src.face_detection.mtcnn_model import MTCNNModel
+    from src.face_recognition.authorization_database import AuthorizationDatabase
+    from src.face_recognition.inception_model import InceptionModel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Video file, or glob pattern of an image sequence')
+    parser.add_argument('--room', required=True, help='The name of the room for authorization')
+    parser.add_argument('--rooms-path', default='rooms')
+    parser.add_argument('--output', default='-', help="JSONL or CSV file of the matches of every frame, '-' for the standard output")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='Output format, derived from the output file extension by default')
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--sample-fps', type=float, help='Frames per second of the recording to process, all frames by default')
+    parser.add_argument('--source-fps', type=float, help='Frame rate of an image sequence')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--prefetch', type=int, default=32, help='Maximum number of frames decoded ahead')
+    args = parser.parse_args()
+
+    authenticator = FaceAuthenticator(
+        detection_model=MTCNNModel(mtcnn_params, **startup_params),
+        embedding_model=InceptionModel(**inception_params, **startup_params),
+        database=AuthorizationDatabase(room_path=args.rooms_path, **{**database_params, 'update_threshold': None}),
+        threshold=args.threshold,
+    )
+    with MatchWriter(args.output, args.format) as writer:
+        summary = process_recording(open_source(args.source, args.source_fps), authenticator, args.room, writer,
+                                    sample_fps=args.sample_fps, batch_size=args.batch_size, prefetch=args.prefetch)
+
+    speed = f", {summary['realtime_factor']:.1f}x real time" if summary['realtime_factor'] else ''
+    print(f"{summary['frames']} frames, {summary['faces']} faces in {summary['elapsed_s']:.1f}s{speed}", file=sys.stderr)
+    for user_id, user in sorted(summary['attendance'].items(), key=lambda entry: entry[1]['first_seen']):
+        print(f"{user_id}: first seen {user['first_seen']}, last seen {user['last_seen']}, {user['frames']} frames", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
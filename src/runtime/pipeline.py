@@ -0,0 +1,346 @@
+import argparse
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from src.authenticator import FaceMatch, tracked_matches
+from src.face_detection.detection_result import DetectionResult
+from src.face_detection.face_tracker import FaceTracker, Track
+from src.face_detection.image import Frame
+from src.face_detection.base_face_detection import BaseFaceDetection
+from src.face_detection.gated_detector import GatedDetector
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.face_recognition.authorization_database import AuthorizationDatabase
+from src.face_recognition.inception_model import InceptionModel
+from src import instrumentation
+from src.runtime.queues import DropOldestQueue
+from src.runtime.sources import VideoSource, next_retry_delay
+
+_END = object()
+
+
+@dataclass
+class PipelineItem:
+    """
+    A captured frame and the results of the pipeline stages that processed it
+
+    Attributes
+    ----------
+    index: int
+        Sequence number of the frame
+    frame: Frame
+        Captured frame, with the location of the first detected face after detection
+    captured_at: float
+        time.perf_counter() value when the frame was captured
+    detections: Optional[DetectionResult]
+        Faces detected in the frame
+    embeddings: Optional[torch.Tensor]
+        Embeddings of the detected faces, only of the faces to recognize if the faces are tracked
+    tracks: Optional[List[Track]]
+        Track of every detected face if the faces are tracked
+    recognized: List[int]
+        Indices of the tracked faces recognized in this frame
+    matches: List[FaceMatch]
+        Authentication result of every detected face
+    """
+    index: int
+    frame: Frame
+    captured_at: float
+    detections: Optional[DetectionResult] = None
+    embeddings: Optional[torch.Tensor] = None
+    tracks: Optional[List[Track]] = None
+    recognized: List[int] = field(default_factory=list)
+    matches: List[FaceMatch] = field(default_factory=list)
+
+
+class StageMetrics:
+    """
+    Latency and throughput counters of a pipeline stage
+
+    Attributes
+    ----------
+    inbox: DropOldestQueue
+        Queue the stage consumes
+    processed: int
+        Number of items processed by the stage
+    failed: int
+        Number of items dropped because the stage raised an error on them
+    last_latency: float
+        Processing time of the last item in seconds
+    mean_latency: float
+        Exponential moving average of the processing time in seconds
+    """
+
+    def __init__(self, inbox: Optional[DropOldestQueue], smoothing: float = 0.1):
+        self.inbox = inbox
+        self.smoothing = smoothing
+        self.processed = 0
+        self.failed = 0
+        self.last_latency = 0.0
+        self.mean_latency = 0.0
+
+    def record(self, latency: float) -> None:
+        self.processed += 1
+        self.last_latency = latency
+        self.mean_latency = latency if self.processed == 1 else self.mean_latency + self.smoothing * (latency - self.mean_latency)
+
+    def as_dict(self) -> dict:
+        return {
+            'queue_depth': len(self.inbox) if self.inbox is not None else 0,
+            'dropped': self.inbox.dropped if self.inbox is not None else 0,
+            'processed': self.processed,
+            'failed': self.failed,
+            'last_latency_ms': self.last_latency * 1000,
+            'mean_latency_ms': self.mean_latency * 1000,
+        }
+
+
+class AuthenticationPipeline:
+    """
+    Runs capture, face detection, embedding and matching in separate threads connected by bounded
+    drop-oldest queues, so that a slow stage does not block the others and consumers always get the freshest frame.
+
+    Stages are only started for the given components: without an embedding model the pipeline stops after
+    detection, without a database it stops after embedding.
+
+    Attributes
+    ----------
+    source: VideoSource
+        Source of the frames
+    detection_model: BaseFaceDetection
+        Model to detect faces, a MTCNNModel or a GatedDetector
+    embedding_model: Optional[InceptionModel]
+        Model to extract face embeddings
+    database: Optional[AuthorizationDatabase]
+        Database of the authorized users
+    room_name: Optional[str]
+        The name of the room for authorization
+    threshold: float
+        Similarity threshold for authorization
+    queue_size: int
+        Size of the queue in front of each stage
+    tracker: Optional[FaceTracker]
+        Tracker to only embed and match faces that are new or whose cached identity has expired
+    recognize: bool
+        Whether to embed and match detected faces. Can be switched off while running to only detect faces.
+    error: Optional[Exception]
+        Error that stopped the capture, e.g. a source that cannot be opened. It is raised by get_result.
+    """
+
+    def __init__(self, source: VideoSource, detection_model: BaseFaceDetection, embedding_model: Optional[InceptionModel] = None,
+                 database: Optional[AuthorizationDatabase] = None, room_name: Optional[str] = None,
+                 threshold: float = 0.7, queue_size: int = 2, tracker: Optional[FaceTracker] = None):
+        self.source = source
+        self.detection_model = detection_model
+        self.embedding_model = embedding_model
+        self.database = database
+        self.room_name = room_name
+        self.threshold = threshold
+        self.tracker = tracker
+        self.recognize = True
+        self.error: Optional[Exception] = None
+
+        stages = [('detect', self._detect)]
+        if embedding_model is not None:
+            stages.append(('embed', self._embed))
+            if database is not None:
+                stages.append(('match', self._match))
+        self._stages = stages
+        self._queues = [DropOldestQueue(queue_size) for _ in stages]
+        self.results = DropOldestQueue(queue_size)
+        self.metrics: Dict[str, StageMetrics] = {'capture': StageMetrics(None)}
+        self.metrics.update({name: StageMetrics(queue) for (name, _), queue in zip(stages, self._queues)})
+
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> 'AuthenticationPipeline':
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._capture, name='capture', daemon=True)]
+        outboxes = self._queues[1:] + [self.results]
+        for (name, work), inbox, outbox in zip(self._stages, self._queues, outboxes):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(name, work, inbox, outbox), name=name, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self.source.release()
+
+    def __enter__(self) -> 'AuthenticationPipeline':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def get_result(self, timeout: Optional[float] = None) -> Optional[PipelineItem]:
+        """
+        Returns the oldest processed frame, None if no frame is processed within timeout seconds or the pipeline has finished.
+        Raises the error that stopped the capture once the frames captured before it are returned.
+        """
+        item = self.results.get(timeout=timeout)
+        if item is _END:
+            self._stop.set()
+            if self.error is not None:
+                raise self.error
+            return None
+        return item
+
+    def stage_metrics(self) -> Dict[str, dict]:
+        """
+        Returns the queue depth, drop count, processed count and latency of every stage
+        """
+        return {name: metrics.as_dict() for name, metrics in self.metrics.items()}
+
+    def _capture(self) -> None:
+        metrics = self.metrics['capture']
+        outbox = self._queues[0]
+        index = 0
+        delay = 0.0
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                with instrumentation.timed('capture.read'):
+                    frame = self.source.read()
+                if frame is None:
+                    if not self.source.realtime:
+                        break
+                    # A camera that delivers no frames is polled with a growing delay instead of spinning
+                    delay = next_retry_delay(delay)
+                    self._stop.wait(delay)
+                    continue
+                delay = 0.0
+                item = PipelineItem(index=index, frame=Frame(frame), captured_at=start)
+                metrics.record(time.perf_counter() - start)
+                # Offline sources wait for the pipeline instead of dropping frames
+                while not outbox.put(item, block=not self.source.realtime, timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                index += 1
+        except Exception as e:
+            self.error = e
+        outbox.put(_END, block=not self.source.realtime)
+
+    def _run_stage(self, name: str, work: Callable[[PipelineItem], None], inbox: DropOldestQueue, outbox: DropOldestQueue) -> None:
+        metrics = self.metrics[name]
+        while not self._stop.is_set():
+            item = inbox.get(timeout=0.1)
+            if item is None:
+                continue
+            if item is not _END:
+                start = time.perf_counter()
+                try:
+                    work(item)
+                except Exception as e:
+                    # A frame that cannot be processed is dropped, the stage keeps serving the next frames
+                    metrics.failed += 1
+                    print(f'Stage {name} cannot process frame {item.index}: {e!r}')
+                    continue
+                metrics.record(time.perf_counter() - start)
+            while not outbox.put(item, block=not self.source.realtime, timeout=0.1):
+                if self._stop.is_set():
+                    return
+            if item is _END:
+                return
+
+    def _detect(self, item: PipelineItem) -> None:
+        item.detections = self.detection_model.detect_faces(item.frame)
+        item.detections.update_frame()
+
+    def _embed(self, item: PipelineItem) -> None:
+        if not self.recognize:
+            return
+        crops = item.detections.views
+        if self.tracker is not None:
+            item.tracks = self.tracker.update(item.detections.boxes)
+            item.recognized = self.tracker.select_for_recognition(item.tracks)
+            crops = [crops[i] for i in item.recognized]
+        if crops:
+            item.embeddings = self.embedding_model.get_embeddings(crops)
+
+    def _match(self, item: PipelineItem) -> None:
+        results = []
+        if item.embeddings is not None:
+            results = self.database.authorize_users(self.room_name, item.embeddings, threshold=self.threshold)
+        if item.tracks is None:
+            item.matches = [FaceMatch(bbox, user_id, score) for bbox, (_, user_id, score) in zip(item.detections.boxes, results)]
+            return
+        for i, (_, user_id, score) in zip(item.recognized, results):
+            self.tracker.record_identity(item.tracks[i], user_id, score)
+        item.matches = tracked_matches(item.tracks, item.recognized)
+
+
+def main():
+    from config import mtcnn_params, detection_frontend_params, inception_params, database_params, startup_params
+
+    parser = argparse.ArgumentParser(description='Runs the authentication pipeline headless and prints the matches of every frame.')
+    parser.add_argument('--source', default='0', help='Camera device index, video file or stream URL')
+    parser.add_argument('--room', required=True, help='The name of the room for authorization')
+    parser.add_argument('--rooms-path', default='rooms')
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--queue-size', type=int, default=2)
+    parser.add_argument('--full-detection', action='store_true', help='Run MTCNN on every full resolution frame')
+    parser.add_argument('--metrics-jsonl', help='Appends the per-stage timings and counters to this file every 10 seconds')
+    parser.add_argument('--profile', help='Dumps cProfile statistics of the run to this file')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between checks for room changes made by other processes, 0 checks on every frame')
+    args = parser.parse_args()
+
+    if args.metrics_jsonl:
+        instrumentation.enable()
+        instrumentation.start_jsonl_exporter(args.metrics_jsonl)
+
+    detection_model = MTCNNModel(mtcnn_params, **startup_params)
+    if not args.full_detection:
+        detection_model = GatedDetector(detection_model, **detection_frontend_params)
+
+    database = AuthorizationDatabase(room_path=args.rooms_path, **database_params)
+    if args.watch_interval:
+        database.watch(interval=args.watch_interval)
+
+    pipeline = AuthenticationPipeline(
+        source=VideoSource(args.source),
+        detection_model=detection_model,
+        embedding_model=InceptionModel(**inception_params, **startup_params),
+        database=database,
+        room_name=args.room,
+        threshold=args.threshold,
+        queue_size=args.queue_size,
+    )
+    start = time.perf_counter()
+    frames = 0
+    with instrumentation.profiled(args.profile), pipeline:
+        while True:
+            try:
+                item = pipeline.get_result(timeout=1.0)
+            except Exception as e:
+                print(f'Capture stopped: {e}')
+                break
+            if item is None:
+                if pipeline.running:
+                    continue
+                break
+            frames += 1
+            matches = ', '.join(f'{match.user_id or "unknown"} ({match.score:.3f})' for match in item.matches if match.score is not None)
+            print(f'frame {item.index}: {len(item.detections or [])} faces {matches}')
+    if args.metrics_jsonl:
+        instrumentation.append_jsonl(args.metrics_jsonl)
+    elapsed = time.perf_counter() - start
+    print(f'{frames} frames in {elapsed:.2f}s ({frames / elapsed:.2f} FPS)')
+    for name, metrics in pipeline.stage_metrics().items():
+        print(f"{name:<8} processed={metrics['processed']} dropped={metrics['dropped']} failed={metrics['failed']} "
+              f"queue={metrics['queue_depth']} mean={metrics['mean_latency_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
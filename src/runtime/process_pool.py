@@ -0,0 +1,230 @@
+"""
+Process-pool execution backend that shards frames across CPU cores.
+
+Every worker process holds its own MTCNNModel and InceptionModel. Frames are copied once into shared memory
+slots instead of being pickled, the workers detect and embed the faces of a frame and only send back the boxes
+and embeddings. Matching runs in the parent process, so the database has a single writer.
+"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from src.authenticator import FaceMatch
+from src.face_detection.image import Frame
+from src.face_recognition.authorization_database import AuthorizationDatabase
+
+_detection_model = None
+_embedding_model = None
+_slots: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _init_worker(mtcnn_kwargs: dict, inception_kwargs: dict, threads: int, weights_dir: Optional[str], warmup: bool) -> None:
+    global _detection_model, _embedding_model
+    import torch
+
+    from src.face_detection.mtcnn_model import MTCNNModel
+    from src.face_recognition.inception_model import InceptionModel
+
+    torch.set_num_threads(threads)
+    _detection_model = MTCNNModel(mtcnn_kwargs, weights_dir=weights_dir, warmup=warmup)
+    _embedding_model = InceptionModel(**inception_kwargs, weights_dir=weights_dir, warmup=warmup)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    slot = _slots.get(name)
+    if slot is None:
+        slot = _slots[name] = shared_memory.SharedMemory(name=name)
+        try:
+            # The parent owns the slots, the resource tracker of the worker must not unlink them when it exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(slot._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError):
+            pass
+    return slot
+
+
+def _process_frame(name: str, shape: Tuple[int, int, int], offset_ratio: float) -> Tuple[List[list], List[float], Optional[np.ndarray]]:
+    """
+    Detects and embeds the faces of the frame in a shared memory slot. Runs in a worker process.
+    """
+    image = np.ndarray(shape, dtype=np.uint8, buffer=_attach(name).buf)
+    detections = _detection_model.detect_faces(Frame(image), offset_ratio=offset_ratio)
+    if not detections:
+        return [], [], None
+    embeddings = _embedding_model.get_embeddings(detections.views).float().cpu().numpy()
+    return [list(map(float, box)) for box in detections.boxes], [float(prob) for prob in detections.probs], embeddings
+
+
+class ShardedAuthenticator:
+    """
+    Authenticates frames with a pool of worker processes, each holding its own detection and embedding model.
+
+    Frames are processed in parallel and their results are returned in frame order. Up to slots frames are
+    in flight at once, each in its own shared memory slot of max_frame_shape. Larger frames are downscaled to fit
+    and their boxes are mapped back. Faces are not tracked, since consecutive frames of a camera may be processed
+    by different workers.
+
+    Attributes
+    ----------
+    database: AuthorizationDatabase
+        Database of the authorized users, only used in the parent process
+    threshold: float
+        Similarity threshold for authorization
+    workers: int
+        Number of worker processes
+    threads_per_worker: int
+        Number of torch intra-op threads of every worker. workers * threads_per_worker should not exceed the number of cores.
+    """
+
+    def __init__(self, mtcnn_kwargs: dict, inception_kwargs: dict, database: AuthorizationDatabase, threshold: float = 0.7,
+                 workers: int = 2, threads_per_worker: int = 1, max_frame_shape: Tuple[int, int, int] = (1080, 1920, 3),
+                 slots: Optional[int] = None, offset_ratio: float = 0.05, weights_dir: Optional[str] = None,
+                 warmup: bool = False):
+        self.database = database
+        self.threshold = threshold
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.max_frame_shape = max_frame_shape
+        self.offset_ratio = offset_ratio
+        slot_size = int(np.prod(max_frame_shape))
+        self._slots = [shared_memory.SharedMemory(create=True, size=slot_size) for _ in range(slots or 2 * workers)]
+        self._free = deque(self._slots)
+        # Workers are spawned, forking a process with initialized torch thread pools can dead-lock
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker,
+                                             initargs=(mtcnn_kwargs, inception_kwargs, threads_per_worker, weights_dir, warmup))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots, self._free = [], deque()
+
+    def __enter__(self) -> 'ShardedAuthenticator':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _as_array(self, image: Union[Frame, np.ndarray]) -> Tuple[np.ndarray, Tuple[float, float]]:
+        """
+        Returns the RGB uint8 array of a frame and the horizontal and vertical scale it is resized by. Frames larger
+        than a slot are downscaled to fit, so that one oversized frame does not fail the other frames of its batch.
+        """
+        array = image.get_array() if isinstance(image, Frame) else image
+        if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f'Frame must be an RGB uint8 array, not a {array.dtype} array of shape {array.shape}')
+        if array.size <= self._slots[0].size:
+            return array, (1.0, 1.0)
+        ratio = (self._slots[0].size / array.size) ** 0.5
+        height, width = max(1, int(array.shape[0] * ratio)), max(1, int(array.shape[1] * ratio))
+        resized = np.asarray(Image.fromarray(array).resize((width, height), Image.BILINEAR))
+        return resized, (width / array.shape[1], height / array.shape[0])
+
+    @staticmethod
+    def _rescale(result: tuple, scale: Tuple[float, float]) -> tuple:
+        # Boxes detected in a downscaled frame are mapped back to the original frame
+        boxes, probs, embeddings = result
+        if scale != (1.0, 1.0):
+            boxes = [[x1 / scale[0], y1 / scale[1], x2 / scale[0], y2 / scale[1]] for x1, y1, x2, y2 in boxes]
+        return boxes, probs, embeddings
+
+    def _submit(self, array: np.ndarray) -> Tuple[shared_memory.SharedMemory, Future]:
+        slot = self._free.popleft()
+        try:
+            np.ndarray(array.shape, dtype=np.uint8, buffer=slot.buf)[...] = array
+            return slot, self._executor.submit(_process_frame, slot.name, array.shape, self.offset_ratio)
+        except BaseException:
+            self._free.append(slot)
+            raise
+
+    def _release(self, tasks) -> None:
+        # A slot is only reused once its worker has stopped reading it, even if another task failed
+        wait([task[1] for task in tasks])
+        self._free.extend(task[0] for task in tasks)
+
+    def _match(self, results: List[tuple], room_names: Sequence[str]) -> List[List[FaceMatch]]:
+        matches: List[List[FaceMatch]] = [[] for _ in results]
+        by_room: Dict[str, List[int]] = {}
+        for i, room_name in enumerate(room_names):
+            if results[i][2] is not None:
+                by_room.setdefault(room_name, []).append(i)
+        for room_name, frames in by_room.items():
+            embeddings = np.concatenate([results[i][2] for i in frames])
+            authorized = iter(self.database.authorize_users(room_name, embeddings, threshold=self.threshold))
+            for i in frames:
+                matches[i] = [FaceMatch(bbox, *next(authorized)[1:]) for bbox in results[i][0]]
+        return matches
+
+    def imap(self, frames: Iterable[Union[Frame, np.ndarray]], room_names: Union[str, Iterable[str]]) -> Iterator[List[FaceMatch]]:
+        """
+        Authenticates a stream of frames, keeping every slot busy, and yields the matches of every frame in frame order
+
+        Parameters
+        ----------
+        frames: Iterable[Union[Frame, np.ndarray]]
+            Frames or RGB uint8 arrays
+        room_names: Union[str, Iterable[str]]
+            The room of all frames, or the room of every frame
+
+        Yields
+        ------
+        List[FaceMatch]
+            Bounding box, authorized user ID and similarity score of every face of the next frame
+        """
+        rooms = iter([room_names]) if isinstance(room_names, str) else iter(room_names)
+        room_name = room_names if isinstance(room_names, str) else None
+        pending = deque()
+        try:
+            for frame in frames:
+                if not self._free:
+                    yield self._collect(pending.popleft())
+                array, scale = self._as_array(frame)
+                pending.append((*self._submit(array), room_name or next(rooms), scale))
+            while pending:
+                yield self._collect(pending.popleft())
+        finally:
+            self._release(pending)
+
+    def _collect(self, task) -> List[FaceMatch]:
+        slot, future, room_name, scale = task
+        try:
+            result = self._rescale(future.result(), scale)
+        finally:
+            self._release([task])
+        return self._match([result], [room_name])[0]
+
+    def authenticate_batch(self, images: List[Union[Frame, np.ndarray]], room_names: List[str]) -> List[List[FaceMatch]]:
+        """
+        Authenticates the faces of several frames in parallel, with one matrix match per room.
+        Has the same interface as FaceAuthenticator.authenticate_batch.
+
+        Parameters
+        ----------
+        images: List[Union[Frame, np.ndarray]]
+            Frames or RGB uint8 arrays to authenticate faces in
+        room_names: List[str]
+            The name of the room for authorization of every image
+
+        Returns
+        -------
+        List[List[FaceMatch]]
+            The matches of every image, in the same order as the images
+        """
+        arrays = [self._as_array(image) for image in images]
+        results = []
+        for start in range(0, len(arrays), len(self._slots)):
+            tasks = []
+            try:
+                for array, scale in arrays[start:start + len(self._slots)]:
+                    tasks.append((*self._submit(array), scale))
+                results += [self._rescale(future.result(), scale) for _, future, scale in tasks]
+            finally:
+                self._release(tasks)
+        return self._match(results, room_names)
@@ -0,0 +1,69 @@
+import threading
+from collections import deque
+from typing import Any, Optional
+
+
+class DropOldestQueue:
+    """
+    Bounded thread-safe queue that drops its oldest item when a new item is put into a full queue,
+    so that consumers always receive the freshest items.
+
+    Attributes
+    ----------
+    maxsize: int
+        Maximum number of items in the queue.
+    dropped: int
+        Number of items dropped since the queue was created.
+    """
+
+    def __init__(self, maxsize: int = 2):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._items)
+
+    def put(self, item: Any, block: bool = False, timeout: Optional[float] = None) -> bool:
+        """
+        Puts an item into the queue.
+
+        Parameters
+        ----------
+        item: Any
+            Item to put into the queue.
+        block: bool
+            Whether to wait for free space instead of dropping the oldest item when the queue is full.
+        timeout: Optional[float]
+            Maximum time to wait for free space in seconds when blocking.
+
+        Returns
+        -------
+        bool
+            False if the queue was still full after the timeout and the item was not put, True otherwise.
+        """
+        with self._condition:
+            if block and not self._condition.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                return False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Removes and returns the oldest item of the queue, waiting up to timeout seconds for one.
+        Returns None if the queue is still empty after the timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
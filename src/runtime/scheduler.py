@@ -0,0 +1,391 @@
+"""
+Runs several cameras, each bound to its own room, on one shared detection and embedding model.
+
+    python -m src.runtime.scheduler --camera door1,0,FENS1017 --camera door2,rtsp://10.0.0.5/stream,FENS2019,1
+"""
+import argparse
+import threading
+import time
+from typing import Dict, List, Optional
+
+from src import instrumentation
+from src.authenticator import FaceMatch, tracked_matches
+from src.face_detection.face_tracker import FaceTracker
+from src.face_detection.gated_detector import GatedDetector
+from src.face_detection.image import Frame
+from src.face_detection.mtcnn_model import MTCNNModel
+from src.face_recognition.authorization_database import AuthorizationDatabase
+from src.face_recognition.inception_model import InceptionModel
+from src.runtime.pipeline import PipelineItem, StageMetrics
+from src.runtime.queues import DropOldestQueue
+from src.runtime.sources import VideoSource, next_retry_delay
+
+POLICIES = ('round_robin', 'priority')
+
+
+class CameraBinding:
+    """
+    A camera source bound to a room, with its own bounded queues and detection front-end state
+
+    Attributes
+    ----------
+    name: str
+        Name of the camera
+    source: VideoSource
+        Source of the frames
+    room_name: str
+        The name of the room the faces are authorized for
+    priority: int
+        Higher priority cameras are served first by the 'priority' policy
+    detector: Optional[GatedDetector]
+        Motion-gated detection front-end of the camera around the shared detection model, None to detect every frame
+    tracker: Optional[FaceTracker]
+        Tracker to only recognize faces that are new or whose cached identity has expired
+    inbox: DropOldestQueue
+        Captured frames waiting for the scheduler. Real time cameras drop their oldest frame when it is full.
+    results: DropOldestQueue
+        Processed frames
+    metrics: StageMetrics
+        Capture-to-result latency of the processed frames, and the number of frames dropped because their batch failed
+    error: Optional[Exception]
+        Error that stopped the capture of the camera, e.g. a source that cannot be opened
+    """
+
+    def __init__(self, name: str, source: VideoSource, room_name: str, priority: int = 0,
+                 detector: Optional[GatedDetector] = None, tracker: Optional[FaceTracker] = None, queue_size: int = 2):
+        self.name = name
+        self.source = source
+        self.room_name = room_name
+        self.priority = priority
+        self.detector = detector
+        self.tracker = tracker
+        self.inbox = DropOldestQueue(queue_size)
+        self.results = DropOldestQueue(queue_size)
+        self.metrics = StageMetrics(self.inbox)
+        self.finished = False
+        self.busy = False
+        self.error: Optional[Exception] = None
+
+
+class MultiCameraScheduler:
+    """
+    Multiplexes several cameras onto one detection model and one embedding model.
+
+    Every camera is captured in its own thread into a bounded queue. Worker threads repeatedly take at most one
+    frame per camera into a batch, fairly in round-robin order or by camera priority, detect the faces of the batch,
+    embed all faces of all cameras in one forward pass and match them with one matrix match per room.
+    A camera is never in two batches at once, so its detection front-end and tracker need no locking, and
+    a slow camera only fills its own queue. Memory stays flat with the number of cameras and throughput
+    scales with the number of workers up to the number of cores.
+
+    Attributes
+    ----------
+    detection_model: MTCNNModel
+        Shared face detection model
+    embedding_model: InceptionModel
+        Shared embedding model
+    database: AuthorizationDatabase
+        Database of the authorized users
+    threshold: float
+        Similarity threshold for authorization
+    policy: str
+        'round_robin' to serve every camera in turn, 'priority' to serve higher priority cameras first
+    max_batch_size: int
+        Maximum number of frames processed in one batch
+    workers: int
+        Number of worker threads. Set torch.set_num_threads(cores // workers) to avoid oversubscription.
+    """
+
+    def __init__(self, detection_model: MTCNNModel, embedding_model: InceptionModel, database: AuthorizationDatabase,
+                 threshold: float = 0.7, policy: str = 'round_robin', max_batch_size: int = 8, workers: int = 1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unsupported policy '{policy}'. Use one of {POLICIES}")
+        self.detection_model = detection_model
+        self.embedding_model = embedding_model
+        self.database = database
+        self.threshold = threshold
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.workers = workers
+        self.cameras: Dict[str, CameraBinding] = {}
+        self.batches = 0
+        self.batched_frames = 0
+
+        self._cursor = 0
+        self._ready = threading.Condition()
+        self._database_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def add_camera(self, name: str, source: VideoSource, room_name: str, priority: int = 0, gate_params: Optional[dict] = None,
+                   tracker: Optional[FaceTracker] = None, queue_size: int = 2) -> CameraBinding:
+        """
+        Binds a camera to a room. Cameras must be added before the scheduler is started.
+
+        Parameters
+        ----------
+        name: str
+            Unique name of the camera
+        source: VideoSource
+            Source of the frames
+        room_name: str
+            The name of the room the faces are authorized for
+        priority: int
+            Priority of the camera for the 'priority' policy
+        gate_params: Optional[dict]
+            Keyword arguments of a GatedDetector front-end for the camera, see config.detection_frontend_params.
+            None detects faces in every frame.
+        tracker: Optional[FaceTracker]
+            Tracker of the faces of the camera
+        queue_size: int
+            Size of the capture and result queues of the camera
+
+        Returns
+        -------
+        CameraBinding
+            The camera binding
+        """
+        if name in self.cameras:
+            raise ValueError(f"Camera '{name}' is already added")
+        detector = GatedDetector(self.detection_model, **gate_params) if gate_params is not None else None
+        camera = CameraBinding(name, source, room_name, priority, detector, tracker, queue_size)
+        self.cameras[name] = camera
+        return camera
+
+    def start(self) -> 'MultiCameraScheduler':
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._capture, args=(camera,), name=f'capture-{camera.name}', daemon=True)
+                         for camera in self.cameras.values()]
+        self._threads += [threading.Thread(target=self._work, name=f'worker-{i}', daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._ready:
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for camera in self.cameras.values():
+            camera.source.release()
+
+    def __enter__(self) -> 'MultiCameraScheduler':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return not self._stop.is_set() and any(not camera.finished or len(camera.inbox) or camera.busy
+                                               for camera in self.cameras.values())
+
+    def get_result(self, name: str, timeout: Optional[float] = None) -> Optional[PipelineItem]:
+        """
+        Returns the oldest processed frame of a camera, None if no frame is processed within timeout seconds
+        """
+        return self.cameras[name].results.get(timeout=timeout)
+
+    def camera_metrics(self) -> Dict[str, dict]:
+        """
+        Returns the queue depth, drop count, processed and failed count and capture-to-result latency of every camera
+        """
+        return {name: camera.metrics.as_dict() for name, camera in self.cameras.items()}
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.batched_frames / self.batches if self.batches else 0.0
+
+    def _capture(self, camera: CameraBinding) -> None:
+        index = 0
+        delay = 0.0
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                with instrumentation.timed('capture.read'):
+                    frame = camera.source.read()
+                if frame is None:
+                    if not camera.source.realtime:
+                        break
+                    # A camera that delivers no frames is polled with a growing delay instead of spinning
+                    delay = next_retry_delay(delay)
+                    self._stop.wait(delay)
+                    continue
+                delay = 0.0
+                item = PipelineItem(index=index, frame=Frame(frame), captured_at=start)
+                # Video files wait for the scheduler instead of dropping frames
+                while not camera.inbox.put(item, block=not camera.source.realtime, timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                with self._ready:
+                    self._ready.notify()
+                index += 1
+        except Exception as e:
+            camera.error = e
+            print(f"Camera '{camera.name}' stopped: {e}")
+        camera.finished = True
+        with self._ready:
+            self._ready.notify_all()
+
+    def _next_batch(self) -> List[tuple]:
+        """
+        Takes at most one frame of every idle camera, in the order of the scheduling policy
+        """
+        with self._ready:
+            while not self._stop.is_set():
+                cameras = list(self.cameras.values())
+                if self.policy == 'round_robin':
+                    order = cameras[self._cursor:] + cameras[:self._cursor]
+                else:
+                    order = sorted(cameras, key=lambda camera: -camera.priority)
+                batch = []
+                for camera in order:
+                    if len(batch) == self.max_batch_size:
+                        break
+                    if camera.busy:
+                        continue
+                    item = camera.inbox.get(timeout=0)
+                    if item is not None:
+                        camera.busy = True
+                        batch.append((camera, item))
+                if batch:
+                    if self.policy == 'round_robin':
+                        self._cursor = (cameras.index(batch[-1][0]) + 1) % len(cameras)
+                    return batch
+                if not self.running:
+                    return []
+                self._ready.wait(timeout=0.1)
+        return []
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                if not self.running:
+                    return
+                continue
+            try:
+                self._process(batch)
+                now = time.perf_counter()
+                for camera, item in batch:
+                    camera.metrics.record(now - item.captured_at)
+                    camera.results.put(item)
+            except Exception as e:
+                # The frames of a failed batch are dropped, the worker keeps serving the cameras
+                for camera, item in batch:
+                    camera.metrics.failed += 1
+                    print(f"Camera '{camera.name}' frame {item.index} cannot be processed: {e!r}")
+            finally:
+                with self._ready:
+                    for camera, _ in batch:
+                        camera.busy = False
+                    self.batches += 1
+                    self.batched_frames += len(batch)
+                    self._ready.notify_all()
+
+    def _process(self, batch: List[tuple]) -> None:
+        ungated = [(camera, item) for camera, item in batch if camera.detector is None]
+        for (camera, item), detections in zip(ungated, self.detection_model.detect_faces_batch([item.frame for _, item in ungated])):
+            item.detections = detections
+        for camera, item in batch:
+            if camera.detector is not None:
+                item.detections = camera.detector.detect_faces(item.frame)
+            item.detections.update_frame()
+
+        # Faces of all cameras go through one embedding forward pass
+        faces = []
+        for camera, item in batch:
+            if camera.tracker is not None:
+                item.tracks = camera.tracker.update(item.detections.boxes)
+                item.recognized = camera.tracker.select_for_recognition(item.tracks)
+            else:
+                item.recognized = list(range(len(item.detections)))
+            faces += [(camera, item, i) for i in item.recognized]
+        if not faces:
+            for camera, item in batch:
+                self._build_matches(camera, item, {})
+            return
+        embeddings = self.embedding_model.get_embeddings([item.detections.views[i] for _, item, i in faces])
+
+        by_room: Dict[str, List[int]] = {}
+        for face, (camera, _, _) in enumerate(faces):
+            by_room.setdefault(camera.room_name, []).append(face)
+        results = {}
+        with self._database_lock:
+            for room_name, room_faces in by_room.items():
+                for face, result in zip(room_faces, self.database.authorize_users(room_name, embeddings[room_faces], threshold=self.threshold)):
+                    results[face] = result
+        recognized = {(id(item), i): results[face] for face, (_, item, i) in enumerate(faces)}
+        for camera, item in batch:
+            self._build_matches(camera, item, recognized)
+
+    @staticmethod
+    def _build_matches(camera: CameraBinding, item: PipelineItem, recognized: dict) -> None:
+        if camera.tracker is None:
+            item.matches = [FaceMatch(bbox, *recognized[(id(item), i)][1:]) for i, bbox in enumerate(item.detections.boxes)]
+            return
+        for i in item.recognized:
+            _, user_id, score = recognized[(id(item), i)]
+            camera.tracker.record_identity(item.tracks[i], user_id, score)
+        item.matches = tracked_matches(item.tracks, item.recognized)
+
+
+def main():
+    from config import mtcnn_params, detection_frontend_params, inception_params, tracker_params, database_params, startup_params
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--camera', action='append', required=True, metavar='NAME,SOURCE,ROOM[,PRIORITY]',
+                        help='Camera device index, video file or stream URL bound to a room. Can be given several times.')
+    parser.add_argument('--rooms-path', default='rooms')
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--policy', choices=POLICIES, default='round_robin')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--full-detection', action='store_true', help='Run MTCNN on every full resolution frame')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between checks for room changes made by other processes, 0 checks on every frame')
+    args = parser.parse_args()
+
+    database = AuthorizationDatabase(room_path=args.rooms_path, **database_params)
+    if args.watch_interval:
+        database.watch(interval=args.watch_interval)
+    scheduler = MultiCameraScheduler(
+        detection_model=MTCNNModel(mtcnn_params, **startup_params),
+        embedding_model=InceptionModel(**inception_params, **startup_params),
+        database=database,
+        threshold=args.threshold,
+        policy=args.policy,
+        max_batch_size=args.max_batch_size,
+        workers=args.workers,
+    )
+    for camera in args.camera:
+        name, source, room_name, *priority = camera.split(',')
+        scheduler.add_camera(name, VideoSource(source), room_name, priority=int(priority[0]) if priority else 0,
+                             gate_params=None if args.full_detection else detection_frontend_params,
+                             tracker=FaceTracker(**tracker_params))
+
+    start = time.perf_counter()
+    with scheduler:
+        running = True
+        while running:
+            running = scheduler.running
+            for name in scheduler.cameras:
+                # Results are drained once more after the last camera has finished
+                item = scheduler.get_result(name, timeout=0.05 if running else 0)
+                while item is not None:
+                    matches = ', '.join(f'{match.user_id or "unknown"} ({match.score:.3f})' for match in item.matches if match.score is not None)
+                    print(f'{name} frame {item.index}: {len(item.detections)} faces {matches}')
+                    item = scheduler.get_result(name, timeout=0)
+    elapsed = time.perf_counter() - start
+    print(f'{scheduler.batched_frames} frames in {elapsed:.2f}s, mean batch size {scheduler.mean_batch_size:.2f}')
+    for name, camera in scheduler.cameras.items():
+        if camera.error is not None:
+            print(f'{name} stopped with an error: {camera.error}')
+    for name, metrics in scheduler.camera_metrics().items():
+        print(f"{name:<12} processed={metrics['processed']} dropped={metrics['dropped']} failed={metrics['failed']} "
+              f"queue={metrics['queue_depth']} mean={metrics['mean_latency_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+from glob import glob
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+
+READ_RETRY_DELAY = 0.01
+MAX_READ_RETRY_DELAY = 1.0
+
+
+def next_retry_delay(delay: float) -> float:
+    """
+    Returns the delay before the next read of a real time source after a failed read, doubling up to MAX_READ_RETRY_DELAY
+    """
+    return min(2 * delay, MAX_READ_RETRY_DELAY) if delay else READ_RETRY_DELAY
+
+
+class VideoSource:
+    """
+    Frame source for a camera device, a video file or a stream URL, returning RGB frames
+
+    Attributes
+    ----------
+    source: Union[int, str]
+        Camera device index, path of a video file or stream URL
+    realtime: bool
+        Whether the source produces frames in real time. Frames of real time sources are dropped when the
+        pipeline falls behind, frames of video files are all processed.
+    """
+
+    def __init__(self, source: Union[int, str] = 0, realtime: Optional[bool] = None):
+        self.source = int(source) if isinstance(source, str) and source.isdigit() else source
+        self.realtime = (isinstance(self.source, int) or '://' in str(self.source)) if realtime is None else realtime
+        self._capture = None
+
+    def open(self) -> None:
+        self._capture = cv2.VideoCapture(self.source)
+        if not self._capture.isOpened():
+            raise IOError(f'Video source {self.source} cannot be opened')
+
+    def read(self) -> Optional[np.ndarray]:
+        """
+        Reads the next frame, None if the source is exhausted or the frame cannot be read
+        """
+        if self._capture is None:
+            self.open()
+        ok, frame = self._capture.read()
+        if not ok or frame is None:
+            return None
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    @property
+    def fps(self) -> float:
+        """
+        Frame rate reported by the source, 0 if it is unknown
+        """
+        if self._capture is None:
+            self.open()
+        return float(self._capture.get(cv2.CAP_PROP_FPS) or 0)
+
+    def skip(self, count: int) -> int:
+        """
+        Skips the next count frames without decoding them
+
+        Returns
+        -------
+        int
+            Number of skipped frames, less than count if the source is exhausted
+        """
+        if self._capture is None:
+            self.open()
+        for skipped in range(count):
+            if not self._capture.grab():
+                return skipped
+        return count
+
+    def release(self) -> None:
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class ImageSequenceSource:
+    """
+    Frame source for an image sequence, e.g. the frames of a recording extracted to files, returning RGB frames
+
+    Attributes
+    ----------
+    pattern: str
+        Glob pattern of the images, which are read in sorted order
+    fps: float
+        Frame rate the images were recorded with, used for the timestamps of the frames
+    """
+    realtime = False
+
+    def __init__(self, pattern: str, fps: float = 1.0):
+        self.pattern = pattern
+        self.fps = fps
+        self._paths = None
+        self._position = 0
+
+    def open(self) -> None:
+        self._paths = sorted(glob(self.pattern))
+        if not self._paths:
+            raise IOError(f'No images match {self.pattern}')
+        self._position = 0
+
+    def read(self) -> Optional[np.ndarray]:
+        """
+        Reads the next image, None if the sequence is exhausted. Images that cannot be read are skipped.
+        """
+        if self._paths is None:
+            self.open()
+        while self._position < len(self._paths):
+            frame = cv2.imread(self._paths[self._position])
+            self._position += 1
+            if frame is not None:
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return None
+
+    def skip(self, count: int) -> int:
+        if self._paths is None:
+            self.open()
+        skipped = min(count, len(self._paths) - self._position)
+        self._position += skipped
+        return skipped
+
+    def release(self) -> None:
+        self._paths = None
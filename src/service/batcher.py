@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+
+class LatencyTracker:
+    """
+    Rolling window of request latencies
+
+    Attributes
+    ----------
+    window: int
+        Number of most recent latencies kept
+    """
+
+    def __init__(self, window: int = 10000):
+        self.window = window
+        self.count = 0
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self.count += 1
+        self._latencies.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        return float(np.percentile(np.fromiter(self._latencies, dtype=np.float64), q))
+
+    def summary(self) -> dict:
+        p50, p99 = self.percentile(50), self.percentile(99)
+        return {
+            'count': self.count,
+            'p50_ms': p50 * 1000 if p50 is not None else None,
+            'p99_ms': p99 * 1000 if p99 is not None else None,
+        }
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into batches processed by one call, so that concurrent clients share model forward passes.
+
+    A batch is processed as soon as it has max_batch_size requests, or max_wait seconds after its first request arrived.
+    Batches are processed one at a time in a worker thread, so the event loop keeps accepting requests meanwhile.
+
+    Attributes
+    ----------
+    process_batch: Callable[[List[Any]], List[Any]]
+        Function that processes a list of requests and returns one result per request
+    max_batch_size: int
+        Maximum number of requests in a batch
+    max_wait: float
+        Maximum time in seconds the first request of a batch waits for more requests
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait: float = 0.01):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batcher')
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, request: Any) -> Any:
+        """
+        Queues a request and waits for its result
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    @property
+    def mean_batch_size(self) -> Optional[float]:
+        return self.batched_requests / self.batches if self.batches else None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests, futures = zip(*batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self.process_batch, list(requests))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_requests += len(batch)
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,233 @@
+"""
+Headless HTTP authentication service. Door cameras POST JPEG frames and concurrent frames are
+micro-batched into shared detection and embedding forward passes.
+
+    python -m src.service.server --port 8000 --max-batch-size 8 --max-wait-ms 10
+    python -m src.service.server --processes 4 --threads-per-process 1
+
+Endpoints
+---------
+POST /authenticate?room=<room>
+    JPEG frame as the request body. Returns the bounding box, user ID and similarity score of every face.
+GET /metrics
+    Request count, p50/p99 latency and mean batch size, and the stage timings if instrumentation is enabled.
+GET /metrics/prometheus
+    Stage timings and counters in the Prometheus text format. Requires --metrics.
+GET /health
+    Returns ok once the models are loaded.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from typing import List, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, UnidentifiedImageError
+
+from src import instrumentation
+from src.authenticator import FaceAuthenticator
+from src.face_detection.image import Frame
+from src.service.batcher import LatencyTracker, MicroBatcher
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+ROOM_NAME_SEPARATORS = {'/', '\\', os.sep, os.altsep} - {None}
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def is_valid_room_name(room_name: str) -> bool:
+    """
+    Returns whether a room name from a request names a directory directly under the rooms path.
+    Path separators, '..' and hidden names such as the '.ann' index directory are rejected.
+    """
+    return (bool(room_name) and not room_name.startswith('.') and '\0' not in room_name
+            and not any(separator in room_name for separator in ROOM_NAME_SEPARATORS))
+
+
+class AuthenticationService:
+    """
+    asyncio HTTP/1.1 server around a FaceAuthenticator
+
+    Attributes
+    ----------
+    authenticator: FaceAuthenticator
+        Detection, embedding and matching of the faces
+    batcher: MicroBatcher
+        Groups concurrent frames into batches
+    latencies: LatencyTracker
+        Latencies of the authenticate requests
+    """
+
+    def __init__(self, authenticator: FaceAuthenticator, max_batch_size: int = 8, max_wait: float = 0.01):
+        self.authenticator = authenticator
+        self.batcher = MicroBatcher(self._process_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+        self.latencies = LatencyTracker()
+        self._server = None
+
+    def _process_batch(self, requests: List[Tuple[bytes, str]]) -> list:
+        frames, room_names, decoded = [], [], []
+        results = [None] * len(requests)
+        for i, (body, room_name) in enumerate(requests):
+            try:
+                frames.append(Frame(Image.open(io.BytesIO(body)).convert('RGB')))
+            except (OSError, UnidentifiedImageError, ValueError) as e:
+                results[i] = ValueError(f'Invalid image: {e}')
+                continue
+            room_names.append(room_name)
+            decoded.append(i)
+        if frames:
+            for i, matches in zip(decoded, self.authenticator.authenticate_batch(frames, room_names)):
+                results[i] = matches
+        return results
+
+    async def start(self, host: str = '0.0.0.0', port: int = 8000) -> None:
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self) -> None:
+        async with self._server:
+            await self._server.serve_forever()
+
+    def metrics(self) -> dict:
+        metrics = {**self.latencies.summary(), 'mean_batch_size': self.batcher.mean_batch_size, 'batches': self.batcher.batches}
+        if instrumentation.registry.enabled:
+            metrics.update(instrumentation.snapshot())
+        return metrics
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {'error': 'Frame is too large'})
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self._route(method, target, body)
+                await self._respond(writer, status, payload)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, body: bytes) -> Tuple[int, Union[dict, str]]:
+        url = urlsplit(target)
+        if method == 'GET' and url.path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and url.path == '/metrics':
+            return 200, self.metrics()
+        if method == 'GET' and url.path == '/metrics/prometheus':
+            return 200, instrumentation.to_prometheus()
+        if method != 'POST' or url.path != '/authenticate':
+            return 404, {'error': f'{method} {url.path} is not found'}
+
+        room_name = parse_qs(url.query).get('room', [None])[0]
+        if not room_name or not body:
+            return 400, {'error': 'A room query parameter and a JPEG body are required'}
+        if not is_valid_room_name(room_name):
+            return 400, {'error': f"Invalid room name '{room_name}'"}
+        start = time.perf_counter()
+        try:
+            result = await self.batcher.submit((body, room_name))
+        except Exception as e:
+            return 500, {'error': str(e)}
+        if isinstance(result, Exception):
+            return 400, {'error': str(result)}
+        latency = time.perf_counter() - start
+        self.latencies.record(latency)
+        faces = [{'bbox': [float(v) for v in match.bbox], 'user_id': match.user_id, 'score': match.score} for match in result]
+        return 200, {'room': room_name, 'faces': faces, 'latency_ms': latency * 1000}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Union[dict, str]) -> None:
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        head = (f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(service: AuthenticationService, host: str, port: int) -> None:
+    await service.start(host, port)
+    print(f'Serving on http://{host}:{port}')
+    try:
+        await service.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    from config import mtcnn_params, inception_params, database_params, startup_params
+    from src.face_detection.mtcnn_model import MTCNNModel
+    from src.face_recognition.authorization_database import AuthorizationDatabase
+    from src.face_recognition.inception_model import InceptionModel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rooms-path', default='rooms')
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--metrics', action='store_true', help='Record the per-stage timings and counters')
+    parser.add_argument('--processes', type=int, default=0, help='Shard the frames of a batch across worker processes')
+    parser.add_argument('--threads-per-process', type=int, default=1, help='torch intra-op threads of every worker process')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between checks for room changes made by other processes, 0 checks on every frame')
+    args = parser.parse_args()
+
+    if args.metrics:
+        instrumentation.enable()
+
+    database = AuthorizationDatabase(room_path=args.rooms_path, **database_params)
+    if args.watch_interval:
+        database.watch(interval=args.watch_interval)
+    if args.processes:
+        from src.runtime.process_pool import ShardedAuthenticator
+
+        authenticator = ShardedAuthenticator(mtcnn_params, inception_params, database, threshold=args.threshold,
+                                             workers=args.processes, threads_per_worker=args.threads_per_process,
+                                             **startup_params)
+    else:
+        authenticator = FaceAuthenticator(
+            detection_model=MTCNNModel(mtcnn_params, **startup_params),
+            embedding_model=InceptionModel(**inception_params, **startup_params),
+            database=database,
+            threshold=args.threshold,
+        )
+    service = AuthenticationService(authenticator, max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.processes:
+            authenticator.close()
+
+
+if __name__ == '__main__':
+    main()
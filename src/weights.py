@@ -0,0 +1,132 @@
+"""
+Local cache of the model weights, so that the models are loaded without network access.
+
+The cache directory is the weights_dir argument of the models, the FACE_AUTH_WEIGHTS environment variable
+or 'weights'. It is filled on a host with network access and copied to air-gapped hosts:
+
+    python -m src.weights fetch --weights-dir weights
+    python -m src.weights export --weights-dir weights --artifact weights/inception-int8.pt --precision int8 --calibration-images "faces/*.jpg"
+"""
+import argparse
+import os
+import shutil
+from typing import Optional
+
+WEIGHTS_DIR_ENV = 'FACE_AUTH_WEIGHTS'
+DEFAULT_WEIGHTS_DIR = 'weights'
+INCEPTION_FILES = {
+    'vggface2': '20180402-114759-vggface2.pt',
+    'casia-webface': '20180408-102900-casia-webface.pt',
+}
+MTCNN_NETS = ('pnet', 'rnet', 'onet')
+
+
+def get_weights_dir(weights_dir: Optional[str] = None) -> str:
+    return weights_dir or os.environ.get(WEIGHTS_DIR_ENV, DEFAULT_WEIGHTS_DIR)
+
+
+def inception_weights_path(pretrained: str, weights_dir: Optional[str] = None) -> str:
+    if pretrained not in INCEPTION_FILES:
+        raise ValueError(f"Pretrained weights only exist for {list(INCEPTION_FILES)}")
+    return os.path.join(get_weights_dir(weights_dir), INCEPTION_FILES[pretrained])
+
+
+def load_inception(pretrained: Optional[str], weights_dir: Optional[str] = None, allow_download: bool = False):
+    """
+    Builds InceptionResnetV1 with the pretrained weights of the local cache. Raises FileNotFoundError naming the
+    missing file if the weights are not cached, unless allow_download is set to fall back to the facenet_pytorch download.
+
+    Parameters
+    ----------
+    pretrained: Optional[str]
+        'vggface2' or 'casia-webface', None for random weights
+    weights_dir: Optional[str]
+        Directory of the weight cache
+    allow_download: bool
+        Whether to download the weights if they are not cached
+
+    Returns
+    -------
+    InceptionResnetV1
+        The model in evaluation mode
+    """
+    import torch
+    from facenet_pytorch import InceptionResnetV1
+
+    if pretrained is None:
+        return InceptionResnetV1().eval()
+    path = inception_weights_path(pretrained, weights_dir)
+    if not os.path.exists(path):
+        if not allow_download:
+            raise FileNotFoundError(f"'{path}' is not found. Run 'python -m src.weights fetch' on a host with network access "
+                                    f"and copy the weights, or set allow_download to download them.")
+        try:
+            return InceptionResnetV1(pretrained=pretrained).eval()
+        except OSError as e:
+            raise FileNotFoundError(f"'{path}' is not found and the weights cannot be downloaded ({e}). "
+                                    f"Run 'python -m src.weights fetch' on a host with network access and copy the weights.") from e
+
+    model = InceptionResnetV1()
+    state_dict = torch.load(path, map_location='cpu')
+    # The classification layer of the pretraining dataset is not used for embeddings
+    model.load_state_dict({name: value for name, value in state_dict.items() if not name.startswith('logits.')})
+    return model.eval()
+
+
+def load_mtcnn_weights(mtcnn, weights_dir: Optional[str] = None) -> None:
+    """
+    Loads the P-, R- and O-net weights of the local cache into a MTCNN, if they are cached.
+    The weights bundled with facenet_pytorch are used otherwise, they need no network access either.
+    """
+    import torch
+
+    for name in MTCNN_NETS:
+        path = os.path.join(get_weights_dir(weights_dir), f'{name}.pt')
+        if os.path.exists(path):
+            getattr(mtcnn, name).load_state_dict(torch.load(path, map_location='cpu'))
+
+
+def fetch(weights_dir: Optional[str] = None) -> None:
+    """
+    Downloads the InceptionResnetV1 weights and copies the MTCNN weights into the cache
+    """
+    import facenet_pytorch
+    from facenet_pytorch.models.inception_resnet_v1 import get_torch_home
+
+    weights_dir = get_weights_dir(weights_dir)
+    os.makedirs(weights_dir, exist_ok=True)
+    for pretrained, filename in INCEPTION_FILES.items():
+        facenet_pytorch.InceptionResnetV1(pretrained=pretrained)
+        shutil.copyfile(os.path.join(get_torch_home(), 'checkpoints', filename), os.path.join(weights_dir, filename))
+    data_dir = os.path.join(os.path.dirname(facenet_pytorch.__file__), 'data')
+    for name in MTCNN_NETS:
+        shutil.copyfile(os.path.join(data_dir, f'{name}.pt'), os.path.join(weights_dir, f'{name}.pt'))
+    print(f"Weights are cached in '{weights_dir}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('fetch', 'export'))
+    parser.add_argument('--weights-dir', default=None)
+    parser.add_argument('--artifact', help='Path of the exported TorchScript embedding model')
+    parser.add_argument('--precision', default='fp32', choices=('fp32', 'int8'))
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--calibration-images', help='Glob of face crops that calibrate the int8 engine')
+    parser.add_argument('--allow-download', action='store_true', help='Download the weights to export if they are not cached')
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        fetch(args.weights_dir)
+    else:
+        from src.face_recognition.inception_model import InceptionModel
+
+        if not args.artifact:
+            parser.error('--artifact is required to export')
+        model = InceptionModel(precision=args.precision, channels_last=args.channels_last, weights_dir=args.weights_dir,
+                               allow_download=args.allow_download, calibration_images=args.calibration_images)
+        model.save_artifact(args.artifact)
+        print(f"Embedding model is exported to '{args.artifact}'")
+
+
+if __name__ == '__main__':
+    main()
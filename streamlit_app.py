@@ -1,27 +1,36 @@
 import os, time
-import cv2, torch
+import torch
 import streamlit as st
-from PIL import Image
 from glob import glob
 from typing import List
 
-from config import mtcnn_params
-from src import Frame, MTCNNModel
+from config import mtcnn_params, detection_frontend_params, inception_params, tracker_params, database_params, startup_params
+from src import MTCNNModel
+from src.face_detection.face_tracker import FaceTracker
+from src.face_detection.gated_detector import GatedDetector
+from src.face_detection.overlay import OverlayRenderer
 from src.face_recognition.authorization_database import AuthorizationDatabase
 from src.face_recognition.inception_model import InceptionModel
+from src.runtime.pipeline import AuthenticationPipeline
+from src.runtime.sources import VideoSource
 
 
 @st.cache_resource
 def face_detection() -> MTCNNModel:
-    face_detection_model = MTCNNModel(mtcnn_params)
+    face_detection_model = MTCNNModel(mtcnn_params, **startup_params)
     return face_detection_model
 
 @st.cache_resource
+def embedding() -> InceptionModel:
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    params = dict(inception_params)
+    if device != 'cpu' and params["precision"] == "int8":
+        params["precision"] = "fp32"
+    return InceptionModel(device=device, **params, **startup_params)
+
 def extract_embeddings(image):
     if image is not None:
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        embedding_model = InceptionModel(device=device)
-        user_embedding = embedding_model.get_embedding(image)
+        user_embedding = embedding().get_embedding(image)
         return user_embedding
     else:
         return None
@@ -45,49 +54,50 @@ def add_user():
     FRAME_WINDOW = st.image([])
     save_button = st.button('Save Image')
 
-    camera_opened = False
-
-    while run:
-        if not camera_opened and run:
-            camera = cv2.VideoCapture(0)
-            camera_opened = True
-        _, frame = camera.read()
-        if frame is not None:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pillow_image = Image.fromarray(frame)
-            img = Frame(pillow_image)
-            model = face_detection()
-            face_img = model.detect(img, return_frame=True)
-            img_w_bbox = face_img.visualize(return_image=True)
+    if not run:
+        return
+    pipeline = AuthenticationPipeline(source=VideoSource(0), detection_model=face_detection())
+    renderer = OverlayRenderer()
+    with pipeline:
+        while run:
+            try:
+                item = pipeline.get_result(timeout=1.0)
+            except Exception as e:
+                st.error(f"Camera stopped: {e}")
+                break
+            if item is None:
+                continue
+            face_img = item.frame
+            detections = item.detections
+            img_w_bbox = renderer.render(face_img.get_array(), detections.boxes if detections else [])
             FRAME_WINDOW.image(img_w_bbox)
 
-        if save_button:
-            if face_img.bbox is not None:
-                if len(username) > 0:
-                    ad = AuthorizationDatabase(room_path='rooms')
-                    face = model.detect(img)
-                    user_embedding = extract_embeddings(face)
-                    username = username.replace('_', '').replace(' ', '')
-                    ad.add_user(room_name=classroom, user_id=username, embedding=user_embedding)
-                    st.balloons()  # Display balloons animation to indicate image is saved
-                    st.success(f"{username} is added to authorized users for {classroom}")
-                    save_button = False
+            if save_button:
+                if face_img.bbox is not None:
+                    if len(username) > 0:
+                        ad = AuthorizationDatabase(room_path='rooms', **database_params)
+                        user_embedding = extract_embeddings(detections.face)
+                        username = username.replace('_', '').replace(' ', '')
+                        ad.add_user(room_name=classroom, user_id=username, embedding=user_embedding)
+                        st.balloons()  # Display balloons animation to indicate image is saved
+                        st.success(f"{username} is added to authorized users for {classroom}")
+                        save_button = False
+                    else:
+                        st.warning(f'Length of username should be more than 1 character!')
+                        save_button = False
                 else:
-                    st.warning(f'Length of username should be more than 1 character!')
+                    st.warning(f'Face is not detected. Please wait for the red box before saving.')
                     save_button = False
-            else:
-                st.warning(f'Face is not detected. Please wait for the red box before saving.')
-                save_button = False
     
 
 def remove_user():
     st.subheader("Remove User")
-    ad = AuthorizationDatabase(room_path='rooms')
+    ad = AuthorizationDatabase(room_path='rooms', **database_params)
     # List all rooms
     classrooms = [os.path.basename(room_path) for room_path in glob(f"{os.path.join(os.getcwd(), 'rooms')}/*")]
     selected_room = st.selectbox("Select Classroom", classrooms)
     # Get authorized users for the selected room
-    authorized_users = [file.split('_')[0] for file in os.listdir(os.path.join('rooms', selected_room)) if file.endswith('_emb.pt')]
+    authorized_users = ad.list_users(selected_room) if selected_room is not None else []
     # Show authorized users
     selected_user = st.selectbox("Select User to Remove", authorized_users)
 
@@ -99,7 +109,7 @@ def remove_user():
 
 
 def authenticate():
-    ad = AuthorizationDatabase(room_path='rooms')
+    ad = AuthorizationDatabase(room_path='rooms', **database_params)
     st.subheader("Authenticate")
     classrooms = [os.path.basename(room_path) for room_path in glob(f"{os.path.join(os.getcwd(), 'rooms')}/*")]
     classroom = st.selectbox("Select Classroom", classrooms)
@@ -110,52 +120,53 @@ def authenticate():
     max_failures = 10
     failure_count = 0
     authentication_done = False
-    camera_opened = False
     name = None
 
-    while run:
-        if not camera_opened and run:
-            camera = cv2.VideoCapture(0)
-            camera_opened = True
-            st.info("Camera Starts")
-            st.info("Authorizing User..")
-
-        _, frame = camera.read()
-        if frame is not None:
-            # Screen and bbox capture
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pillow_image = Image.fromarray(frame)
-            img = Frame(pillow_image)
-            model = face_detection()
-            screen_img = model.detect(img, return_frame=True)
-            # Detection and Recognition
-            if not authentication_done:
-                face_img = model.detect(img)
-                user_embedding = extract_embeddings(face_img)
-            
-            if user_embedding is not None and not authentication_done:
-                is_auth, user_id, _ = ad.authorize_user(room_name=classroom, new_embedding=user_embedding)
-                if is_auth:
+    if not run:
+        return
+    st.info("Camera Starts")
+    st.info("Authorizing User..")
+    detector = GatedDetector(face_detection(), **detection_frontend_params)
+    pipeline = AuthenticationPipeline(source=VideoSource(0), detection_model=detector,
+                                      embedding_model=embedding(), database=ad, room_name=classroom,
+                                      tracker=FaceTracker(**tracker_params))
+    renderer = OverlayRenderer()
+    with pipeline:
+        while run:
+            try:
+                item = pipeline.get_result(timeout=1.0)
+            except Exception as e:
+                st.error(f"Camera stopped: {e}")
+                break
+            if item is None:
+                continue
+            screen_img = item.frame
+            # Detection, embedding and matching run in the pipeline threads, tracked faces are only matched again when their identity expires.
+            # Every frame of an unauthorized face counts as a failure, whether it was matched in this frame or cached from its track.
+            if item.matches and not authentication_done:
+                user_id = item.matches[0].user_id
+                if user_id is not None:
                     border_color = "green"
                     st.success("Authentication successful. Access granted!")
                     authentication_done = True
+                    pipeline.recognize = False
                     name = user_id
                 else:
                     border_color = "red"
                     failure_count += 1
                     if failure_count >= max_failures:
                         st.error(f"Authentication failed. Access denied.")
-                        camera.release()
                         st.error("Camera stopped.")
                         break
-            img_w_bbox = screen_img.visualize(return_image=True, border_color= border_color, text=name)
+            boxes = item.detections.boxes if item.detections else []
+            labels = [name] + [None] * (len(boxes) - 1)
+            img_w_bbox = renderer.render(screen_img.get_array(), boxes, labels=labels, colors=border_color)
             FRAME_WINDOW.image(img_w_bbox)
-            
+
             if screen_img.bbox is None and authentication_done:
                 time.sleep(2)
-                camera.release()
                 st.error("Detection lost. Camera stopped.")
-
+                break
 
 
 def app():
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+import torch
+
+from src.face_recognition.ann_index import ANNIndex, ExactIndex, IVFIndex, create_ann_index
+
+
+def clustered_vectors(count, dim=32, clusters=20, noise=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    vectors = centers[rng.integers(0, clusters, count)] + noise * rng.standard_normal((count, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def noisy_queries(vectors, noise=0.05, seed=1):
+    queries = vectors + noise * np.random.default_rng(seed).standard_normal(vectors.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def build(index, vectors):
+    index.add([f'u{i}' for i in range(len(vectors))], vectors)
+    return index
+
+
+def recall(index, exact, queries, k=5):
+    found = index.search(queries, k)
+    expected = exact.search(queries, k)
+    return np.mean([len({id_ for id_, _ in a} & {id_ for id_, _ in b}) / k for a, b in zip(found, expected)])
+
+
+def test_exact_search_is_sorted_and_complete():
+    vectors = clustered_vectors(50)
+    index = build(ExactIndex(), vectors)
+    results = index.search(vectors[:3], k=4)
+    for i, matches in enumerate(results):
+        assert matches[0] == (f'u{i}', pytest.approx(1.0, abs=1e-5))
+        scores = [score for _, score in matches]
+        assert scores == sorted(scores, reverse=True) and len(scores) == 4
+    assert len(index.search(vectors[:1], k=100)[0]) == 50
+
+
+def test_ivf_recall_against_exact_search():
+    vectors = clustered_vectors(2000)
+    queries = noisy_queries(vectors[:200])
+    ivf, exact = build(IVFIndex(nprobe=8), vectors), build(ExactIndex(), vectors)
+    assert recall(ivf, exact, queries) >= 0.9
+    top = [matches[0][0] for matches in ivf.search(queries, 1)]
+    assert np.mean([id_ == matches[0][0] for id_, matches in zip(top, exact.search(queries, 1))]) >= 0.95
+
+
+def test_ivf_retrains_after_growth():
+    vectors = clustered_vectors(400)
+    index = build(IVFIndex(retrain_growth=2.0), vectors[:100])
+    index.train()
+    centroids = index.centroids
+
+    index.add(['a'], vectors[100:101])
+    assert index.centroids is centroids and len(index.assignments) == 101
+    index.add([f'b{i}' for i in range(150)], vectors[101:251])
+    assert index.centroids is None
+    index.search(vectors[:1])
+    assert index._trained_size == 251 and len(index.assignments) == 251
+
+
+def test_save_and_load_after_removals(tmp_path):
+    vectors = clustered_vectors(500)
+    index = build(IVFIndex(), vectors)
+    index.train()
+    index.remove([f'u{i}' for i in range(0, 500, 3)])
+    assert len(index) == 333 and 'u0' not in index.ids
+
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = ANNIndex.load(path)
+    assert isinstance(loaded, IVFIndex) and loaded.ids == index.ids
+    np.testing.assert_array_equal(loaded.centroids, index.centroids)
+    queries = noisy_queries(vectors[1:30])
+    assert loaded.search(queries, 3) == index.search(queries, 3)
+
+    loaded.remove(loaded.ids)
+    assert len(loaded) == 0 and loaded.search(queries[:1]) == [[]]
+
+
+def test_hnsw_matches_exact_search():
+    pytest.importorskip('faiss')
+    vectors = clustered_vectors(500)
+    queries = noisy_queries(vectors[:50])
+    index, exact = build(create_ann_index('hnsw'), vectors), build(ExactIndex(), vectors)
+    index.remove(['u1'])
+    exact.remove(['u1'])
+    assert recall(index, exact, queries) >= 0.95
+    assert all(id_ != 'u1' for matches in index.search(queries, 5) for id_, _ in matches)
+
+
+def test_global_index_follows_room_changes(tmp_path):
+    from src.face_recognition.authorization_database import AuthorizationDatabase
+
+    vectors = clustered_vectors(6)
+    database = AuthorizationDatabase(room_path=str(tmp_path), exact_search_limit=0)
+    database.add_users('a', ['x', 'y', 'z'], torch.from_numpy(vectors[:3]))
+    database.add_users('b', ['x', 'w'], torch.from_numpy(vectors[3:5]))
+    # The index is persisted trained, so that other processes do not retrain it on load
+    database.get_global_index()
+    assert AuthorizationDatabase(room_path=str(tmp_path)).get_global_index().centroids is not None
+    assert database.identify(torch.from_numpy(vectors[3]), k=1)[0][:2] == ('b', 'x')
+
+    database.remove_user('b', 'x')
+    assert sorted(database.get_global_index().ids) == ['a/x', 'a/y', 'a/z', 'b/w']
+    assert database.identify(torch.from_numpy(vectors[3]), k=1)[0][:2] != ('b', 'x')
+
+    # Another process loads the index trained and only re-indexes the rooms that changed since
+    reloaded = AuthorizationDatabase(room_path=str(tmp_path), exact_search_limit=0)
+    index = reloaded.get_global_index()
+    assert index.centroids is not None and sorted(index.ids) == ['a/x', 'a/y', 'a/z', 'b/w']
+    database.add_users('a', ['v'], torch.from_numpy(vectors[5:]))
+    assert 'a/v' in reloaded.get_global_index().ids
+    assert reloaded.identify(torch.from_numpy(vectors[5]), k=1)[0][:2] == ('a', 'v')
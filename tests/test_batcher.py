@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from src.service.batcher import MicroBatcher
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, requests):
+        self.batches.append(list(requests))
+        if 'fail' in requests:
+            raise RuntimeError('batch failed')
+        return [request * 2 for request in requests]
+
+
+async def submit_all(batcher, requests):
+    start = time.monotonic()
+    results = await asyncio.gather(*(batcher.submit(request) for request in requests), return_exceptions=True)
+    return results, time.monotonic() - start
+
+
+def test_full_batch_is_processed_without_waiting():
+    async def run():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch_size=4, max_wait=10)
+        batcher.start()
+        try:
+            results, elapsed = await submit_all(batcher, range(8))
+        finally:
+            await batcher.stop()
+        assert results == [0, 2, 4, 6, 8, 10, 12, 14]
+        assert recorder.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+        assert elapsed < 5
+        assert (batcher.batches, batcher.mean_batch_size) == (2, 4)
+
+    asyncio.run(run())
+
+
+def test_partial_batch_is_processed_after_max_wait():
+    async def run():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch_size=8, max_wait=0.05)
+        batcher.start()
+        try:
+            results, elapsed = await submit_all(batcher, range(3))
+            assert results == [0, 2, 4] and elapsed >= 0.05
+            results, _ = await submit_all(batcher, [1, 'fail'])
+        finally:
+            await batcher.stop()
+        assert recorder.batches == [[0, 1, 2], [1, 'fail']]
+        # A failed batch fails every request of it, but the batcher keeps running
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert batcher.batches == 1
+
+    asyncio.run(run())
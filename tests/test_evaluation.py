@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.evaluation import SCORE_BINS, calibrate, score_histograms
+
+
+def histogram(scores):
+    bins = np.clip(np.rint((np.asarray(scores) + 1) * ((SCORE_BINS - 1) / 2)), 0, SCORE_BINS - 1).astype(np.int64)
+    return np.bincount(bins, minlength=SCORE_BINS)
+
+
+def test_histograms_count_every_pair_once_in_any_block_size():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(30, 16)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    labels = np.repeat(np.array(['a', 'b', 'c', 'd', 'e']), 6)
+
+    i, j = np.triu_indices(len(embeddings), k=1)
+    scores = np.sum(embeddings[i] * embeddings[j], axis=1)
+    same = labels[i] == labels[j]
+    expected = histogram(scores[same]), histogram(scores[~same])
+    for block_size in [1, 7, 1024]:
+        genuine, impostor = score_histograms(embeddings, labels, block_size=block_size)
+        assert np.array_equal(genuine, expected[0]) and np.array_equal(impostor, expected[1])
+    assert (expected[0].sum(), expected[1].sum()) == (5 * 15, 435 - 5 * 15)
+
+
+def test_separable_scores_have_no_equal_error():
+    # Every user has its own orthogonal embedding, genuine pairs score 1 and impostor pairs 0
+    embeddings = np.repeat(np.eye(4, dtype=np.float32), 3, axis=0)
+    labels = np.repeat(np.arange(4), 3)
+    genuine, impostor = score_histograms(embeddings, labels)
+    report = calibrate(genuine, impostor)
+    assert (report['genuine_pairs'], report['impostor_pairs']) == (12, 54)
+    assert report['eer'] == 0
+    assert report['recommended_threshold'] == 0
+    assert report['far_at_recommended'] == 0 and report['frr_at_recommended'] == 0
+    assert report['far_at_0.7'] == 0 and report['frr_at_0.7'] == 0
+
+
+def test_overlapping_scores_are_calibrated():
+    rng = np.random.default_rng(0)
+    genuine = histogram(rng.normal(0.6, 0.1, 200000))
+    impostor = histogram(rng.normal(0.4, 0.1, 200000))
+    report = calibrate(genuine, impostor, target_far=1e-3)
+    # Both distributions are one standard deviation away from 0.5, so the EER is Phi(-1)
+    assert abs(report['eer'] - 0.1587) < 0.005
+    assert abs(report['eer_threshold'] - 0.5) < 0.005
+    # The 99.9th percentile of the impostor scores is 3.09 standard deviations above their mean
+    assert abs(report['recommended_threshold'] - 0.709) < 0.01
+    assert report['far_at_recommended'] <= 1e-3
+    assert abs(report['frr_at_recommended'] - 0.85) < 0.03
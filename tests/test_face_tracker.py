@@ -0,0 +1,78 @@
+from src.face_detection.face_tracker import FaceTracker
+
+
+def shifted(box, dx, dy=0):
+    return [box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy]
+
+
+BOX = [100, 100, 200, 200]
+
+
+def test_moving_face_keeps_its_track_and_identity():
+    tracker = FaceTracker()
+    tracks = tracker.update([BOX])
+    assert tracker.select_for_recognition(tracks) == [0]
+    tracker.record_identity(tracks[0], 'user', 0.9)
+
+    for step in range(1, 6):
+        tracks = tracker.update([shifted(BOX, 10 * step)])
+        assert tracks[0].track_id == 0 and tracks[0].user_id == 'user'
+        assert tracker.select_for_recognition(tracks) == []
+    assert tracks[0].bbox == shifted(BOX, 50)
+
+
+def test_faces_are_matched_to_their_own_tracks():
+    tracker = FaceTracker()
+    other = shifted(BOX, 300)
+    tracks = tracker.update([BOX, other])
+    assert [track.track_id for track in tracks] == [0, 1]
+    tracks = tracker.update([shifted(other, 5), shifted(BOX, 5)])
+    assert [track.track_id for track in tracks] == [1, 0]
+
+
+def test_fast_face_is_matched_by_its_centroid_and_recognized_again():
+    tracker = FaceTracker()
+    tracker.select_for_recognition(tracker.update([BOX]))
+    # IoU of 0.25 is below the threshold, but the centroid only moved 0.42 box diagonals
+    tracks = tracker.update([shifted(BOX, 60)])
+    assert tracks[0].track_id == 0
+    assert tracker.select_for_recognition(tracks) == [0]
+
+
+def test_large_jump_starts_a_new_track():
+    tracker = FaceTracker()
+    tracker.select_for_recognition(tracker.update([BOX]))
+    tracks = tracker.update([shifted(BOX, 400)])
+    assert tracks[0].track_id == 1 and tracks[0].user_id is None
+    assert tracker.select_for_recognition(tracks) == [0]
+    assert [track.track_id for track in tracker.tracks] == [0, 1]
+
+
+def test_missing_face_expires_and_is_recognized_again():
+    tracker = FaceTracker(max_missed=2)
+    tracks = tracker.update([BOX])
+    tracker.select_for_recognition(tracks)
+    tracker.record_identity(tracks[0], 'user', 0.9)
+
+    tracker.update([])
+    tracker.update([])
+    assert [track.track_id for track in tracker.tracks] == [0]
+    tracker.update([])
+    assert tracker.tracks == []
+
+    tracks = tracker.update([BOX])
+    assert tracks[0].track_id == 1 and tracks[0].user_id is None
+    assert tracker.select_for_recognition(tracks) == [0]
+
+
+def test_identity_is_rechecked_after_interval_and_confidence_decay():
+    tracker = FaceTracker(recheck_interval=3, confidence_decay=1.0)
+    tracker.select_for_recognition(tracker.update([BOX]))
+    selected = [tracker.select_for_recognition(tracker.update([BOX])) for _ in range(6)]
+    assert selected == [[], [], [0], [], [], [0]]
+
+    tracker = FaceTracker(recheck_interval=100, confidence_decay=0.8, min_confidence=0.6)
+    tracker.select_for_recognition(tracker.update([BOX]))
+    # 0.8 and 0.64 are still confident, 0.512 is not
+    selected = [tracker.select_for_recognition(tracker.update([BOX])) for _ in range(3)]
+    assert selected == [[], [], [0]]
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from src.face_detection import gated_detector
+from src.face_detection.detection_result import DetectionResult
+from src.face_detection.gated_detector import GatedDetector
+from src.face_detection.image import Frame
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+
+class FakeModel:
+    """
+    Finds one face at a fixed position of the image it is given and advances the clock by its latency
+    """
+
+    def __init__(self, clock, latency=0.0):
+        self.clock = clock
+        self.latency = latency
+        self.sizes = []
+
+    def detect_faces(self, image, offset_ratio=0.05):
+        self.sizes.append((image.width, image.height))
+        self.clock.now += self.latency
+        return DetectionResult(image, [[10, 20, 30, 40]], [0.99], [np.ones((5, 2))])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(gated_detector, 'time', clock)
+    return clock
+
+
+def frame(value, size=(64, 96)):
+    return Frame(np.full((*size, 3), value, dtype=np.uint8))
+
+
+def test_static_frames_reuse_the_last_faces(clock):
+    model = FakeModel(clock)
+    detector = GatedDetector(model, motion_threshold=2.0, detection_scale=1, target_latency=None)
+    reused = [detector.detect_faces(frame(value)).reused for value in [100, 100, 101, 100, 150, 150]]
+    assert reused == [False, True, True, True, False, True]
+    assert (detector.detected, detector.skipped) == (2, 4)
+
+    skipped = detector.detect_faces(frame(150))
+    assert skipped.boxes == [[10, 20, 30, 40]] and skipped.probs == [0.99]
+    # Frames of another size are always detected
+    assert not detector.detect_faces(frame(150, size=(32, 48))).reused
+
+
+def test_boxes_are_scaled_back_to_the_frame(clock):
+    model = FakeModel(clock)
+    detector = GatedDetector(model, motion_threshold=0, detection_scale=0.5, target_latency=None)
+    result = detector.detect_faces(frame(0))
+    assert model.sizes == [(48, 32)]
+    assert result.boxes == [[20, 40, 60, 80]]
+    assert np.array_equal(result.landmarks[0], np.full((5, 2), 2.0))
+    with pytest.raises(ValueError):
+        GatedDetector(model, detection_scale=0)
+
+
+def test_stride_grows_under_load_and_recovers(clock):
+    model = FakeModel(clock, latency=0.1)
+    detector = GatedDetector(model, motion_threshold=0, detection_scale=1, target_latency=0.05, max_stride=3)
+    reused = [detector.detect_faces(frame(index)).reused for index in range(8)]
+    assert reused == [False, True, False, True, True, False, True, True]
+    assert detector.stride == 3
+
+    model.latency = 0.01
+    reused = [detector.detect_faces(frame(index)).reused for index in range(8)]
+    assert reused == [False, True, False, False, False, False, False, False]
+    assert detector.stride == 1
+
+
+def test_motion_is_detected_once_the_stride_elapses(clock):
+    model = FakeModel(clock, latency=0.1)
+    detector = GatedDetector(model, motion_threshold=2.0, detection_scale=1, target_latency=0.05, max_stride=2)
+    reused = [detector.detect_faces(frame(value)).reused for value in [0, 100, 100, 100, 100, 200]]
+    # The stride skips the moving frame after a detection, static frames are skipped after it elapsed
+    assert reused == [False, True, False, True, True, False]
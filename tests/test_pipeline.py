@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.face_detection.detection_result import DetectionResult
+from src.runtime.pipeline import AuthenticationPipeline
+
+
+class FrameSource:
+    realtime = False
+
+    def __init__(self, count):
+        self.count = count
+        self.index = 0
+
+    def read(self):
+        if self.index == self.count:
+            return None
+        self.index += 1
+        return np.full((8, 8, 3), self.index - 1, dtype=np.uint8)
+
+    def release(self):
+        pass
+
+
+class FailingDetector:
+    """
+    Detects no faces and raises on the third frame
+    """
+
+    def detect_faces(self, frame):
+        if frame.get_array()[0, 0, 0] == 2:
+            raise RuntimeError('detection failed')
+        return DetectionResult(frame)
+
+
+def test_failed_frame_is_dropped_and_the_stage_keeps_running():
+    pipeline = AuthenticationPipeline(FrameSource(5), FailingDetector())
+    indices = []
+    with pipeline:
+        while True:
+            item = pipeline.get_result(timeout=5)
+            if item is None:
+                break
+            indices.append(item.index)
+    assert indices == [0, 1, 3, 4]
+    assert pipeline.error is None
+    metrics = pipeline.stage_metrics()['detect']
+    assert (metrics['processed'], metrics['failed']) == (4, 1)
+    assert not pipeline.running
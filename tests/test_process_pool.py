@@ -0,0 +1,78 @@
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from src.runtime.process_pool import ShardedAuthenticator
+
+
+class FailingExecutor:
+    """
+    Runs nothing, the frames whose first pixel is odd fail like a crashed worker
+    """
+
+    def submit(self, fn, name, shape, offset_ratio):
+        self.shapes.append(shape)
+        future = Future()
+        if self.frames[name][0, 0, 0] % 2:
+            future.set_exception(RuntimeError('worker failed'))
+        else:
+            future.set_result(([], [], None))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@pytest.fixture
+def authenticator():
+    # The worker processes are replaced, only the slot bookkeeping of the parent is tested
+    authenticator = ShardedAuthenticator.__new__(ShardedAuthenticator)
+    authenticator.max_frame_shape = (4, 4, 3)
+    authenticator.offset_ratio = 0.05
+    authenticator.database = None
+    authenticator.threshold = 0.7
+    authenticator._slots = [shared_memory.SharedMemory(create=True, size=48) for _ in range(3)]
+    authenticator._free = deque(authenticator._slots)
+    executor = FailingExecutor()
+    executor.shapes = []
+    executor.frames = {slot.name: np.ndarray((4, 4, 3), dtype=np.uint8, buffer=slot.buf) for slot in authenticator._slots}
+    authenticator._executor = executor
+    yield authenticator
+    authenticator.close()
+
+
+def frames(*values):
+    return [np.full((4, 4, 3), value, dtype=np.uint8) for value in values]
+
+
+def test_failed_batch_returns_every_slot(authenticator):
+    with pytest.raises(RuntimeError):
+        authenticator.authenticate_batch(frames(0, 1, 2, 4, 6), ['room'] * 5)
+    assert len(authenticator._free) == 3
+    assert authenticator.authenticate_batch(frames(0, 2, 4, 6), ['room'] * 4) == [[], [], [], []]
+    assert len(authenticator._free) == 3
+
+
+def test_failed_stream_returns_every_slot(authenticator):
+    results = authenticator.imap(frames(0, 2, 1, 4, 6), 'room')
+    assert next(results) == []
+    assert next(results) == []
+    with pytest.raises(RuntimeError):
+        next(results)
+    assert len(authenticator._free) == 3
+
+
+def test_oversized_frame_is_downscaled_without_failing_the_batch(authenticator):
+    images = frames(0, 2) + [np.zeros((8, 6, 3), dtype=np.uint8)]
+    assert authenticator.authenticate_batch(images, ['room'] * 3) == [[], [], []]
+    assert authenticator._executor.shapes[2] == (4, 3, 3)
+    assert len(authenticator._free) == 3
+
+    array, scale = authenticator._as_array(images[2])
+    assert array.shape == (4, 3, 3) and scale == (0.5, 0.5)
+    assert authenticator._rescale(([[1, 1, 2, 3]], [0.9], None), scale)[0] == [[2, 2, 4, 6]]
+    with pytest.raises(ValueError):
+        authenticator._as_array(np.zeros((4, 4), dtype=np.uint8))
@@ -0,0 +1,24 @@
+import threading
+
+from src.runtime.queues import DropOldestQueue
+
+
+def test_full_queue_drops_its_oldest_items():
+    queue = DropOldestQueue(maxsize=3)
+    for item in range(5):
+        assert queue.put(item)
+    assert (len(queue), queue.dropped) == (3, 2)
+    assert [queue.get(timeout=0) for _ in range(4)] == [2, 3, 4, None]
+
+
+def test_blocking_put_waits_for_free_space():
+    queue = DropOldestQueue(maxsize=1)
+    queue.put('old')
+    assert not queue.put('new', block=True, timeout=0.01)
+    assert (len(queue), queue.dropped) == (1, 0)
+
+    consumer = threading.Timer(0.05, queue.get)
+    consumer.start()
+    assert queue.put('new', block=True, timeout=5)
+    consumer.join()
+    assert queue.get(timeout=0) == 'new' and queue.dropped == 0
@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+import pytest
+import torch
+
+from src.face_recognition.room_index import RoomIndex
+from src.face_recognition.room_storage import (COUNT_OFFSET, HEADER_FORMAT, HEADER_SIZE, IDS_FILENAME, MAGIC, MATRIX_FILENAME,
+                                               RoomStorage, prepare_embeddings)
+
+
+def random_embeddings(count, dim=16, seed=0):
+    return prepare_embeddings(np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32))
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return RoomStorage(str(tmp_path / 'room'), min_compact_rows=4)
+
+
+def test_header_layout(storage):
+    storage.append(['a', 'b'], random_embeddings(2))
+    with open(storage.matrix_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    magic, version, dtype_code, dim, count, ids_size = struct.unpack(HEADER_FORMAT, header)
+    assert (magic, version, dtype_code, dim, count) == (MAGIC, 1, 1, 16, 2)
+    assert ids_size == len(b'a\nb\n')
+    assert COUNT_OFFSET == 16
+    assert os.path.getsize(storage.matrix_path) == HEADER_SIZE + 2 * 16 * 4
+    assert storage.read_header() == (np.dtype(np.float32), 16, 2, ids_size)
+
+
+def test_float16_storage(tmp_path):
+    storage = RoomStorage(str(tmp_path / 'room'), dtype='float16')
+    embeddings = random_embeddings(3)
+    storage.append(['a', 'b', 'c'], embeddings)
+    user_ids, matrix = storage.load()
+    assert user_ids == ['a', 'b', 'c']
+    assert matrix.dtype == np.float16
+    np.testing.assert_allclose(matrix, embeddings, atol=1e-3)
+
+
+def test_append_is_committed_by_the_header(storage):
+    embeddings = random_embeddings(3)
+    storage.append(['a', 'b'], embeddings[:2])
+    # Rows and ids written after the committed header are left over from an interrupted append
+    with open(storage.ids_path, 'ab') as f:
+        f.write(b'partial\n')
+    with open(storage.matrix_path, 'ab') as f:
+        f.write(embeddings[2].tobytes())
+    assert storage.load()[0] == ['a', 'b']
+
+    storage.append(['c'], embeddings[2:])
+    user_ids, matrix = storage.load()
+    assert user_ids == ['a', 'b', 'c']
+    np.testing.assert_allclose(matrix, embeddings, atol=1e-6)
+
+
+def test_replace_supersedes_and_remove_appends_tombstones(storage):
+    embeddings = random_embeddings(4)
+    storage.append(['a', 'b', 'c'], embeddings[:3])
+    storage.replace(['b'], embeddings[3:])
+    assert storage.remove(['a', 'missing']) == 1
+
+    user_ids, matrix = storage.load()
+    assert user_ids == ['c', 'b']
+    np.testing.assert_allclose(matrix, embeddings[[2, 3]], atol=1e-6)
+    # Nothing is rewritten below the compaction limit
+    assert len(storage.snapshot().user_ids) == 5
+
+
+def test_compaction_keeps_live_rows(storage):
+    embeddings = random_embeddings(11)
+    storage.append([f'u{i}' for i in range(5)], embeddings[:5])
+    old = storage.snapshot()
+    storage.replace(['u0'], embeddings[10])
+    # The sixth dead row outnumbers the five live ones
+    for i in range(5):
+        storage.replace([f'u{i}'], embeddings[5 + i])
+
+    snapshot = storage.snapshot()
+    assert snapshot.generation == old.generation + 2
+    assert len(snapshot.user_ids) == 5
+    user_ids, matrix = storage.load()
+    assert sorted(user_ids) == [f'u{i}' for i in range(5)]
+    np.testing.assert_allclose(matrix[[user_ids.index(f'u{i}') for i in range(5)]], embeddings[5:10], atol=1e-6)
+    # The old snapshot stays readable after its files are replaced
+    np.testing.assert_allclose(old.matrix, embeddings[:5], atol=1e-6)
+    assert not os.path.exists(storage.matrix_path + '.tmp')
+
+
+def test_incremental_snapshot_after_compaction(storage):
+    storage.append([f'u{i}' for i in range(8)], random_embeddings(8))
+    old = storage.snapshot()
+    storage.remove([f'u{i}' for i in range(6)])
+
+    assert storage.snapshot(ids_start=old.ids_size, row_start=len(old.matrix), generation=old.generation) is None
+    assert storage.snapshot(ids_start=old.ids_size, row_start=len(old.matrix)) is None
+    assert storage.snapshot().user_ids == ['u6', 'u7']
+
+
+def test_room_index_follows_appends_and_compaction(storage):
+    embeddings = random_embeddings(12)
+    index = RoomIndex(storage)
+    index.refresh()
+    assert len(index) == 0
+
+    storage.append([f'u{i}' for i in range(6)], embeddings[:6])
+    assert index.refresh()
+    assert index.user_ids == [f'u{i}' for i in range(6)]
+    assert not index.refresh()
+
+    storage.replace(['u0'], embeddings[6])
+    index.refresh()
+    assert index.search(torch.from_numpy(embeddings[6]))[0][0] == 'u0'
+
+    storage.remove([f'u{i}' for i in range(1, 6)])
+    index.refresh()
+    assert index.user_ids == ['u0']
+    np.testing.assert_allclose(index.embeddings.numpy(), embeddings[6:7], atol=1e-6)
+
+
+def _write(room_path, worker, rounds):
+    storage = RoomStorage(room_path, min_compact_rows=8)
+    embeddings = random_embeddings(rounds, seed=worker)
+    for i in range(rounds):
+        user_id = f'w{worker}-{i % 4}'
+        if i % 3 == 2:
+            storage.remove([user_id])
+        else:
+            storage.replace([user_id], embeddings[i])
+
+
+def _read(room_path, rounds, errors):
+    storage = RoomStorage(room_path, min_compact_rows=8)
+    index = RoomIndex(storage)
+    try:
+        for _ in range(rounds):
+            index.refresh()
+            if index.embeddings is not None:
+                assert len(index.user_ids) == len(index.embeddings)
+                assert len(set(index.user_ids)) == len(index.user_ids)
+                np.testing.assert_allclose(np.linalg.norm(index.embeddings.numpy(), axis=1), 1, atol=1e-5)
+    except Exception as e:
+        errors.put(repr(e))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_concurrent_writers_and_readers(storage):
+    storage.append(['seed'], random_embeddings(1))
+    context = multiprocessing.get_context('fork')
+    errors = context.Queue()
+    writers = [context.Process(target=_write, args=(storage.room_path, worker, 150)) for worker in range(3)]
+    readers = [context.Process(target=_read, args=(storage.room_path, 400, errors)) for _ in range(2)]
+    for process in writers + readers:
+        process.start()
+    for process in writers + readers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert errors.empty(), errors.get()
+    user_ids, matrix = storage.load()
+    expected = {f'w{worker}-{user}' for worker in range(3) for user in range(4)}
+    # Every user's last operation decides whether it is live
+    for worker in range(3):
+        for user in range(4):
+            last = max(i for i in range(150) if i % 4 == user)
+            if last % 3 == 2:
+                expected.discard(f'w{worker}-{user}')
+    assert set(user_ids) == expected | {'seed'}
+    assert len(matrix) == len(user_ids)
+    with open(os.path.join(storage.room_path, IDS_FILENAME), 'rb') as f:
+        assert f.read().count(b'\n') == storage.read_header()[2]
+    assert os.path.exists(os.path.join(storage.room_path, MATRIX_FILENAME))
+
+
+def test_legacy_rooms_are_migrated_on_first_open(tmp_path):
+    from src.face_recognition.authorization_database import AuthorizationDatabase
+
+    room_path = tmp_path / 'room'
+    room_path.mkdir()
+    legacy_path = room_path / 'alice_emb.pt'
+    embedding = random_embeddings(1)
+    torch.save(torch.from_numpy(embedding), legacy_path)
+
+    database = AuthorizationDatabase(room_path=str(tmp_path))
+    assert database.list_users('room') == ['alice']
+    assert legacy_path.exists() and (room_path / MATRIX_FILENAME).exists()
+    assert database.authorize_users('room', torch.from_numpy(embedding))[0][:2] == (True, 'alice')
+
+
+def test_failed_legacy_migration_names_the_command(tmp_path, monkeypatch, capsys):
+    from src.face_recognition import authorization_database
+    from src.face_recognition.room_storage import migrate_legacy_room
+
+    room_path = tmp_path / 'room'
+    room_path.mkdir()
+    torch.save(torch.from_numpy(random_embeddings(1)), room_path / 'alice_emb.pt')
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('read-only')
+
+    monkeypatch.setattr(authorization_database, 'migrate_legacy_room', read_only)
+    database = authorization_database.AuthorizationDatabase(room_path=str(tmp_path))
+    assert database.list_users('room') == []
+    assert f'python -m src.face_recognition.room_storage {tmp_path}' in capsys.readouterr().out
+
+    assert migrate_legacy_room(str(room_path)) == 1
+    assert database.list_users('room') == ['alice']
+
+
+def test_interrupted_database_write_is_completed(tmp_path, monkeypatch):
+    from src.face_recognition.authorization_database import PENDING_FILENAME, AuthorizationDatabase
+    from src.face_recognition.templates import normalized_centroid
+
+    database = AuthorizationDatabase(room_path=str(tmp_path))
+    embeddings = random_embeddings(7)
+    database.add_users('room', ['a', 'b'], templates=[embeddings[:2], embeddings[2:4]])
+
+    # The new templates of 'a' are written, the write dies before its centroid is committed
+    replace = RoomStorage.replace
+
+    def crash(self, user_ids, rows):
+        if self.unique:
+            raise RuntimeError('crash')
+        replace(self, user_ids, rows)
+
+    monkeypatch.setattr(RoomStorage, 'replace', crash)
+    with pytest.raises(RuntimeError):
+        database.add_users('room', ['a'], replace=True, templates=[embeddings[4:6]])
+    monkeypatch.undo()
+    assert (tmp_path / 'room' / PENDING_FILENAME).exists()
+
+    database = AuthorizationDatabase(room_path=str(tmp_path))
+    database.add_users('room', ['c'], templates=[embeddings[6:]])
+    assert not (tmp_path / 'room' / PENDING_FILENAME).exists()
+    index = database.get_room_index('room')
+    assert sorted(index.user_ids) == ['a', 'b', 'c']
+    np.testing.assert_allclose(index.embeddings[index.user_ids.index('a')].numpy(), normalized_centroid(embeddings[4:6]), atol=1e-6)
+    np.testing.assert_allclose(database.get_template_store('room').get('a'), embeddings[4:6], atol=1e-6)